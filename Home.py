@@ -3,55 +3,50 @@ import logging
 from typing import Dict, Text, Any
 import json
 
-from pydantic_ai.messages import (
+import startup
+
+
+logging.basicConfig(level=logging.INFO)
+
+# Draw the chat input and sidebar before importing the agent, so a fresh 
+# worker shows the page while the rest of the app loads.
+user_input = st.chat_input()
+
+
+# Build the sidebar with quick actions.
+with st.sidebar:
+    st.title("Peloton Pal")
+    st.subheader("An AI project to build personalized Peloton workouts.")
+    st.divider()
+    st.caption("QUICK ACTIONS")
+
+    if st.button("Suggest a workout"):
+        user_input = "Suggest a workout"
+
+    if st.button("See Recent Workouts"):
+        user_input = "Describe my recent workouts"
+
+
+# Import and build what isn't needed until the first response in the 
+# background, then load the rest of the app.
+startup.load_env()
+startup.warm_up()
+
+from pydantic_ai.messages import (  # noqa: E402
     UserPrompt,
     ModelTextResponse
 )
-from peloton import PelotonAPI
-from agent import peloton_agent
-from schemas import UserWorkoutPreferences
-import asyncio
-from functools import wraps
-import nest_asyncio
-from concurrent.futures import ThreadPoolExecutor
-
-
-# Apply nest_asyncio to handle nested event loops from calling the agent run.
-nest_asyncio.apply()
-
-def async_handler():
-    """
-    Decorator to handle async functions in Streamlit.
-    Ensures proper event loop handling across threads.
-    """
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            loop = asyncio.new_event_loop()
-            executor = ThreadPoolExecutor(max_workers=1)
-            try:
-                asyncio.set_event_loop(loop)
-                future = asyncio.ensure_future(func(*args, **kwargs), loop=loop)
-                return loop.run_until_complete(future)
-            finally:
-                loop.close()
-                executor.shutdown(wait=True)
-        return wrapper
-    return decorator
-
-
-@async_handler()
-async def run_agent():
-    if st.session_state["last_response"]:
-            output = st.session_state["agent"].run_sync(user_input, message_history=st.session_state["last_response"].all_messages())
-    else:
-        output = st.session_state["agent"].run_sync(user_input)
-    
-    return output
+from service import RecommendationService  # noqa: E402
+from schemas import UserWorkoutPreferences  # noqa: E402
+from streaming import iterate  # noqa: E402
+import interface  # noqa: E402
+import telemetry  # noqa: E402
 
 
-
-logging.basicConfig(level=logging.INFO)
+@st.cache_resource()
+def load_service() -> RecommendationService:
+    """The clients, catalog and caches are shared by every session so one service is shared."""
+    return RecommendationService()
 
 
 @st.cache_data()
@@ -63,18 +58,7 @@ def load_goals() -> Dict[Text, Any]:
         return {}
 
 
-if "agent" not in st.session_state:
-    st.session_state["agent"] = peloton_agent
-    st.session_state["last_response"] = None
-    st.session_state["chat_history"] = []
-
-
-if "pelo_interface" not in st.session_state:
-    pelo = PelotonAPI()
-    pelo_auth = pelo.authenticate()
-    user_id = pelo_auth.json()['user_id']
-    st.session_state["pelo_interface"] = pelo
-    st.session_state["pelo_user_id"] = user_id
+service = load_service()
 
 
 if "user_preferences" not in st.session_state:
@@ -87,34 +71,30 @@ if "user_preferences" not in st.session_state:
     
     st.session_state["user_preferences"] = preferences
 
-user_input = st.chat_input()
-
 
-# Build the sidebar with quick actions.
-with st.sidebar:
-    st.title("Peloton Pal")
-    st.subheader("An AI project to build personalized Peloton workouts.")
-    st.divider()
-    st.caption("QUICK ACTIONS")
-
-    if st.button("Suggest a workout"):
-        user_input = "Suggest a workout"
-
-    if st.button("See Recent Workouts"):
-        user_input = "Describe my recent workouts"
-
-
-# Display the chat.
-if st.session_state["last_response"]:
-    for msg in st.session_state["last_response"].all_messages():
-        if isinstance(msg, UserPrompt):
-            content = msg.content
-            with st.chat_message("user"):
-                st.markdown(f'*:grey["{content}"]*')
-        elif isinstance(msg, ModelTextResponse):
-            content = msg.content
-            with st.chat_message("assistant"):
-                st.markdown(content)
+if "session" not in st.session_state:
+    # Sessions for the same account share one authenticated client, and the 
+    # workouts, instructors and new classes are fetched while the user types.
+    session = service.open_session(st.session_state["user_preferences"])
+    st.session_state["session"] = session
+    st.session_state["chat_history"] = []
+    # The other pages use the session's client and stores directly.
+    st.session_state["pelo_async"] = session.deps.api
+    st.session_state["pelo_user_id"] = session.deps.user_id
+    st.session_state["workout_history"] = service.history
+
+
+# Display the chat. The history sent to the agent is compacted, so the chat
+# is kept separately.
+for msg in st.session_state["chat_history"]:
+    if isinstance(msg, UserPrompt):
+        content = msg.content
+        with st.chat_message("user"):
+            st.markdown(f'*:grey["{content}"]*')
+    elif isinstance(msg, ModelTextResponse):
+        content = msg.content
+        with st.chat_message("assistant"):
+            st.markdown(content)
 
 
 if user_input:
@@ -123,11 +103,63 @@ if user_input:
     with st.chat_message("user"):
         st.markdown(f'*:grey["{user_input}"]*')
 
-        output = run_agent()
-        print(output.all_messages())
-
-        st.session_state["last_response"] = output
-    
-    with st.empty():
-        with st.chat_message("assistant"):
-            st.markdown(output.data)
+    # Stream the response, showing what the agent is doing until text arrives.
+    with st.chat_message("assistant"):
+        status = st.empty()
+        response = st.empty()
+        status.caption("Thinking...")
+
+        events = service.chat(
+            st.session_state["session"], user_input, preferences=st.session_state["user_preferences"]
+        )
+        for event in iterate(events):
+            if event.kind == "progress":
+                status.caption(f"{event.content}...")
+            elif event.kind == "text":
+                status.empty()
+                response.markdown(event.content)
+            elif event.kind == "done":
+                status.empty()
+                st.session_state["chat_history"].extend(
+                    msg for msg in event.content.new_messages()
+                    if isinstance(msg, (UserPrompt, ModelTextResponse))
+                )
+            elif event.kind == "error":
+                status.empty()
+                raise event.content
+
+
+# Show where the time of the last response went.
+with st.sidebar:
+    st.divider()
+    if st.toggle("Debug"):
+        trace = telemetry.last_trace(session=st.session_state["session"].id)
+        if trace:
+            trace_start = min(span.start for span in trace)
+            st.caption("LAST RESPONSE")
+            st.dataframe(
+                [
+                    {
+                        "kind": span.kind,
+                        "name": span.name,
+                        "start ms": round((span.start - trace_start) * 1000),
+                        "duration ms": round(span.duration * 1000, 1),
+                        "status": span.status,
+                        "attributes": json.dumps(span.attributes, default=str),
+                    }
+                    for span in sorted(trace, key=lambda span: span.start)
+                ],
+                hide_index=True
+            )
+
+        st.caption("CACHES")
+        cache_stats = interface.cache_stats()
+        cache_stats["summaries"] = service.summary_cache.stats()
+        cache_stats["ride_details"] = service.ride_cache.stats()
+        st.dataframe(
+            [{"cache": name, **stats} for name, stats in cache_stats.items()],
+            hide_index=True
+        )
+
+        with st.expander("Metrics"):
+            st.code(telemetry.prometheus_snapshot(), language="text")
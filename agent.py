@@ -1,156 +1,440 @@
-import json
+import asyncio
 import datetime
-import streamlit as st
-from openai import OpenAI
-from pydantic_ai import Agent
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from pydantic_ai import Agent, RunContext
 from schemas import (
-    RecentUserClasses,
     PelotonClass,
     UserWorkoutPreferences,
-    RecentUserSummary
+    RecentUserSummary,
+    WorkoutDigest,
+    WorkoutOption
 )
-from prompts import AGENT_SYSTEM_MSG, RECENT_WORKOUT_SUMMARY
+from prompts import AGENT_SYSTEM_MSG, RECENT_WORKOUT_SUMMARY, RECENT_WORKOUT_SUMMARY_VERSION
+from summary_cache import SummaryCache
+from ranking import rank_classes
+from solver import compose_workouts
+from analytics import build_digest, format_digest, DIGEST_DAYS
+from peloton import AsyncPelotonAPI
+from catalog import ClassCatalog
+from semantic_index import SemanticIndex, build_query
+from history import WorkoutHistory
+from streaming import AgentEvent
+from prompt_format import IdAliases, fit_classes, format_preferences
+from traced_model import TracedModel
 import interface
+import runtime
+import telemetry
 
 
+# Seconds the prefetched workouts, instructors and catalog are used for.
+PREFETCH_MAX_AGE = 5 * 60
+
+
+@dataclass
+class AgentDeps:
+    """Per-session dependencies for the agent tools.
+
+    Agent runs happen on the shared runtime loop, away from the Streamlit 
+    script thread, so the tools get everything from here rather than from 
+    `st.session_state`. One instance lives for the whole chat session so the 
+    candidate classes and class ID aliases carry over between turns.
+    """
+    api: AsyncPelotonAPI
+    user_id: str
+    preferences: UserWorkoutPreferences
+    catalog: ClassCatalog
+    history: WorkoutHistory
+    summary_cache: SummaryCache
+    available_classes: dict[str, PelotonClass] = field(default_factory=dict)
+    class_scores: dict[str, float] = field(default_factory=dict)
+    aliases: IdAliases = field(default_factory=IdAliases)
+    index: Optional[SemanticIndex] = None
+    events: Optional[queue.Queue] = None
+    _prefetch: Optional[Future] = field(default=None, repr=False)
+    _prefetched_at: float = 0.0
+
+    def progress(self, message: str) -> None:
+        """Reports what a tool is doing when the run is being streamed."""
+        if self.events is not None:
+            self.events.put_nowait(AgentEvent("progress", message))
+
+    def start_prefetch(self) -> None:
+        """Starts fetching the workout context on the shared runtime.
+
+        Called when the session starts so the workouts, instructors and 
+        catalog are ready by the time the user asks for a workout.
+        """
+        self._prefetch = runtime.submit(prefetch_context(self))
+        self._prefetched_at = time.time()
+
+    async def prefetched(self) -> Optional[Dict[str, str]]:
+        """Waits for the prefetch, starting a new one if there isn't a recent one.
+
+        Returns:
+            The instructor map, or None if it couldn't be fetched.
+        """
+        if self._prefetch is None or time.time() - self._prefetched_at > PREFETCH_MAX_AGE:
+            self.start_prefetch()
+        return await asyncio.wrap_future(self._prefetch)
+
+
+# The OpenAI model and client are built on first use, so importing the 
+# agent doesn't import openai or need the API key yet.
 peloton_agent = Agent(
-    'openai:gpt-4o-mini',
-    system_prompt=AGENT_SYSTEM_MSG
+    TracedModel('openai:gpt-4o-mini'),
+    system_prompt=AGENT_SYSTEM_MSG,
+    deps_type=AgentDeps
 )
 
 
-client = OpenAI()
+_client = None
+_client_lock = threading.Lock()
 
 
-@peloton_agent.tool_plain
-async def user_workout_preferences() -> UserWorkoutPreferences:
-    """Get the user workout preferences.
-    """
-    return st.session_state["user_preferences"]
+def get_client():
+    """Gets the OpenAI client for the summary completions, creating it on first use."""
+    global _client
 
+    with _client_lock:
+        if _client is None:
+            from openai import AsyncOpenAI
+            _client = AsyncOpenAI()
 
-@peloton_agent.tool_plain
-async def recent_user_workouts(user_preferences: UserWorkoutPreferences) -> list[RecentUserClasses]:
-    """Gets the recent Peloton classes the user has taken.
+    return _client
 
-    Recent user workouts can be used to determine the trend of user classes. Do not add classes to a workout from this list.
+
+def warm_up() -> None:
+    """Builds the OpenAI clients now rather than in the first agent run."""
+    # The summary completions' client.
+    get_client()
+    # The agent's model and its client.
+    peloton_agent.model.build()
+
+
+# Number of recent classes listed by title in the summary prompt.
+RECENT_TITLES = 5
+
+# Number of recent classes summarized and excluded from the available classes.
+RECENT_CLASSES = 30
+
+
+async def _sync_catalog(deps: AgentDeps) -> None:
+    """Syncs the catalog, then updates its columns and indexes any new classes."""
+    await deps.catalog.sync_if_stale(deps.api)
+    await asyncio.to_thread(deps.catalog.columns)
+    if deps.index is not None:
+        # Vectorizing is CPU bound, so keep it off the event loop.
+        await asyncio.to_thread(deps.index.update, deps.catalog)
+
+
+@telemetry.traced("internal")
+async def prefetch_context(deps: AgentDeps) -> Optional[Dict[str, str]]:
+    """Fetches everything the workout context needs from Peloton.
+
+    New workouts, the instructor list and new classes don't depend on each 
+    other so they are fetched concurrently.
+
+    Returns:
+        The instructor map, or None if it couldn't be fetched.
     """
-    response = interface.get_user_workouts(
-        st.session_state["pelo_interface"], 
-        st.session_state["pelo_user_id"]
+    results = await asyncio.gather(
+        deps.history.sync(deps.api, deps.user_id),
+        interface.get_instructor_list_async(deps.api),
+        _sync_catalog(deps),
+        return_exceptions=True
     )
 
-    # Get the instructor map to.
-    instructor_map = interface.get_instructor_list(st.session_state["pelo_interface"])
-
-    # Get important attributes from the classes.
-    recent_classes = []
-    test = []
-    for cl in response["data"][:30]:
-        if cl["peloton"]:
-            description = cl["peloton"]["ride"]["description"]
-            title = cl["peloton"]["ride"]["title"]
-            class_id = cl["peloton"]["ride"]["id"]
-            try:
-                instructor = instructor_map[cl["peloton"]["ride"]["instructor_id"]]
-            except KeyError:
-                instructor = ""
-        else:
-            description = cl["ride"]["title"]
-            title = cl["ride"]["title"]
-            instructor = cl["ride"]["instructor"]["name"]
-            class_id = cl["ride"]["id"]
-
-        user_class = RecentUserClasses(
-            id=class_id,
-            fitness_discipline=cl["fitness_discipline"],
-            name=cl["name"],
-            class_date=datetime.datetime.fromtimestamp(cl["start_time"]).strftime("%Y-%m-%d"),
-            description=description,
-            title=title,
-            instructor=instructor
-        )
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error(f'Error occurred prefetching the workout context. {result}')
 
-        # Convert to a string to include in the next query.
-        class_str = f"<class>{json.dumps(user_class.model_dump_json())}</class>"
+    instructor_map = results[1]
+    return instructor_map if isinstance(instructor_map, dict) else None
 
-        recent_classes.append(user_class)
-        test.append(class_str)
 
+def _workout_digest(
+        deps: AgentDeps,
+        user_preferences: UserWorkoutPreferences,
+        instructor_map: Optional[Dict[str, str]]
+    ) -> WorkoutDigest:
+    """Builds the digest of the user's stored workouts."""
+    workouts = deps.history.between(
+        deps.user_id,
+        start=datetime.date.today() - datetime.timedelta(days=DIGEST_DAYS - 1)
+    )
+    return build_digest(workouts, user_preferences, instructor_map)
+
+
+async def _summarize_recent_workouts(
+        deps: AgentDeps,
+        user_preferences: UserWorkoutPreferences,
+        instructor_map: Optional[Dict[str, str]],
+        digest: Optional[WorkoutDigest] = None
+    ) -> RecentUserSummary:
+    """Summarizes the user's stored workouts, reusing a cached summary if there is one."""
+    history = deps.history
+    user_id = deps.user_id
+
+    recent_classes = await asyncio.to_thread(history.recent, user_id, limit=RECENT_CLASSES)
+    if digest is None:
+        digest = await asyncio.to_thread(_workout_digest, deps, user_preferences, instructor_map)
+    workout_digest = format_digest(digest)
+
+    # Reuse the summary if the recent classes, digest and preferences haven't changed.
+    summary_cache = deps.summary_cache
+    cache_key = SummaryCache.key(
+        [cl["ride_id"] for cl in recent_classes],
+        user_preferences,
+        RECENT_WORKOUT_SUMMARY_VERSION,
+        workout_digest
+    )
+    cached_summary = await asyncio.to_thread(summary_cache.get, cache_key)
+    if cached_summary is not None:
+        return cached_summary
+
+    # The last few classes by title, the digest covers the rest.
+    recent_titles = "\n".join(
+        f"{datetime.datetime.fromtimestamp(cl['start_time']).strftime('%Y-%m-%d')} "
+        f"{cl['fitness_discipline']}: {cl['title']}"
+        for cl in recent_classes[:RECENT_TITLES]
+    )
 
+    deps.progress("Summarizing your recent workouts")
     pr = RECENT_WORKOUT_SUMMARY.format(
-        RECENT_USER_CLASSES=json.dumps(test),
+        WORKOUT_DIGEST=workout_digest,
+        RECENT_USER_CLASSES=recent_titles,
         USER_PREFERENCES=f"Fitness goals: {user_preferences.fitness_goals}"
     )
 
-    chat_completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "user",
-                "content": pr
-            }
-        ]
-    )
+    with telemetry.span("summary gpt-4o-mini", kind="llm") as span:
+        chat_completion = await get_client().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {
+                    "role": "user",
+                    "content": pr
+                }
+            ]
+        )
+        if chat_completion.usage is not None:
+            span.set(
+                prompt_tokens=chat_completion.usage.prompt_tokens,
+                completion_tokens=chat_completion.usage.completion_tokens
+            )
 
     summary = RecentUserSummary(
-        recent_class_ids=[cl.id for cl in recent_classes],
+        recent_class_ids=[cl["ride_id"] for cl in recent_classes],
         summary=chat_completion.choices[0].message.content
     )
+    await asyncio.to_thread(summary_cache.put, cache_key, summary)
 
     return summary
 
 
-@peloton_agent.tool_plain
-async def get_available_classes(recent_classes: RecentUserSummary) -> list[PelotonClass]:
-    """Gets the list of available Peloton classes to choose from.
+def _rank_available_classes(
+        deps: AgentDeps,
+        exclude_ids: list[str],
+        digest: Optional[WorkoutDigest] = None
+    ) -> list[PelotonClass]:
+    """Ranks the catalog for the user and keeps the candidates in `deps`.
 
-    Args:
-        recent_classes: list of recent classes taken by the user that will be excluded from the available classes.
-
-    Classes for a workout should be selected from this list of available classes.
+    Runs on a worker thread, so it doesn't report progress.
     """
-    # all_class_data = json.load(open("available_classes.json", "r"))
-    all_class_data = interface.get_available_classes(st.session_state["pelo_interface"])
-
-    # Create a lookup for the instructors.
-    instructors = {i['id']: i['name'] for i in all_class_data['instructors']}
-
-    # List of IDs to remove.
-    # exclude_recent_classes = [cl for cl in recent_classes.recent_class_ids]
+    all_class_data = rank_classes(
+        deps.catalog,
+        deps.preferences,
+        exclude_ids=exclude_ids,
+        index=deps.index,
+        query=build_query(
+            deps.preferences.fitness_goals,
+            digest.goal_gaps if digest is not None else None
+        )
+    )
 
     available_classes = []
-    for cl in all_class_data["data"][:50]:
-        if cl["id"] in recent_classes.recent_class_ids:
-            continue
-
+    for cl in all_class_data:
         pelo_class = PelotonClass(
             id=cl["id"],
             title=cl["title"],
             description=cl["description"],
-            duration=cl["duration"]/60,
-            difficulty=cl["difficulty_rating_avg"],
+            duration=cl["duration"] // 60,
+            difficulty=cl["difficulty"],
             fitness_discipline=cl["fitness_discipline"],
-            instructor=instructors[cl['instructor_id']]
+            instructor=cl["instructor"]
         )
         available_classes.append(pelo_class)
-    
+
+    # Keep the candidates so workouts can be composed from them.
+    deps.available_classes = {cl.id: cl for cl in available_classes}
+    deps.class_scores = {cl["id"]: cl["score"] for cl in all_class_data}
+
     return available_classes
 
 
-@peloton_agent.tool_plain
-async def add_class_to_stack(class_ids: list[str]) -> bool:
-    """Adds classes to the user's stack.
+async def stack_classes(deps: AgentDeps, class_ids: list[str], append: bool = True) -> dict[str, bool]:
+    """Adds classes to the user's stack by their aliases or IDs.
+
+    Returns:
+        Whether each class ID was added to the stack.
+    """
+    aliases = deps.aliases
+    ride_ids = {class_id: aliases.resolve(class_id) for class_id in class_ids}
+    stacked = await deps.api.stack_classes(list(ride_ids.values()), append=append)
+
+    return {class_id: stacked.get(ride_id, False) for class_id, ride_id in ride_ids.items()}
+
+
+async def summarize_history(deps: AgentDeps) -> RecentUserSummary:
+    """Summarizes the user's recent workouts, as `recent_user_workouts` does for the agent."""
+    instructor_map = await deps.prefetched()
+
+    return await _summarize_recent_workouts(deps, deps.preferences, instructor_map)
+
+
+@peloton_agent.tool
+@telemetry.traced("tool")
+async def workout_context(ctx: RunContext[AgentDeps]) -> str:
+    """Gets everything needed to build a workout in one call.
+
+    Returns the user workout preferences, a summary of the user's recent 
+    workouts and the available classes to choose from. Use this instead of 
+    calling user_workout_preferences, recent_user_workouts and 
+    get_available_classes one after another.
+    """
+    ctx.deps.progress("Fetching your workouts and classes")
+    # Usually already done, the fetches start with the session.
+    instructor_map = await ctx.deps.prefetched()
+
+    preferences = ctx.deps.preferences
+    # pandas, NumPy and SQLite work, so keep it off the loop every session shares.
+    recent_classes = await asyncio.to_thread(
+        ctx.deps.history.recent, ctx.deps.user_id, limit=RECENT_CLASSES
+    )
+    recent_class_ids = [cl["ride_id"] for cl in recent_classes]
+    digest = await asyncio.to_thread(_workout_digest, ctx.deps, preferences, instructor_map)
+    ctx.deps.progress("Ranking classes")
+    available_classes = await asyncio.to_thread(
+        _rank_available_classes, ctx.deps, exclude_ids=recent_class_ids, digest=digest
+    )
+    recent_workouts = await _summarize_recent_workouts(ctx.deps, preferences, instructor_map, digest=digest)
+
+    table, count = fit_classes(available_classes, ctx.deps.aliases)
+
+    return (
+        f"Preferences:\n{format_preferences(preferences)}\n\n"
+        f"Recent workouts:\n{recent_workouts.summary}\n\n"
+        f"Available classes, best first ({count} of {len(available_classes)}):\n{table}"
+    )
+
+
+@peloton_agent.tool
+@telemetry.traced("tool")
+async def user_workout_preferences(ctx: RunContext[AgentDeps]) -> UserWorkoutPreferences:
+    """Get the user workout preferences.
+    """
+    return ctx.deps.preferences
+
+
+@peloton_agent.tool
+@telemetry.traced("tool")
+async def recent_user_workouts(ctx: RunContext[AgentDeps], user_preferences: UserWorkoutPreferences) -> RecentUserSummary:
+    """Gets the recent Peloton classes the user has taken.
+
+    Recent user workouts can be used to determine the trend of user classes. Do not add classes to a workout from this list.
+    """
+    ctx.deps.progress("Fetching your recent workouts")
+    instructor_map = await ctx.deps.prefetched()
+
+    return await _summarize_recent_workouts(ctx.deps, user_preferences, instructor_map)
+
+
+@peloton_agent.tool
+@telemetry.traced("tool")
+async def get_available_classes(ctx: RunContext[AgentDeps], recent_classes: RecentUserSummary) -> str:
+    """Gets the list of available Peloton classes to choose from.
+
+    Args:
+        recent_classes: list of recent classes taken by the user that will be excluded from the available classes.
+
+    Classes for a workout should be selected from this list of available classes. 
+    The classes already match the user's excluded classes and duration 
+    preference and are ordered from the best fit to the worst.
+    """
+    # Pick up any classes released since the last sync, then query locally.
+    ctx.deps.progress("Checking for new classes")
+    await ctx.deps.prefetched()
+
+    ctx.deps.progress("Ranking classes")
+    available_classes = await asyncio.to_thread(
+        _rank_available_classes, ctx.deps, exclude_ids=recent_classes.recent_class_ids
+    )
+    table, _ = fit_classes(available_classes, ctx.deps.aliases)
+
+    return table
+
+
+@peloton_agent.tool
+@telemetry.traced("tool")
+async def compose_workout(
+    ctx: RunContext[AgentDeps],
+    class_ids: Optional[list[str]] = None,
+    total_duration: Optional[int] = None
+) -> list[WorkoutOption]:
+    """Finds combinations of available classes that add up to the workout duration.
+
+    Use this after getting the available classes instead of adding up class 
+    durations. Each workout adds up to exactly the total duration and the 
+    workouts are ordered from the best fit to the worst.
+
+    Args:
+        class_ids: IDs of the available classes to choose from. Leave empty to use all the available classes.
+        total_duration: The workout duration in minutes. Defaults to the user's duration preference.
+    """
+    ctx.deps.progress("Building workouts")
+    aliases = ctx.deps.aliases
+    available_classes = ctx.deps.available_classes
+    if class_ids:
+        class_ids = [aliases.resolve(class_id) for class_id in class_ids]
+        candidates = [available_classes[class_id] for class_id in class_ids if class_id in available_classes]
+    else:
+        candidates = list(available_classes.values())
+
+    preferences = ctx.deps.preferences
+
+    workouts = compose_workouts(
+        candidates,
+        total_duration or preferences.preferred_duration_minutes,
+        fitness_goals=preferences.fitness_goals,
+        favorite_instructors=preferences.favorite_instructors,
+        class_scores=ctx.deps.class_scores
+    )
+
+    # Refer to the classes by the same aliases as the available classes.
+    return [
+        workout.model_copy(update={"class_ids": [aliases.alias(class_id) for class_id in workout.class_ids]})
+        for workout in workouts
+    ]
+
+
+@peloton_agent.tool
+@telemetry.traced("tool")
+async def add_class_to_stack(ctx: RunContext[AgentDeps], class_ids: list[str], append: bool = True) -> dict[str, bool]:
+    """Adds classes to the user's stack and reports whether each class ID was added.
 
     This is after the user gets recommended classes by using the 
     ID of the class.
 
     Args:
         class_ids: the class IDs of the recommended classes.
+        append: keep the classes already in the user's stack and add the 
+            recommended classes after them. Set to False to replace the stack.
     """
-    for class_id in class_ids:
-        join_token = st.session_state["pelo_interface"].convert_ride_to_class_id(class_id)
-
-        success = st.session_state["pelo_interface"].stack_class(join_token)
+    ctx.deps.progress("Adding classes to your stack")
 
-    return success
+    return await stack_classes(ctx.deps, class_ids, append=append)
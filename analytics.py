@@ -0,0 +1,160 @@
+"""Deterministic analytics over a user's workout history.
+
+Turns the stored workouts into a compact `WorkoutDigest` with vectorized
+pandas operations: minutes per discipline per week, the intensity trend,
+rest days, the instructor mix and the fitness goals that aren't being
+worked on. The digest replaces the raw classes in the summary prompt and
+can be shown in the UI without a completion.
+"""
+
+import datetime
+from typing import Any, Dict, Optional, Text
+
+import numpy as np
+
+from ranking import discipline_slugs
+from schemas import UserWorkoutPreferences, WorkoutDigest
+
+
+# Days of workout history covered by the digest.
+DIGEST_DAYS = 28
+
+# Number of instructors listed in the digest.
+TOP_INSTRUCTORS = 5
+
+
+def build_digest(
+        workouts: list[Dict[Text, Any]],
+        preferences: UserWorkoutPreferences,
+        instructor_map: Optional[Dict[Text, Text]] = None,
+        period_days: int = DIGEST_DAYS,
+        today: Optional[datetime.date] = None
+    ) -> WorkoutDigest:
+    """Summarizes the workouts from the last `period_days` days.
+
+    Args:
+        workouts: Workouts from `WorkoutHistory.between`.
+        preferences: The user workout preferences.
+        instructor_map: Instructor names keyed by instructor ID, for 
+            workouts that only have the ID.
+        period_days: Days of workout history covered by the digest.
+        today: The last day of the period. Defaults to today.
+
+    Returns:
+        The digest of the workouts.
+    """
+    # pandas is slow to import and only needed here, so it's imported on first use.
+    import pandas as pd
+    from dateutil.tz import tzlocal
+
+    today = today or datetime.date.today()
+    period_start = pd.Timestamp(today - datetime.timedelta(days=period_days - 1))
+
+    df = pd.DataFrame(
+        workouts,
+        columns=["start_time", "fitness_discipline", "instructor_id", "instructor", "duration", "difficulty"]
+    )
+    # Bucket by the local date, like `today` and `WorkoutHistory.between`.
+    df["date"] = (
+        pd.to_datetime(df["start_time"], unit="s", utc=True)
+        .dt.tz_convert(tzlocal())
+        .dt.tz_localize(None)
+        .dt.normalize()
+    )
+    df = df[(df["date"] >= period_start) & (df["date"] <= pd.Timestamp(today))]
+
+    if df.empty:
+        return WorkoutDigest(
+            period_days=period_days,
+            total_workouts=0,
+            total_minutes=0,
+            weekly_minutes={},
+            discipline_minutes={},
+            rest_days=period_days,
+            instructor_counts={},
+            goal_gaps=list(preferences.fitness_goals or [])
+        )
+
+    df["minutes"] = df["duration"] / 60
+    df["week"] = (df["date"] - pd.to_timedelta(df["date"].dt.weekday, unit="D")).dt.strftime("%Y-%m-%d")
+
+    weekly = df.pivot_table(
+        index="week", columns="fitness_discipline", values="minutes", aggfunc="sum", fill_value=0
+    ).round(1)
+    discipline_minutes = df.groupby("fitness_discipline")["minutes"].sum().round(1)
+
+    # Intensity trend is the slope of a line through the class difficulty over time.
+    rated = df.dropna(subset=["difficulty"])
+    average_difficulty = None
+    intensity_trend = None
+    if not rated.empty:
+        average_difficulty = round(float(rated["difficulty"].mean()), 2)
+        days = (rated["date"] - period_start).dt.days.to_numpy(dtype=float)
+        if np.unique(days).size > 1:
+            slope = np.polyfit(days, rated["difficulty"].to_numpy(dtype=float), 1)[0]
+            # A flat trend can round to -0.0, which would render as "-0".
+            intensity_trend = round(float(slope * 7), 2) or 0.0
+
+    instructor_map = instructor_map or {}
+    # `where` rather than fillna, which warns about downcasting when no
+    # workout has an instructor name.
+    instructors = df["instructor"].where(
+        df["instructor"].notna(), df["instructor_id"].map(instructor_map)
+    )
+    instructor_counts = instructors.replace("", np.nan).dropna().value_counts().head(TOP_INSTRUCTORS)
+
+    goal_gaps = [
+        goal for goal in preferences.fitness_goals or []
+        if not discipline_minutes.index.isin(discipline_slugs([goal])).any()
+    ]
+
+    last_workout = df["date"].max().date()
+
+    return WorkoutDigest(
+        period_days=period_days,
+        total_workouts=len(df),
+        total_minutes=round(float(df["minutes"].sum()), 1),
+        weekly_minutes={week: row[row > 0].to_dict() for week, row in weekly.iterrows()},
+        discipline_minutes=discipline_minutes.sort_values(ascending=False).to_dict(),
+        average_difficulty=average_difficulty,
+        intensity_trend=intensity_trend,
+        rest_days=period_days - df["date"].nunique(),
+        days_since_last_workout=(today - last_workout).days,
+        instructor_counts=instructor_counts.to_dict(),
+        goal_gaps=goal_gaps
+    )
+
+
+def format_digest(digest: WorkoutDigest) -> str:
+    """Renders the digest as compact text for a prompt."""
+    lines = [
+        f"Last {digest.period_days} days: {digest.total_workouts} workouts, "
+        f"{digest.total_minutes:g} min, {digest.rest_days} rest days"
+    ]
+
+    if digest.days_since_last_workout is not None:
+        lines.append(f"Days since last workout: {digest.days_since_last_workout}")
+
+    if digest.discipline_minutes:
+        lines.append("Minutes by discipline: " + ", ".join(
+            f"{discipline} {minutes:g}" for discipline, minutes in digest.discipline_minutes.items()
+        ))
+
+    for week, minutes in digest.weekly_minutes.items():
+        lines.append(f"Week of {week}: " + ", ".join(
+            f"{discipline} {value:g}" for discipline, value in minutes.items()
+        ))
+
+    if digest.average_difficulty is not None:
+        trend = "" if digest.intensity_trend is None else f", trend {digest.intensity_trend:+g}/week"
+        lines.append(f"Average difficulty: {digest.average_difficulty:g}/10{trend}")
+
+    if digest.instructor_counts:
+        lines.append("Instructors: " + ", ".join(
+            f"{name} {count}" for name, count in digest.instructor_counts.items()
+        ))
+
+    if digest.goal_gaps:
+        lines.append("Goals with no workouts: " + ", ".join(digest.goal_gaps))
+
+    return "\n".join(lines)
@@ -0,0 +1,213 @@
+"""Shared, persisted Peloton sessions.
+
+Logging in is the first request every new Streamlit session used to make.
+`SessionManager` keeps one authenticated pair of clients per Peloton
+account for the whole process and saves the session cookies to disk, so
+new sessions and app restarts reuse them without a login request. When a
+saved session has expired the clients get a 401, authenticate again on
+their own and the new cookies are saved.
+
+A shared or saved session is only handed out for the password it was
+created with. A salted hash of the password is kept with the session and
+any other password has to log in to Peloton first.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional, Text
+
+from requests.cookies import create_cookie
+
+import storage
+from peloton import PelotonAPI, AsyncPelotonAPI
+
+
+# PBKDF2 iterations of the password hashes kept with the sessions.
+PASSWORD_HASH_ITERATIONS = 100_000
+
+
+@dataclass
+class PelotonSession:
+    """An authenticated Peloton account shared across Streamlit sessions."""
+    username: str
+    user_id: str
+    api: PelotonAPI
+    async_api: AsyncPelotonAPI
+    password_hash: Dict[Text, str] = field(default_factory=dict, repr=False)
+
+
+def _hash_password(password: str, salt: Optional[bytes] = None) -> Dict[Text, str]:
+    """Hashes a password with a new salt, or with `salt` to check it."""
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PASSWORD_HASH_ITERATIONS)
+    return {"salt": salt.hex(), "hash": digest.hex()}
+
+
+def _check_password(password: str, password_hash: Optional[Dict[Text, str]]) -> bool:
+    """Checks a password against a hash from `_hash_password`."""
+    if not password_hash:
+        return False
+    expected = _hash_password(password, bytes.fromhex(password_hash["salt"]))
+    return hmac.compare_digest(expected["hash"], password_hash["hash"])
+
+
+def _serialize_cookies(jar) -> list[Dict[Text, Any]]:
+    return [
+        {
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "expires": cookie.expires,
+            "secure": cookie.secure,
+        }
+        for cookie in jar
+    ]
+
+
+class SessionManager:
+    """Creates and shares one `PelotonSession` per Peloton account.
+
+    Args:
+        ride_cache: Optional `RideDetailCache` for the async clients.
+        reference_data: Optional `ReferenceDataStore` for the async clients.
+        session_dir: Directory the session cookies are saved in. Defaults to
+            `sessions` in the cache directory.
+    """
+
+    def __init__(
+            self,
+            ride_cache: Optional[Any] = None,
+            reference_data: Optional[Any] = None,
+            session_dir: Optional[Path] = None
+        ):
+
+        self.ride_cache = ride_cache
+        self.reference_data = reference_data
+        self.session_dir = Path(session_dir or storage.CACHE_DIR / "sessions")
+        self._sessions = {}
+        # Guards `_account_locks` only. Logins hold their account's lock, so
+        # a slow login doesn't hold up the other accounts.
+        self._lock = threading.Lock()
+        self._account_locks = {}
+
+    def _account_lock(self, account: str) -> threading.Lock:
+        with self._lock:
+            return self._account_locks.setdefault(account, threading.Lock())
+
+    def _session_path(self, username: str) -> Path:
+        digest = hashlib.sha256(username.lower().encode()).hexdigest()
+        return self.session_dir / f"{digest}.json"
+
+    def _save(self, username: str, user_id: str, jar, password_hash: Dict[Text, str]) -> None:
+        """Saves the session cookies so they can be reused after a restart."""
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        path = self._session_path(username)
+
+        # The cookies are credentials, so only the owner can read them.
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                "user_id": user_id,
+                "password_hash": password_hash,
+                "cookies": _serialize_cookies(jar)
+            }, f)
+
+    def _load(self, username: str) -> Optional[Dict[Text, Any]]:
+        try:
+            with open(self._session_path(username), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _create(self, username: str, password: str) -> PelotonSession:
+        """Restores the saved session for the account if the password matches, or logs in.
+
+        Raises:
+            requests.HTTPError: The login failed, i.e. the password is wrong.
+        """
+        saved = self._load(username)
+        if saved and not _check_password(password, saved.get("password_hash")):
+            # Saved for another password, or before passwords were checked.
+            saved = None
+        user_id = saved["user_id"] if saved else None
+        password_hash = saved["password_hash"] if saved else _hash_password(password)
+
+        def on_authenticate(jar) -> None:
+            # Keep both clients and the saved session on the newest cookies.
+            for cookie in jar:
+                api.sess.cookies.set_cookie(cookie)
+            async_api.update_cookies(jar)
+            self._save(username, user_id, jar, password_hash)
+
+        api = PelotonAPI(username=username, password=password)
+        async_api = AsyncPelotonAPI(
+            ride_cache=self.ride_cache,
+            reference_data=self.reference_data,
+            username=username,
+            password=password
+        )
+
+        if saved:
+            cookies = [create_cookie(**cookie) for cookie in saved["cookies"]]
+            for cookie in cookies:
+                api.sess.cookies.set_cookie(cookie)
+            async_api.update_cookies(cookies)
+        else:
+            response = api.authenticate()
+            response.raise_for_status()
+            user_id = response.json()["user_id"]
+            self._save(username, user_id, api.sess.cookies, password_hash)
+            async_api.update_cookies(api.sess.cookies)
+
+        api.on_authenticate = on_authenticate
+        async_api.on_authenticate = on_authenticate
+
+        return PelotonSession(
+            username=username,
+            user_id=user_id,
+            api=api,
+            async_api=async_api,
+            password_hash=password_hash
+        )
+
+    def get(self, username: Optional[str] = None, password: Optional[str] = None) -> PelotonSession:
+        """Gets the shared session for a Peloton account.
+
+        The shared session is only returned for the password it was created 
+        with. For any other password this logs in, and replaces the shared 
+        session if the login succeeds.
+
+        Args:
+            username: The Peloton username or email. Defaults to `PELOTON_USER`.
+            password: The Peloton password. Defaults to `PELOTON_PASS`.
+
+        Returns:
+            The authenticated session for the account.
+
+        Raises:
+            requests.HTTPError: The login failed, i.e. the password is wrong.
+        """
+        if username is None:
+            username = os.environ["PELOTON_USER"]
+            password = password or os.environ["PELOTON_PASS"]
+        elif password is None:
+            raise ValueError("A password is needed for any account other than PELOTON_USER.")
+
+        # Usernames and emails aren't case sensitive, so neither are the
+        # shared and saved sessions.
+        account = username.lower()
+        with self._account_lock(account):
+            session = self._sessions.get(account)
+            if session is None or not _check_password(password, session.password_hash):
+                logging.info("Creating a Peloton session.")
+                session = self._create(username, password)
+                self._sessions[account] = session
+
+            return session
@@ -0,0 +1,9 @@
+"""Offline benchmarks for the recommendation flow.
+
+The benchmarks run the agent against `mock_peloton`, a local server that
+replays recorded Peloton and OpenAI responses with injected latency, and a
+scripted model from `scripted_model`, so no live service is called. Run
+them from the repository root with:
+
+    python -m benchmarks.run
+"""
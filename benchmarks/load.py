@@ -0,0 +1,312 @@
+"""Concurrent-session load test of the recommendation flow.
+
+Simulated users each open a session on their own Peloton account and go
+through the flow a user takes in the app: open the preferences page (the
+instructor list), ask for a workout and add it to the stack. Every user
+runs on its own thread like a Streamlit script thread, so the shared
+runtime loop, the module level agent and clients and the caches are used
+concurrently the way they are in a running app.
+
+The test steps through increasing numbers of concurrent users against one
+deployment. For every level it reports the p50/p95/p99 latency of each
+step and of the whole flow, the throughput, the memory retained per
+session and the hit ratios of the caches.
+
+    python -m benchmarks.load --concurrency 1 4 16 32 --flows 2
+"""
+
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional, Text
+
+from benchmarks.recording import Recording, synthetic
+from benchmarks.run import SCENARIOS, Deployment, deploy, open_session, stream_turn
+from benchmarks.scripted_model import ScriptedModel
+
+
+STEPS = ["preferences", "suggest", "stack", "flow"]
+
+
+@dataclass
+class LevelResult:
+    """Measurements of one concurrency level."""
+    users: int
+    flows: int
+    errors: int
+    seconds: float
+    latencies: Dict[Text, list[float]] = field(default_factory=dict)
+    http_calls: Dict[Text, int] = field(default_factory=dict)
+    cache_stats: Dict[Text, Dict[Text, Any]] = field(default_factory=dict)
+    memory_per_session: Optional[float] = None
+    peak_memory: Optional[float] = None
+
+    @property
+    def throughput(self) -> float:
+        """Completed flows per second."""
+        return self.flows / self.seconds if self.seconds else 0.0
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    """Gets the `p`th percentile, interpolating between the closest values."""
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _rss_bytes() -> Optional[int]:
+    """Gets the resident memory of the process, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cache_stats(deployment: Deployment) -> Dict[Text, Dict[Text, Any]]:
+    import interface
+
+    stats = interface.cache_stats()
+    stats["summaries"] = deployment.summary_cache.stats()
+    stats["ride_details"] = deployment.ride_cache.stats()
+    return stats
+
+
+def _stats_delta(
+        before: Dict[Text, Dict[Text, Any]],
+        after: Dict[Text, Dict[Text, Any]]
+    ) -> Dict[Text, Dict[Text, Any]]:
+    """Gets the hits and misses between two `_cache_stats` snapshots."""
+    delta = {}
+    for name, stats in after.items():
+        hits = stats["hits"] - before[name]["hits"]
+        misses = stats["misses"] - before[name]["misses"]
+        delta[name] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        }
+    return delta
+
+
+def simulate_user(deployment: Deployment, username: str, flows: int, sessions: list) -> tuple[Dict[Text, list[float]], int]:
+    """Runs the flows of one user in a new session.
+
+    The session is added to `sessions` when the user is done, standing in
+    for `st.session_state` holding it until the browser tab is closed.
+
+    Returns:
+        The latencies of each step and the number of flows that failed.
+    """
+    import interface
+    import runtime
+    from compaction import compact_messages
+
+    latencies = defaultdict(list)
+    errors = 0
+
+    deps = open_session(deployment, username)
+    message_history = None
+
+    for _ in range(flows):
+        flow_start = time.perf_counter()
+        try:
+            start = time.perf_counter()
+            runtime.run(interface.get_instructor_list_async(deps.api))
+            latencies["preferences"].append(time.perf_counter() - start)
+
+            result, seconds, _ = stream_turn(deps, SCENARIOS["suggest"], message_history)
+            latencies["suggest"].append(seconds)
+
+            result, seconds, _ = stream_turn(
+                deps, SCENARIOS["stack"], compact_messages(result.all_messages())
+            )
+            latencies["stack"].append(seconds)
+            message_history = compact_messages(result.all_messages())
+        except Exception as err:
+            logging.error(f'Error occurred in the flow of {username}. {err}')
+            errors += 1
+            continue
+
+        latencies["flow"].append(time.perf_counter() - flow_start)
+
+    sessions.append((deps, message_history))
+
+    return latencies, errors
+
+
+def run_level(deployment: Deployment, users: int, flows: int, first_user: int = 0) -> LevelResult:
+    """Runs `users` simulated users concurrently, each on a new account.
+
+    Args:
+        deployment: The deployment every user shares.
+        users: Number of concurrent users.
+        flows: Flows each user goes through.
+        first_user: Number of the first user's account, so every level can
+            use new accounts.
+    """
+    sessions = []
+    gc.collect()
+    rss_before = _rss_bytes()
+    stats_before = _cache_stats(deployment)
+    deployment.mock.reset_calls()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        outcomes = list(pool.map(
+            lambda user: simulate_user(deployment, f"loadtest-{user}", flows, sessions),
+            range(first_user, first_user + users)
+        ))
+    seconds = time.perf_counter() - start
+
+    gc.collect()
+    rss_after = _rss_bytes()
+
+    latencies = defaultdict(list)
+    for user_latencies, _ in outcomes:
+        for step, values in user_latencies.items():
+            latencies[step].extend(values)
+
+    return LevelResult(
+        users=users,
+        flows=len(latencies["flow"]),
+        errors=sum(errors for _, errors in outcomes),
+        seconds=seconds,
+        latencies=dict(latencies),
+        http_calls=deployment.mock.reset_calls(),
+        cache_stats=_stats_delta(stats_before, _cache_stats(deployment)),
+        memory_per_session=(
+            (rss_after - rss_before) / users if rss_before is not None and rss_after is not None else None
+        ),
+        peak_memory=_peak_rss_bytes()
+    )
+
+
+def run(
+        recording: Recording,
+        concurrency: list[int],
+        flows: int = 2,
+        warmup: bool = True,
+        latency: float = 0.05,
+        llm_latency: float = 0.5,
+        model_latency: float = 0.5
+    ) -> list[LevelResult]:
+    """Steps through the concurrency levels against one deployment.
+
+    Args:
+        recording: The Peloton data the mock serves.
+        concurrency: Number of concurrent users of each level.
+        flows: Flows each user goes through.
+        warmup: Run one user first so the catalog sync and index build
+            aren't part of the first level.
+        latency: Seconds added to every Peloton response.
+        llm_latency: Seconds added to every summary completion.
+        model_latency: Seconds before the first token of every model turn.
+    """
+    deployment = deploy(recording, latency, llm_latency)
+    model = ScriptedModel(latency=model_latency)
+
+    from agent import peloton_agent
+
+    results = []
+    try:
+        with peloton_agent.override(model=model.model()):
+            if warmup:
+                simulate_user(deployment, "loadtest-warmup", 1, [])
+
+            first_user = 0
+            for users in concurrency:
+                results.append(run_level(deployment, users, flows, first_user))
+                first_user += users
+    finally:
+        deployment.mock.stop()
+
+    return results
+
+
+def _format(value: Optional[float], scale: float = 1.0, digits: int = 3) -> str:
+    return "-" if value is None else f"{value * scale:.{digits}f}"
+
+
+def report(results: list[LevelResult]) -> str:
+    """Renders the throughput, memory and cache hit ratios, then the latencies of each level."""
+    cache_names = sorted({name for result in results for name in result.cache_stats})
+    summary = [
+        f"{'users':>6}{'flows':>7}{'errors':>8}{'flows/s':>9}{'http/flow':>11}"
+        f"{'MB/session':>12}{'peak MB':>9}"
+        + "".join(f"{name + ' hit':>18}" for name in cache_names)
+    ]
+    latency_lines = [f"{'users':>6}  {'step':<12}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'max s':>8}"]
+
+    for result in results:
+        summary.append(
+            f"{result.users:>6}{result.flows:>7}{result.errors:>8}{result.throughput:>9.2f}"
+            f"{_format(sum(result.http_calls.values()) / result.flows if result.flows else None, digits=1):>11}"
+            f"{_format(result.memory_per_session, 1 / 2 ** 20, 2):>12}"
+            f"{_format(result.peak_memory, 1 / 2 ** 20, 0):>9}"
+            + "".join(
+                f"{_format(result.cache_stats[name]['hit_ratio'], digits=2):>18}"
+                for name in cache_names
+            )
+        )
+        for step in STEPS:
+            values = result.latencies.get(step, [])
+            latency_lines.append(
+                f"{result.users:>6}  {step:<12}"
+                + "".join(f"{_format(percentile(values, p)):>8}" for p in (50, 95, 99, 100))
+            )
+
+    return "\n".join(summary) + "\n\n" + "\n".join(latency_lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the recommendation flow with concurrent sessions.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="Concurrent users of each level.")
+    parser.add_argument("--flows", type=int, default=2, help="Flows each user goes through.")
+    parser.add_argument("--no-warmup", action="store_true", help="Include the first catalog sync in the first level.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to each Peloton response.")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds added to each summary completion.")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Seconds before each model turn responds.")
+    parser.add_argument("--recording", help="Recording to replay. Defaults to synthetic data.")
+    parser.add_argument("--rides", type=int, default=5000, help="Classes in the synthetic recording.")
+    parser.add_argument("--workouts", type=int, default=300, help="Workouts in the synthetic recording.")
+    parser.add_argument("--json", help="Also write every measurement to this file.")
+    args = parser.parse_args()
+
+    recording = (
+        Recording.load(args.recording) if args.recording
+        else synthetic(num_rides=args.rides, num_workouts=args.workouts)
+    )
+    results = run(
+        recording, args.concurrency, args.flows, not args.no_warmup,
+        args.latency, args.llm_latency, args.model_latency
+    )
+
+    print(report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
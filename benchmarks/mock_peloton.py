@@ -0,0 +1,376 @@
+"""Local stand-in for the Peloton and OpenAI APIs.
+
+`MockPeloton` serves a `Recording` on the endpoints the app calls: login,
+instructors and categories (with ETags), the class archive, user workouts,
+ride details, the GraphQL stack operations (with persisted queries) and
+OpenAI chat completions for the workout summary. Every response is
+delayed by the injected latency and counted by route, so benchmarks can
+report how many calls a flow makes and how long it takes on a slow network.
+
+The server can also be run on its own and the app pointed at it:
+
+    python -m benchmarks.mock_peloton --port 8080 --latency 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Text
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.recording import Recording, synthetic
+from tokens import estimate_tokens
+
+
+# Instructors on each page of `/api/instructor`.
+INSTRUCTOR_PAGE_SIZE = 10
+
+SUMMARY_TEXT = (
+    "You have been training consistently, mostly cycling and strength. "
+    "Yoga and stretching have been missing lately, so add some recovery."
+)
+
+
+def _page(items: list, page: int, limit: int) -> Dict[Text, Any]:
+    page_count = max(-(-len(items) // limit), 1)
+    return {
+        "data": items[page * limit:(page + 1) * limit],
+        "page": page,
+        "page_count": page_count,
+        "show_next": page < page_count - 1,
+        "total": len(items),
+    }
+
+
+def _etag(value: Any) -> str:
+    return '"' + hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16] + '"'
+
+
+class MockPeloton:
+    """Serves a recording of the Peloton API with injected latency.
+
+    Args:
+        recording: The data to serve. Defaults to a `synthetic` recording.
+        latency: Seconds every Peloton response is delayed.
+        llm_latency: Seconds every chat completion is delayed.
+        host: Interface to listen on.
+        port: Port to listen on, or 0 for any free port.
+    """
+
+    def __init__(
+            self,
+            recording: Optional[Recording] = None,
+            latency: float = 0.0,
+            llm_latency: float = 0.0,
+            host: str = "127.0.0.1",
+            port: int = 0
+        ):
+
+        self.recording = recording or synthetic()
+        self.latency = latency
+        self.llm_latency = llm_latency
+        self.calls = Counter()
+        self.llm_prompt_tokens = []
+        # Stacked join tokens by session cookie, so every account has its own stack.
+        self.stacks = defaultdict(list)
+        self._lock = threading.Lock()
+        self._persisted = set()
+        self._rides = sorted(self.recording.rides, key=lambda ride: -ride["original_air_time"])
+        self._rides_by_id = {ride["id"]: ride for ride in self._rides}
+        self._rides_by_token = {
+            self._join_token(ride): ride["id"] for ride in self._rides
+        }
+        self._workouts = sorted(self.recording.workouts, key=lambda workout: -workout["created_at"])
+        self._user_workouts = {}
+        self._instructors = {i["id"]: i for i in self.recording.instructors}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def root(self) -> str:
+        """Root URL of the server, used for `PELOTON_API_ROOT`."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environ(self) -> Dict[Text, str]:
+        """Environment variables that point the app at the server."""
+        return {
+            "PELOTON_API_ROOT": self.root,
+            "PELOTON_GRAPHQL_ROOT": f"{self.root}/graphql",
+            "OPENAI_BASE_URL": f"{self.root}/v1",
+        }
+
+    def start(self) -> "MockPeloton":
+        """Starts serving on a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_calls(self) -> Dict[Text, int]:
+        """Clears the call counts and returns the counts so far."""
+        with self._lock:
+            calls = dict(self.calls)
+            self.calls.clear()
+            return calls
+
+    def reset_llm_tokens(self) -> list[int]:
+        """Clears the recorded prompt sizes and returns the sizes so far."""
+        with self._lock:
+            tokens = list(self.llm_prompt_tokens)
+            self.llm_prompt_tokens.clear()
+            return tokens
+
+    def user_id(self, username: Optional[str]) -> str:
+        """Gets the user ID of an account."""
+        if not username:
+            return self.recording.user_id
+        return f"{self.recording.user_id}-{hashlib.sha1(username.encode()).hexdigest()[:12]}"
+
+    def workouts(self, user_id: str) -> list[Dict[Text, Any]]:
+        """Gets the workouts of a user, newest first.
+
+        Other accounts than the recorded one take the recorded classes in a
+        rotated order, so their histories and summaries differ.
+        """
+        if user_id == self.recording.user_id or not self._workouts:
+            return self._workouts
+
+        with self._lock:
+            if user_id not in self._user_workouts:
+                offset = int(hashlib.sha1(user_id.encode()).hexdigest(), 16) % len(self._workouts)
+                rides = [(workout.get("peloton") or {}).get("ride") for workout in self._workouts]
+                rides = rides[offset:] + rides[:offset]
+                self._user_workouts[user_id] = [
+                    {
+                        **workout,
+                        "fitness_discipline": ride["fitness_discipline"],
+                        "name": f"{ride['fitness_discipline'].title()} Workout",
+                        "peloton": {"ride": ride},
+                    }
+                    # Workouts without a class, i.e. Just Ride, are left as they are.
+                    if ride is not None and workout.get("peloton") else workout
+                    for workout, ride in zip(self._workouts, rides)
+                ]
+            return self._user_workouts[user_id]
+
+    def _count(self, route: str) -> None:
+        with self._lock:
+            self.calls[route] += 1
+
+    @staticmethod
+    def _join_token(ride: Dict[Text, Any]) -> str:
+        return (ride.get("join_tokens") or {}).get("on_demand") or f"join-{ride['id']}"
+
+    def _stack_classes(self, stack: list[str]) -> list[Dict[Text, Any]]:
+        classes = []
+        for token in stack:
+            ride = self._rides_by_id.get(self._rides_by_token.get(token), {})
+            classes.append({
+                "pelotonClass": {
+                    "joinToken": token,
+                    "classId": ride.get("id"),
+                    "title": ride.get("title", token),
+                }
+            })
+        return classes
+
+    def _archived(self, query: Dict[Text, list]) -> Dict[Text, Any]:
+        page = int(query.get("page", ["0"])[0])
+        limit = int(query.get("limit", ["50"])[0])
+        rides = self._rides
+        category = query.get("browse_category", [None])[0]
+        if category:
+            rides = [ride for ride in rides if ride["fitness_discipline"] == category]
+
+        response = _page(rides, page, limit)
+        instructor_ids = {ride.get("instructor_id") for ride in response["data"]}
+        response["instructors"] = [
+            self._instructors[id] for id in instructor_ids if id in self._instructors
+        ]
+        return response
+
+    def _graphql(self, body: Dict[Text, Any], session: str) -> Dict[Text, Any]:
+        operation = body.get("operationName")
+        persisted = (body.get("extensions") or {}).get("persistedQuery")
+        if persisted:
+            if "query" in body:
+                self._persisted.add(persisted["sha256Hash"])
+            elif persisted["sha256Hash"] not in self._persisted:
+                return {"errors": [{"extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]}
+
+        variables = (body.get("variables") or {}).get("input") or {}
+        success = {"__typename": "StackResponseSuccess"}
+        stack = self.stacks[session]
+
+        if operation == "ViewUserStack":
+            return {"data": {"viewUserStack": {
+                **success, "userStack": {"stackedClassList": self._stack_classes(stack)}
+            }}}
+        if operation == "ModifyStack":
+            stack[:] = variables.get("pelotonClassIdList") or []
+            return {"data": {"modifyStack": {
+                **success, "userStack": {"stackedClassList": self._stack_classes(stack)}
+            }}}
+        if operation == "AddClassToStack":
+            stack.append(variables.get("pelotonClassId"))
+            return {"data": {"addClassToStack": success}}
+
+        return {"errors": [{"message": f"Unknown operation {operation}"}]}
+
+    def _chat_completion(self, body: Dict[Text, Any]) -> Dict[Text, Any]:
+        prompt_tokens = sum(estimate_tokens(message.get("content") or "") for message in body["messages"])
+        completion_tokens = estimate_tokens(SUMMARY_TEXT)
+        with self._lock:
+            self.llm_prompt_tokens.append(prompt_tokens)
+
+        return {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": SUMMARY_TEXT},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body: Any, status: int = 200, headers: Optional[Dict[Text, str]] = None):
+                data = b"" if body is None else json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if body is not None:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_reference(self, route: str, body: Any):
+                # Instructors and categories support conditional requests.
+                etag = _etag(body)
+                if self.headers.get("If-None-Match") == etag:
+                    mock._count(f"{route} (304)")
+                    return self._send(None, 304, {"ETag": etag})
+                mock._count(route)
+                return self._send(body, headers={"ETag": etag})
+
+            def _session(self) -> str:
+                cookies = (part.strip().split("=", 1) for part in (self.headers.get("Cookie") or "").split(";"))
+                return dict(cookie for cookie in cookies if len(cookie) == 2).get("peloton_session_id", "")
+
+            def _body(self) -> Dict[Text, Any]:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                path = url.path
+                time.sleep(mock.latency)
+
+                if path == "/api/me":
+                    mock._count("GET /api/me")
+                    return self._send({"id": mock.recording.user_id})
+                if path == "/api/instructor":
+                    page = int(query.get("page", ["0"])[0])
+                    return self._send_reference(
+                        "GET /api/instructor",
+                        _page(mock.recording.instructors, page, INSTRUCTOR_PAGE_SIZE)
+                    )
+                if path == "/api/browse_categories":
+                    disciplines = sorted({ride["fitness_discipline"] for ride in mock._rides})
+                    return self._send_reference(
+                        "GET /api/browse_categories",
+                        {"categories": [{"slug": slug, "name": slug.title()} for slug in disciplines]}
+                    )
+                if path == "/api/v2/ride/archived":
+                    mock._count("GET /api/v2/ride/archived")
+                    return self._send(mock._archived(query))
+                if path.startswith("/api/user/") and path.endswith("/workouts"):
+                    mock._count("GET /api/user/{id}/workouts")
+                    page = int(query.get("page", ["0"])[0])
+                    limit = int(query.get("limit", ["50"])[0])
+                    return self._send(_page(mock.workouts(path.split("/")[3]), page, limit))
+                if path.startswith("/api/ride/") and path.endswith("/details"):
+                    mock._count("GET /api/ride/{id}/details")
+                    ride = mock._rides_by_id.get(path.split("/")[3])
+                    if ride is None:
+                        return self._send({"status": 404}, 404)
+                    return self._send({"ride": {**ride, "join_tokens": {"on_demand": mock._join_token(ride)}}})
+
+                mock._count(f"GET {path}")
+                self._send({"status": 404}, 404)
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self._body()
+
+                if path == "/v1/chat/completions":
+                    mock._count("POST /v1/chat/completions")
+                    time.sleep(mock.llm_latency)
+                    return self._send(mock._chat_completion(body))
+
+                time.sleep(mock.latency)
+                if path == "/auth/login":
+                    mock._count("POST /auth/login")
+                    user_id = mock.user_id(body.get("username_or_email"))
+                    return self._send(
+                        {"user_id": user_id, "session_id": user_id},
+                        headers={"Set-Cookie": f"peloton_session_id={user_id}; Path=/"}
+                    )
+                if path == "/graphql":
+                    mock._count(f"POST /graphql {body.get('operationName')}")
+                    return self._send(mock._graphql(body, self._session()))
+                if path == "/api/favorites/create":
+                    mock._count("POST /api/favorites/create")
+                    return self._send({})
+
+                mock._count(f"POST {path}")
+                self._send({"status": 404}, 404)
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a mock Peloton API.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each Peloton response.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds added to each chat completion.")
+    parser.add_argument("--recording", help="Recording to serve. Defaults to synthetic data.")
+    args = parser.parse_args()
+
+    recording = Recording.load(args.recording) if args.recording else synthetic()
+    mock = MockPeloton(recording, args.latency, args.llm_latency, port=args.port)
+    for name, value in mock.environ().items():
+        print(f"export {name}={value}")
+
+    mock.start()._thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Recorded Peloton data replayed by the mock server.
+
+A `Recording` holds the instructors, on demand classes and user workouts
+the way the Peloton API returns them. The mock pages and filters them per
+request, so one recording serves every page size the app asks for.
+`synthetic` generates a recording of any size. Running this module
+captures one from the live API with the credentials in `.env`:
+
+    python -m benchmarks.recording --output benchmarks/recordings/live.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Text, Union
+
+
+DISCIPLINES = [
+    "cycling", "strength", "yoga", "running", "walking", "stretching",
+    "meditation", "cardio", "caesar", "circuit",
+]
+
+THEMES = [
+    "Pop", "HIIT", "Climb", "Endurance", "Low Impact", "Full Body", "Core",
+    "Upper Body", "Lower Body", "Recovery", "Tabata", "Power Zone", "90s", "Rock",
+]
+
+DURATIONS = [5, 10, 15, 20, 30, 45, 60]
+
+
+@dataclass
+class Recording:
+    """Peloton API data for the mock server to serve."""
+    user_id: str = "benchmark-user"
+    instructors: list[Dict[Text, Any]] = field(default_factory=list)
+    rides: list[Dict[Text, Any]] = field(default_factory=list)
+    workouts: list[Dict[Text, Any]] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Recording":
+        """Loads a recording saved with `save`."""
+        return cls(**json.loads(Path(path).read_text()))
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Saves the recording as JSON."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(asdict(self)))
+
+
+def synthetic(
+        num_rides: int = 5000,
+        num_workouts: int = 300,
+        num_instructors: int = 40,
+        seed: int = 0
+    ) -> Recording:
+    """Generates a recording shaped like the Peloton API responses.
+
+    Args:
+        num_rides: Number of classes in the on demand library.
+        num_workouts: Number of workouts in the user's history, one a day
+            going back from now.
+        num_instructors: Number of instructors teaching the classes.
+        seed: Seed for the random values, so runs are comparable.
+    """
+    rng = random.Random(seed)
+    now = int(time.time())
+
+    instructors = [
+        {"id": f"instructor-{i:03d}", "name": f"Instructor {i}"}
+        for i in range(num_instructors)
+    ]
+
+    rides = []
+    for i in range(num_rides):
+        discipline = rng.choice(DISCIPLINES)
+        minutes = rng.choice(DURATIONS)
+        theme = rng.choice(THEMES)
+        ride_id = f"{i:032x}"
+        rides.append({
+            "id": ride_id,
+            "title": f"{minutes} min {theme} {discipline.replace('_', ' ').title()}",
+            "description": (
+                f"A {minutes} minute {theme.lower()} {discipline} class. "
+                f"{rng.choice(['Build strength', 'Push your limits', 'Find your flow', 'Recover and reset'])} "
+                f"with music to keep you moving."
+            ),
+            "duration": minutes * 60,
+            "difficulty_rating_avg": round(rng.uniform(4.0, 9.5), 2),
+            "fitness_discipline": discipline,
+            "instructor_id": rng.choice(instructors)["id"],
+            "original_air_time": now - (num_rides - i) * 3600,
+            "join_tokens": {"on_demand": f"join-{ride_id}"},
+        })
+
+    workouts = []
+    for i in range(num_workouts):
+        ride = rng.choice(rides)
+        started = now - i * 86400
+        workouts.append({
+            "id": f"workout-{i:06d}",
+            "created_at": started,
+            "start_time": started,
+            "fitness_discipline": ride["fitness_discipline"],
+            "name": f"{ride['fitness_discipline'].title()} Workout",
+            "peloton": {"ride": ride},
+        })
+
+    return Recording(instructors=instructors, rides=rides, workouts=workouts)
+
+
+async def capture(ride_pages: int = 10, workout_pages: int = 4) -> Recording:
+    """Records the instructors, newest classes and workouts of the live account.
+
+    Args:
+        ride_pages: Pages of 100 classes to record.
+        workout_pages: Pages of 50 workouts to record.
+    """
+    from startup import load_env
+    load_env()
+    from peloton import AsyncPelotonAPI
+
+    api = AsyncPelotonAPI()
+    try:
+        response = await api.authenticate()
+        response.raise_for_status()
+        user_id = response.json()["user_id"]
+
+        instructor_map = await api.get_instructor_list() or {}
+        ride_responses = await asyncio.gather(
+            *[api.get_archived_rides(page=page, limit=100) for page in range(ride_pages)]
+        )
+        workout_responses = await asyncio.gather(
+            *[api.get_user_workouts(user_id, page=page) for page in range(workout_pages)]
+        )
+    finally:
+        await api.aclose()
+
+    return Recording(
+        user_id=user_id,
+        instructors=[{"id": id, "name": name} for id, name in instructor_map.items()],
+        rides=[ride for response in ride_responses for ride in response["data"]],
+        workouts=[
+            workout for response in workout_responses if response
+            for workout in response["data"]
+        ]
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Record Peloton data for the benchmarks.")
+    parser.add_argument("--output", default="benchmarks/recordings/live.json")
+    parser.add_argument("--ride-pages", type=int, default=10)
+    parser.add_argument("--workout-pages", type=int, default=4)
+    args = parser.parse_args()
+
+    recording = asyncio.run(capture(args.ride_pages, args.workout_pages))
+    recording.save(args.output)
+    print(
+        f"Recorded {len(recording.instructors)} instructors, {len(recording.rides)} classes "
+        f"and {len(recording.workouts)} workouts to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""End-to-end benchmarks of the recommendation flow.
+
+Each session is opened the way `Home.py` opens one, with
+`RecommendationService.open_session`: the shared stores and account
+client, a new `AgentDeps` and a prefetch started as the session opens.
+The user then immediately asks for a workout ("suggest") and adds the
+first suggestion to the stack ("stack"), with the history compacted
+between the turns. The agent is streamed with `streaming.stream_agent` like in the
+app, against `MockPeloton` and a `ScriptedModel`.
+
+The first session runs against empty caches ("cold"), the rest reuse them
+like later sessions of a running app ("warm"). For every scenario the
+report has the end-to-end and first text times, the time spent in each
+tool, the HTTP calls by route and the prompt tokens sent to the model and
+to the summary completion.
+
+    python -m benchmarks.run --sessions 5 --latency 0.05 --json bench.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional, Text
+
+from benchmarks.mock_peloton import MockPeloton
+from benchmarks.recording import Recording, synthetic
+from benchmarks.scripted_model import ScriptedModel
+
+
+SCENARIOS = {
+    "suggest": "Suggest a workout",
+    "stack": "Add the first workout to my stack",
+}
+
+PREFERENCES = {
+    "fitness_goals": ["Cycling", "Strength", "Yoga"],
+    "preferred_duration_minutes": 30,
+    "preferred_intensity": "6-8",
+    "excluded_classes": ["Meditation"],
+    "favorite_instructors": ["Instructor 1", "Instructor 2"],
+}
+
+
+@dataclass
+class ScenarioResult:
+    """Measurements of one scenario in one session."""
+    scenario: str
+    session: int
+    seconds: float
+    first_text_seconds: Optional[float]
+    tool_seconds: Dict[Text, list[float]] = field(default_factory=dict)
+    http_calls: Dict[Text, int] = field(default_factory=dict)
+    prompt_tokens: list[int] = field(default_factory=list)
+    summary_prompt_tokens: list[int] = field(default_factory=list)
+    retries: int = 0
+    response: str = ""
+
+    @property
+    def warm(self) -> bool:
+        return self.session > 0
+
+
+def _configure(mock: MockPeloton, cache_dir: str) -> None:
+    """Points the app at the mock. Must run before the app modules are imported."""
+    os.environ.update(mock.environ())
+    os.environ["PELOTON_PAL_CACHE_DIR"] = cache_dir
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["PELOTON_USER"] = "benchmark"
+    os.environ["PELOTON_PASS"] = "benchmark"
+
+
+def _tool_seconds(messages: list) -> Dict[Text, list[float]]:
+    """Times each tool from the model response that called it to its result."""
+    from pydantic_ai.messages import ModelStructuredResponse, ToolReturn
+
+    seconds = defaultdict(list)
+    called_at = None
+    for message in messages:
+        if isinstance(message, ModelStructuredResponse):
+            called_at = message.timestamp
+        elif isinstance(message, ToolReturn) and called_at is not None:
+            seconds[message.tool_name].append((message.timestamp - called_at).total_seconds())
+
+    return dict(seconds)
+
+
+def _prompt_tokens(all_messages: list, new_count: int, tool_tokens: int) -> list[int]:
+    """Estimates the prompt tokens of every model request in the turn."""
+    from pydantic_ai.messages import ModelStructuredResponse, ModelTextResponse
+
+    from compaction import message_tokens
+
+    tokens = []
+    sent = 0
+    for i, message in enumerate(all_messages):
+        if isinstance(message, (ModelStructuredResponse, ModelTextResponse)):
+            if i >= len(all_messages) - new_count:
+                tokens.append(sent + tool_tokens)
+        sent += message_tokens(message)
+
+    return tokens
+
+
+@dataclass
+class Deployment:
+    """The mock server and the service shared by every session, like the one in Home.py."""
+    mock: MockPeloton
+    service: Any
+
+    @property
+    def summary_cache(self):
+        return self.service.summary_cache
+
+    @property
+    def ride_cache(self):
+        return self.service.ride_cache
+
+
+def deploy(recording: Recording, latency: float = 0.05, llm_latency: float = 0.5) -> Deployment:
+    """Starts a mock server and creates the shared stores in an empty cache directory.
+
+    Args:
+        recording: The Peloton data the mock serves.
+        latency: Seconds added to every Peloton response.
+        llm_latency: Seconds added to every summary completion.
+    """
+    mock = MockPeloton(recording, latency=latency, llm_latency=llm_latency).start()
+    _configure(mock, tempfile.mkdtemp(prefix="peloton-pal-bench-"))
+
+    # The app reads its configuration at import, so it is imported once
+    # the environment points at the mock.
+    from service import RecommendationService
+
+    return Deployment(mock=mock, service=RecommendationService())
+
+
+def open_session(deployment: Deployment, username: Optional[str] = None):
+    """Opens a session for a Peloton account and gets its `AgentDeps`.
+
+    The session's prefetch is already started.
+
+    Args:
+        deployment: The deployment the session is opened in.
+        username: The account, defaults to `PELOTON_USER`. Sessions of the
+            same account share its client.
+    """
+    from schemas import UserWorkoutPreferences
+
+    # The mock accepts any password.
+    session = deployment.service.open_session(
+        UserWorkoutPreferences(**PREFERENCES), username, os.environ["PELOTON_PASS"]
+    )
+    return session.deps
+
+
+def stream_turn(deps, prompt: str, message_history: Optional[list] = None) -> tuple[Any, float, Optional[float]]:
+    """Streams a prompt through the agent the way Home.py does.
+
+    Returns:
+        The `StreamedRunResult`, the seconds until the run finished and the
+        seconds until the first text, or None if there was no text.
+    """
+    from agent import peloton_agent
+    from streaming import stream_agent
+
+    start = time.perf_counter()
+    first_text = None
+    result = None
+    for event in stream_agent(peloton_agent, prompt, deps, message_history=message_history):
+        if event.kind == "text" and first_text is None:
+            first_text = time.perf_counter() - start
+        elif event.kind == "done":
+            result = event.content
+        elif event.kind == "error":
+            raise event.content
+
+    return result, time.perf_counter() - start, first_text
+
+
+def run_turn(
+        deployment: Deployment,
+        model: ScriptedModel,
+        deps,
+        scenario: str,
+        session: int,
+        message_history: Optional[list] = None
+    ) -> tuple[ScenarioResult, Any]:
+    """Streams a scenario's prompt through the agent and measures it.
+
+    The HTTP calls and summary prompts counted by the mock since its
+    counters were last reset are included, then the counters are reset.
+
+    Returns:
+        The measurements and the `StreamedRunResult`.
+    """
+    result, seconds, first_text = stream_turn(deps, SCENARIOS[scenario], message_history)
+
+    new_messages = result.new_messages()
+    return ScenarioResult(
+        scenario=scenario,
+        session=session,
+        seconds=seconds,
+        first_text_seconds=first_text,
+        tool_seconds=_tool_seconds(new_messages),
+        http_calls=deployment.mock.reset_calls(),
+        prompt_tokens=_prompt_tokens(result.all_messages(), len(new_messages), model.tool_tokens),
+        summary_prompt_tokens=deployment.mock.reset_llm_tokens(),
+        retries=sum(1 for message in new_messages if message.role == "retry-prompt"),
+        response=new_messages[-1].content
+    ), result
+
+
+def run(
+        recording: Recording,
+        sessions: int = 5,
+        latency: float = 0.05,
+        llm_latency: float = 0.5,
+        model_latency: float = 0.5
+    ) -> list[ScenarioResult]:
+    """Runs the scenarios for each session against a new mock and empty caches.
+
+    Args:
+        recording: The Peloton data the mock serves.
+        sessions: Number of sessions. The first runs against empty caches.
+        latency: Seconds added to every Peloton response.
+        llm_latency: Seconds added to every summary completion.
+        model_latency: Seconds before the first token of every model turn.
+    """
+    deployment = deploy(recording, latency, llm_latency)
+    model = ScriptedModel(latency=model_latency)
+
+    from agent import peloton_agent
+    from compaction import compact_messages
+
+    results = []
+    try:
+        with peloton_agent.override(model=model.model()):
+            for session in range(sessions):
+                # The login isn't part of the first turn. The prefetch
+                # starts with the session, so it is.
+                deployment.service.session_manager.get()
+                deployment.mock.reset_calls()
+                deployment.mock.reset_llm_tokens()
+                deps = open_session(deployment)
+
+                suggest, result = run_turn(deployment, model, deps, "suggest", session)
+                stack, _ = run_turn(
+                    deployment, model, deps, "stack", session,
+                    message_history=compact_messages(result.all_messages())
+                )
+                results.extend([suggest, stack])
+    finally:
+        deployment.mock.stop()
+
+    return results
+
+
+def _median(values: list[float]) -> Optional[float]:
+    return statistics.median(values) if values else None
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def report(results: list[ScenarioResult]) -> str:
+    """Renders the cold run and the median of the warm runs of each scenario."""
+    lines = [
+        f"{'scenario':<10}{'run':<6}{'total s':>10}{'first text s':>14}{'http':>7}"
+        f"{'requests':>10}{'prompt tok':>12}{'max prompt':>12}{'summary tok':>13}{'retries':>9}"
+    ]
+    tool_lines = [f"{'scenario':<10}{'run':<6}{'tool':<28}{'calls':>7}{'median s':>10}"]
+    http_lines = [f"{'scenario':<10}{'run':<6}{'route':<44}{'calls':>7}"]
+
+    for scenario in SCENARIOS:
+        for run_name, runs in [
+            ("cold", [r for r in results if r.scenario == scenario and not r.warm]),
+            ("warm", [r for r in results if r.scenario == scenario and r.warm]),
+        ]:
+            if not runs:
+                continue
+
+            lines.append(
+                f"{scenario:<10}{run_name:<6}"
+                f"{_format_seconds(_median([r.seconds for r in runs])):>10}"
+                f"{_format_seconds(_median([r.first_text_seconds for r in runs if r.first_text_seconds is not None])):>14}"
+                f"{_median([sum(r.http_calls.values()) for r in runs]):>7g}"
+                f"{_median([len(r.prompt_tokens) for r in runs]):>10g}"
+                f"{_median([sum(r.prompt_tokens) for r in runs]):>12g}"
+                f"{_median([max(r.prompt_tokens, default=0) for r in runs]):>12g}"
+                f"{_median([sum(r.summary_prompt_tokens) for r in runs]):>13g}"
+                f"{_median([r.retries for r in runs]):>9g}"
+            )
+
+            tools = sorted({tool for r in runs for tool in r.tool_seconds})
+            for tool in tools:
+                seconds = [s for r in runs for s in r.tool_seconds.get(tool, [])]
+                tool_lines.append(
+                    f"{scenario:<10}{run_name:<6}{tool:<28}{len(seconds) / len(runs):>7g}"
+                    f"{_format_seconds(_median(seconds)):>10}"
+                )
+
+            routes = sorted({route for r in runs for route in r.http_calls})
+            for route in routes:
+                http_lines.append(
+                    f"{scenario:<10}{run_name:<6}{route:<44}"
+                    f"{_median([r.http_calls.get(route, 0) for r in runs]):>7g}"
+                )
+
+    return "\n\n".join("\n".join(section) for section in [lines, tool_lines, http_lines])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation flow offline.")
+    parser.add_argument("--sessions", type=int, default=5, help="Sessions to run, the first is cold.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to each Peloton response.")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds added to each summary completion.")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Seconds before each model turn responds.")
+    parser.add_argument("--recording", help="Recording to replay. Defaults to synthetic data.")
+    parser.add_argument("--rides", type=int, default=5000, help="Classes in the synthetic recording.")
+    parser.add_argument("--workouts", type=int, default=300, help="Workouts in the synthetic recording.")
+    parser.add_argument("--json", help="Also write every measurement to this file.")
+    args = parser.parse_args()
+
+    recording = (
+        Recording.load(args.recording) if args.recording
+        else synthetic(num_rides=args.rides, num_workouts=args.workouts)
+    )
+    results = run(recording, args.sessions, args.latency, args.llm_latency, args.model_latency)
+
+    print(report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
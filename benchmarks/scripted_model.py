@@ -0,0 +1,120 @@
+"""Scripted model that plays the model's side of the benchmark conversations.
+
+`ScriptedModel.model` is a pydantic-ai `FunctionModel` that makes the tool
+calls gpt-4o-mini makes for "Suggest a workout" and for adding the
+suggested workout to the stack, so the tools, HTTP calls and prompt sizes
+are exercised without OpenAI. Responses are streamed like the real model's.
+"""
+
+import asyncio
+import json
+import re
+from typing import AsyncIterator, Union
+
+from pydantic_ai.messages import (
+    Message,
+    ModelAnyResponse,
+    ModelStructuredResponse,
+    ModelTextResponse,
+    ToolCall,
+    ToolReturn,
+    UserPrompt
+)
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, DeltaToolCalls, FunctionModel
+
+from tokens import estimate_tokens
+from traced_model import TracedModel
+
+
+# Characters in each streamed text chunk.
+CHUNK_CHARS = 20
+
+CLASS_ALIAS = re.compile(r"\bc\d+\b")
+
+
+class ScriptedModel:
+    """Responds to the benchmark prompts with a fixed sequence of tool calls.
+
+    "Suggest a workout" calls `workout_context`, then `compose_workout`, then
+    lists the workouts. A prompt mentioning the stack adds the first
+    suggested workout with `add_class_to_stack`.
+
+    Args:
+        latency: Seconds before the first token of each response, standing
+            in for the model's time to first token.
+    """
+
+    def __init__(self, latency: float = 0.0):
+
+        self.latency = latency
+        # Tokens of the tool definitions sent with every request.
+        self.tool_tokens = 0
+
+    def model(self) -> TracedModel:
+        """The pydantic-ai model to override the agent's model with, traced like the app's."""
+        return TracedModel(FunctionModel(self.request, stream_function=self.stream))
+
+    def respond(self, messages: list[Message], info: AgentInfo) -> ModelAnyResponse:
+        """Picks the next response from the conversation so far."""
+        self.tool_tokens = sum(
+            estimate_tokens(json.dumps({
+                "name": tool.name,
+                "description": tool.description,
+                "parameters": tool.parameters_json_schema,
+            }))
+            for tool in info.function_tools
+        )
+
+        last = messages[-1]
+        if isinstance(last, UserPrompt):
+            if "stack" in last.content.lower():
+                class_ids = self._suggested_class_ids(messages)
+                if class_ids:
+                    return ModelStructuredResponse(calls=[
+                        ToolCall.from_dict("add_class_to_stack", {"class_ids": class_ids, "append": True})
+                    ])
+            return ModelStructuredResponse(calls=[ToolCall.from_dict("workout_context", {})])
+
+        if isinstance(last, ToolReturn):
+            if last.tool_name == "workout_context":
+                # Every parameter is required in the schema, so the model sends nulls.
+                return ModelStructuredResponse(calls=[
+                    ToolCall.from_dict("compose_workout", {"class_ids": None, "total_duration": None})
+                ])
+            if last.tool_name == "compose_workout" and last.content:
+                return ModelTextResponse(content="Here are a few workouts for today.\n\n" + "\n".join(
+                    f"Workout {i}: {', '.join(workout.class_ids)} ({', '.join(workout.titles)})"
+                    for i, workout in enumerate(last.content, start=1)
+                ))
+            if last.tool_name == "add_class_to_stack":
+                added = sum(1 for stacked in last.content.values() if stacked)
+                return ModelTextResponse(content=f"Added {added} classes to your stack.")
+
+        return ModelTextResponse(content="Sorry, I couldn't build a workout.")
+
+    @staticmethod
+    def _suggested_class_ids(messages: list[Message]) -> list[str]:
+        """Gets the class aliases of the first workout the model suggested."""
+        for message in reversed(messages):
+            if isinstance(message, ModelTextResponse):
+                for line in message.content.split("\n"):
+                    if line.startswith("Workout 1:"):
+                        return CLASS_ALIAS.findall(line.split("(")[0])
+        return []
+
+    async def request(self, messages: list[Message], info: AgentInfo) -> ModelAnyResponse:
+        await asyncio.sleep(self.latency)
+        return self.respond(messages, info)
+
+    async def stream(self, messages: list[Message], info: AgentInfo) -> AsyncIterator[Union[str, DeltaToolCalls]]:
+        await asyncio.sleep(self.latency)
+        response = self.respond(messages, info)
+
+        if isinstance(response, ModelTextResponse):
+            for start in range(0, len(response.content), CHUNK_CHARS):
+                yield response.content[start:start + CHUNK_CHARS]
+        else:
+            yield {
+                i: DeltaToolCall(name=call.tool_name, json_args=json.dumps(call.args.args_dict))
+                for i, call in enumerate(response.calls)
+            }
@@ -0,0 +1,135 @@
+"""Startup benchmark of a fresh app worker.
+
+Every run starts a new interpreter and imports the app in the stages
+`Home.py` goes through (see `startup`): the modules needed for the first
+paint, the modules needed to set up the session, and the deferred modules
+and clients `startup.warm_up` builds in the background. The import time of
+each stage is checked against `startup.IMPORT_BUDGET`.
+
+The report also compares the time to first paint with what it was when
+`Home.py` imported everything before drawing the page, i.e. the sum of
+the stages.
+
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Text
+
+from startup import IMPORT_BUDGET
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs in the fresh interpreter, timing each stage like Home.py runs them.
+PROBE = """
+import json, time
+start = time.perf_counter()
+import startup
+stages = {"first_paint": time.perf_counter() - start}
+stages["first_paint"] += startup.import_seconds(startup.FIRST_PAINT_MODULES)
+startup.load_env()
+stages["session"] = startup.import_seconds(startup.SESSION_MODULES)
+start = time.perf_counter()
+startup.import_seconds(startup.DEFERRED_MODULES)
+import agent
+agent.warm_up()
+stages["deferred"] = time.perf_counter() - start
+print(json.dumps(stages))
+"""
+
+
+def measure(cache_dir: str) -> Dict[Text, float]:
+    """Times the startup stages in a new interpreter.
+
+    Returns:
+        The seconds spent in each stage.
+    """
+    env = dict(os.environ, PELOTON_PAL_CACHE_DIR=cache_dir)
+    # The clients are built but never used, so any key will do.
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs: int = 5) -> Dict[Text, list[float]]:
+    """Measures the startup `runs` times, after one run to warm the bytecode caches.
+
+    Returns:
+        The seconds spent in each stage, by stage.
+    """
+    stages = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        measure(cache_dir)
+        for _ in range(runs):
+            for stage, seconds in measure(cache_dir).items():
+                stages.setdefault(stage, []).append(seconds)
+
+    return stages
+
+
+def report(stages: Dict[Text, list[float]]) -> tuple[str, bool]:
+    """Renders the median time of each stage against its budget.
+
+    Returns:
+        The report and whether every stage is within its budget.
+    """
+    lines = [f"{'stage':<14}{'median s':>10}{'max s':>8}{'budget s':>10}"]
+    within_budget = True
+
+    for stage, values in stages.items():
+        median = statistics.median(values)
+        budget = IMPORT_BUDGET.get(stage)
+        over = budget is not None and median > budget
+        within_budget = within_budget and not over
+        lines.append(
+            f"{stage:<14}{median:>10.3f}{max(values):>8.3f}"
+            f"{budget if budget is not None else '-':>10}{'  OVER' if over else ''}"
+        )
+
+    first_paint = statistics.median(stages["first_paint"])
+    eager = statistics.median([sum(run) for run in zip(*stages.values())])
+    lines.append("")
+    lines.append(
+        f"Imports before the first paint: {first_paint:.3f} s "
+        f"(importing everything first: {eager:.3f} s)"
+    )
+
+    return "\n".join(lines), within_budget
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the startup of a fresh app worker.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure.")
+    parser.add_argument("--json", help="Also write every measurement to this file.")
+    args = parser.parse_args()
+
+    stages = run(args.runs)
+    text, within_budget = report(stages)
+
+    print(text)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(stages, f, indent=2)
+
+    sys.exit(0 if within_budget else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""Local store of the Peloton on demand class library.
+
+The first sync backfills the whole library from `/api/v2/ride/archived`,
+a few pages at a time, and resumes where it stopped if it fails partway.
+Later syncs walk the archive newest first and stop once they reach the
+newest class already stored (the high-water mark), so a refresh usually
+costs a single request. Classes are kept in SQLite with indexes on the
+columns recommendations filter on, so candidates can be drawn from the
+whole library without calling the API.
+
+For ranking, `ClassCatalog.columns` keeps a columnar copy of the catalog
+in memory: NumPy arrays for the numeric columns, integer codes for the
+disciplines and instructors, and a dictionary from class ID to row. The
+whole library can then be filtered and scored with array operations.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Text
+
+import numpy as np
+
+import storage
+
+
+# Number of classes requested for each page of the archive.
+PAGE_SIZE = 100
+
+# Most pages of the archive requested at once during the backfill.
+BACKFILL_CONCURRENCY = 8
+
+# How long a sync is considered fresh before checking for new classes.
+SYNC_INTERVAL_SECONDS = 60 * 60
+
+
+class CatalogColumns:
+    """Columnar, in-memory copy of the catalog.
+
+    Each class is a row across the arrays. Disciplines and instructors are
+    stored as codes into `disciplines` and `instructors`. Instances aren't
+    changed once shared, so updates are applied to a `copy`.
+    """
+
+    def __init__(self):
+
+        self.ids = np.empty(0, dtype=object)
+        self.titles = np.empty(0, dtype=object)
+        self.descriptions = np.empty(0, dtype=object)
+        self.duration = np.empty(0, dtype=np.int32)
+        self.difficulty = np.empty(0, dtype=np.float32)
+        self.original_air_time = np.empty(0, dtype=np.int64)
+        self.discipline = np.empty(0, dtype=np.int32)
+        self.instructor = np.empty(0, dtype=np.int32)
+        self.disciplines = []
+        self.instructors = []
+        self.rows = {}
+        # Catalog rowid of the newest class in the columns.
+        self.last_rowid = 0
+        self._codes = {"discipline": {}, "instructor": {}}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def copy(self) -> "CatalogColumns":
+        """Copies the columns so they can be updated without changing this instance."""
+        columns = CatalogColumns()
+        for name in ["ids", "titles", "descriptions", "duration", "difficulty",
+                     "original_air_time", "discipline", "instructor"]:
+            setattr(columns, name, getattr(self, name).copy())
+        columns.disciplines = list(self.disciplines)
+        columns.instructors = list(self.instructors)
+        columns.rows = dict(self.rows)
+        columns.last_rowid = self.last_rowid
+        columns._codes = {kind: dict(codes) for kind, codes in self._codes.items()}
+        return columns
+
+    def _code(self, kind: str, value: str) -> int:
+        codes = self._codes[kind]
+        if value not in codes:
+            codes[value] = len(codes)
+            (self.disciplines if kind == "discipline" else self.instructors).append(value)
+        return codes[value]
+
+    def codes(self, kind: str, values: Optional[Iterable[str]]) -> np.ndarray:
+        """Gets the codes of the "discipline" or "instructor" values in the catalog."""
+        codes = self._codes[kind]
+        return np.array([codes[value] for value in values or [] if value in codes], dtype=np.int32)
+
+    def row_indices(self, class_ids: Optional[Iterable[str]]) -> np.ndarray:
+        """Gets the rows of the class IDs in the catalog, leaving out unknown IDs."""
+        return np.array(
+            [self.rows[class_id] for class_id in class_ids or [] if class_id in self.rows],
+            dtype=np.int64
+        )
+
+    def apply(self, classes: list[Dict[Text, Any]]) -> None:
+        """Adds new classes and overwrites the rows of replaced ones.
+
+        Args:
+            classes: Classes from `ClassCatalog.changed_since`.
+        """
+        if not classes:
+            return
+
+        new = []
+        for cl in classes:
+            values = (
+                cl["title"],
+                cl["description"],
+                cl["duration"],
+                cl["difficulty"],
+                cl["original_air_time"],
+                self._code("discipline", cl["fitness_discipline"]),
+                self._code("instructor", cl["instructor"]),
+            )
+            row = self.rows.get(cl["id"])
+            if row is None:
+                self.rows[cl["id"]] = len(self.ids) + len(new)
+                new.append((cl["id"], *values))
+            else:
+                (
+                    self.titles[row],
+                    self.descriptions[row],
+                    self.duration[row],
+                    self.difficulty[row],
+                    self.original_air_time[row],
+                    self.discipline[row],
+                    self.instructor[row],
+                ) = values
+
+        if new:
+            columns = list(zip(*new))
+            for name, values in zip(
+                ["ids", "titles", "descriptions", "duration", "difficulty",
+                 "original_air_time", "discipline", "instructor"],
+                columns
+            ):
+                current = getattr(self, name)
+                added = np.empty(len(values), dtype=current.dtype)
+                added[:] = values
+                setattr(self, name, np.concatenate([current, added]))
+
+        self.last_rowid = max(self.last_rowid, max(cl["rowid"] for cl in classes))
+
+    def record(self, row: int) -> Dict[Text, Any]:
+        """Gets a row as a dictionary.
+
+        Returns:
+            The class with the `id`, `title`, `description`, `duration`
+            (seconds), `difficulty`, `fitness_discipline`, `instructor` and
+            `original_air_time` keys.
+        """
+        return {
+            "id": self.ids[row],
+            "title": self.titles[row],
+            "description": self.descriptions[row],
+            "duration": int(self.duration[row]),
+            "difficulty": float(self.difficulty[row]),
+            "fitness_discipline": self.disciplines[self.discipline[row]],
+            "instructor": self.instructors[self.instructor[row]],
+            "original_air_time": int(self.original_air_time[row]),
+        }
+
+
+class ClassCatalog:
+    """SQLite backed catalog of on demand classes.
+
+    Args:
+        name: File name of the database in the cache directory.
+        page_size: Number of classes requested for each page of the archive.
+    """
+
+    def __init__(self, name: str = "catalog.sqlite", page_size: int = PAGE_SIZE):
+
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._sync_lock = asyncio.Lock()
+        self._columns = CatalogColumns()
+        self._columns_lock = threading.Lock()
+        self._conn = storage.connect(name)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS classes (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT NOT NULL,
+                duration INTEGER NOT NULL,
+                difficulty REAL NOT NULL,
+                fitness_discipline TEXT NOT NULL,
+                instructor_id TEXT,
+                instructor TEXT NOT NULL,
+                original_air_time INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS classes_fitness_discipline ON classes (fitness_discipline);
+            CREATE INDEX IF NOT EXISTS classes_duration ON classes (duration);
+            CREATE INDEX IF NOT EXISTS classes_instructor ON classes (instructor);
+            CREATE INDEX IF NOT EXISTS classes_difficulty ON classes (difficulty);
+            CREATE INDEX IF NOT EXISTS classes_original_air_time ON classes (original_air_time);
+
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM catalog_meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row["value"] if row else None
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO catalog_meta (key, value) VALUES (?, ?)",
+                (key, str(value))
+            )
+
+    @property
+    def high_water_mark(self) -> Optional[int]:
+        """The `original_air_time` of the newest stored class."""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(original_air_time) AS hwm FROM classes").fetchone()
+        return row["hwm"]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM classes").fetchone()[0]
+
+    def upsert(self, pelo_response: Dict[Text, Any]) -> int:
+        """Stores the classes from a page of the archive.
+
+        Args:
+            pelo_response: A response from `AsyncPelotonAPI.get_archived_rides`.
+
+        Returns:
+            The number of classes stored.
+        """
+        instructors = {i["id"]: i["name"] for i in pelo_response.get("instructors", [])}
+
+        rows = []
+        for cl in pelo_response["data"]:
+            difficulty = cl.get("difficulty_rating_avg") or cl.get("difficulty_estimate") or 0
+            rows.append((
+                cl["id"],
+                cl["title"],
+                cl.get("description") or "",
+                cl["duration"],
+                difficulty,
+                cl["fitness_discipline"],
+                cl.get("instructor_id"),
+                instructors.get(cl.get("instructor_id"), ""),
+                cl["original_air_time"]
+            ))
+
+        # Updating in place keeps the rowid, so `changed_since` doesn't
+        # report classes that were only stored again.
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT INTO classes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    title = excluded.title,
+                    description = excluded.description,
+                    duration = excluded.duration,
+                    difficulty = excluded.difficulty,
+                    fitness_discipline = excluded.fitness_discipline,
+                    instructor_id = excluded.instructor_id,
+                    instructor = excluded.instructor,
+                    original_air_time = excluded.original_air_time
+                """,
+                rows
+            )
+
+        return len(rows)
+
+    async def _backfill(self, api) -> None:
+        """Stores every class in the library.
+
+        Pages are requested `BACKFILL_CONCURRENCY` at a time and stored as
+        each chunk finishes. The next page to request is recorded, so a
+        backfill that fails partway resumes from there on the next sync.
+        New classes only push the older ones to later pages, so resuming
+        doesn't skip any.
+        """
+        first_page = await api.get_archived_rides(page=0, limit=self.page_size)
+        self.upsert(first_page)
+
+        page_count = first_page.get("page_count", 1)
+        next_page = int(self._get_meta("backfill_next_page") or 1)
+        for start in range(next_page, page_count, BACKFILL_CONCURRENCY):
+            end = min(start + BACKFILL_CONCURRENCY, page_count)
+            pages = await asyncio.gather(
+                *[api.get_archived_rides(page=page, limit=self.page_size) for page in range(start, end)]
+            )
+            for pelo_response in pages:
+                self.upsert(pelo_response)
+            self._set_meta("backfill_next_page", end)
+
+        self._set_meta("backfill_complete", 1)
+
+    async def _sync_new(self, api, high_water_mark: int) -> None:
+        """Stores the classes that aired after the high-water mark."""
+        page = 0
+        while True:
+            pelo_response = await api.get_archived_rides(page=page, limit=self.page_size)
+            new_classes = [
+                cl for cl in pelo_response["data"] if cl["original_air_time"] > high_water_mark
+            ]
+            if not new_classes:
+                break
+            self.upsert({**pelo_response, "data": new_classes})
+
+            reached_stored = len(new_classes) < len(pelo_response["data"])
+            if reached_stored or not pelo_response.get("show_next"):
+                break
+            page += 1
+
+    async def sync(self, api) -> None:
+        """Brings the catalog up to date with the class library.
+
+        Args:
+            api: An `AsyncPelotonAPI` used to request the archive.
+        """
+        async with self._sync_lock:
+            try:
+                high_water_mark = self.high_water_mark
+                if high_water_mark is None or self._get_meta("backfill_complete") is None:
+                    await self._backfill(api)
+                else:
+                    await self._sync_new(api, high_water_mark)
+            except Exception as http_err:
+                logging.error(f'Error occurred syncing the Peloton class catalog. {http_err}')
+                return
+
+            self._set_meta("last_synced_at", time.time())
+
+    async def sync_if_stale(self, api, max_age: float = SYNC_INTERVAL_SECONDS) -> None:
+        """Syncs the catalog if it hasn't been synced within `max_age` seconds."""
+        last_synced_at = self._get_meta("last_synced_at")
+        if last_synced_at is None or time.time() - float(last_synced_at) > max_age:
+            await self.sync(api)
+
+    def changed_since(self, rowid: int = 0) -> list[Dict[Text, Any]]:
+        """Gets the classes stored after a SQLite rowid.
+
+        Classes keep their rowid when they are stored again, so only new
+        classes are picked up.
+
+        Returns:
+            A list of classes with the columns of the `classes` table plus
+            `rowid`, oldest stored first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, * FROM classes WHERE rowid > ? ORDER BY rowid", (rowid,)
+            ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def columns(self) -> CatalogColumns:
+        """Gets the columnar copy of the catalog, adding any classes stored since the last call."""
+        with self._columns_lock:
+            changed = self.changed_since(self._columns.last_rowid)
+            if changed:
+                columns = self._columns.copy()
+                columns.apply(changed)
+                self._columns = columns
+            return self._columns
@@ -0,0 +1,150 @@
+"""Keeps the conversation history sent to the agent inside a token budget.
+
+Every turn used to send back the full history, including each 50 class
+tool result, so the cost of a turn grew with the length of the chat.
+`compact_messages` keeps the most recent turn as it is and shrinks the
+tool results and arguments of older turns to short references. Class tables
+keep their aliases and titles so a workout suggested earlier can still be
+added to the stack. If the history is still over the budget the oldest
+turns are dropped, and as a last resort the recent turn is compacted too.
+"""
+
+import os
+from dataclasses import replace
+from typing import Any
+
+from pydantic_ai.messages import (
+    ArgsJson,
+    Message,
+    ModelStructuredResponse,
+    RetryPrompt,
+    SystemPrompt,
+    ToolReturn,
+    UserPrompt
+)
+
+from prompt_format import compact_table, truncate
+from schemas import RecentUserSummary, WorkoutOption
+from tokens import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+
+# Most tokens of history sent with each turn.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("PELOTON_PAL_HISTORY_TOKENS", "4000"))
+
+# Tool results and arguments smaller than this are kept as they are.
+COMPACT_MIN_TOKENS = 100
+
+# Most characters kept from a summary or other text in a compacted result.
+COMPACT_TEXT_CHARS = 400
+
+COMPACTED_PREFIX = "[Compacted "
+
+
+def _compact_content(message: ToolReturn) -> str:
+    """Renders a tool result as a short reference."""
+    content = message.content
+    note = f"{COMPACTED_PREFIX}{message.tool_name} result, call the tool again for the full details.]"
+
+    if isinstance(content, str):
+        # Class tables keep the aliases and titles, which is enough to stack them.
+        return f"{note}\n{compact_table(content, max_line_chars=COMPACT_TEXT_CHARS)}"
+    if isinstance(content, RecentUserSummary):
+        return f"{note}\n{truncate(content.summary, COMPACT_TEXT_CHARS)}"
+    if isinstance(content, list) and content and all(isinstance(w, WorkoutOption) for w in content):
+        workouts = "\n".join(
+            f"{', '.join(w.class_ids)} | {', '.join(w.titles)} | {w.total_duration} min"
+            for w in content
+        )
+        return f"{note}\nWorkouts (class ids | titles | duration):\n{workouts}"
+
+    return f"{note}\n{truncate(message.model_response_str(), COMPACT_TEXT_CHARS)}"
+
+
+def message_tokens(message: Message) -> int:
+    """Estimates the tokens a message adds to a request."""
+    if isinstance(message, ToolReturn):
+        text = message.model_response_str()
+    elif isinstance(message, RetryPrompt):
+        text = message.model_response()
+    elif isinstance(message, ModelStructuredResponse):
+        text = "".join(call.tool_name + _args_json(call.args) for call in message.calls)
+    else:
+        text = message.content
+
+    return estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _args_json(args: Any) -> str:
+    if isinstance(args, ArgsJson):
+        return args.args_json
+    return ToolReturn("", args.args_dict).model_response_str()
+
+
+def compact_message(message: Message) -> Message:
+    """Shrinks a large tool result or tool call, leaving other messages as they are."""
+    if isinstance(message, ToolReturn):
+        already_compacted = isinstance(message.content, str) and message.content.startswith(COMPACTED_PREFIX)
+        if not already_compacted and estimate_tokens(message.model_response_str()) >= COMPACT_MIN_TOKENS:
+            return replace(message, content=_compact_content(message))
+    elif isinstance(message, ModelStructuredResponse):
+        calls = [
+            replace(call, args=ArgsJson('{"compacted": "arguments removed from the history"}'))
+            if estimate_tokens(_args_json(call.args)) >= COMPACT_MIN_TOKENS else call
+            for call in message.calls
+        ]
+        return replace(message, calls=calls)
+
+    return message
+
+
+def _split_turns(messages: list[Message]) -> tuple[list[Message], list[list[Message]]]:
+    """Splits the history into the system prompts and the turns that start with a user prompt."""
+    system = [message for message in messages if isinstance(message, SystemPrompt)]
+
+    turns = []
+    for message in messages:
+        if isinstance(message, SystemPrompt):
+            continue
+        if isinstance(message, UserPrompt) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+
+    return system, turns
+
+
+def _total_tokens(groups: list[list[Message]]) -> int:
+    return sum(message_tokens(message) for group in groups for message in group)
+
+
+def compact_messages(
+        messages: list[Message],
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        keep_recent_turns: int = 1
+    ) -> list[Message]:
+    """Compacts the conversation history to fit in a token budget.
+
+    Whole turns are dropped rather than single messages so every tool call
+    stays paired with its result.
+
+    Args:
+        messages: The history, i.e. from `all_messages()` of the last run.
+        token_budget: Most tokens of history to keep.
+        keep_recent_turns: Number of the most recent turns left as they are
+            unless the history can't fit the budget otherwise.
+
+    Returns:
+        The compacted history.
+    """
+    system, turns = _split_turns(messages)
+    split = max(len(turns) - keep_recent_turns, 0)
+    older = [[compact_message(message) for message in turn] for turn in turns[:split]]
+    recent = turns[split:]
+
+    while older and _total_tokens([system, *older, *recent]) > token_budget:
+        older.pop(0)
+
+    if _total_tokens([system, *older, *recent]) > token_budget:
+        recent = [[compact_message(message) for message in turn] for turn in recent]
+
+    return [*system, *(message for turn in [*older, *recent] for message in turn)]
+
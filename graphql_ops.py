@@ -0,0 +1,189 @@
+"""GraphQL operations for the Peloton stack.
+
+The documents the web app sends ask for thumbnails, captions, locales,
+timelines and class types, but the stack operations only need a title, a
+join token or the response `__typename`. Each operation here selects just
+the fields its caller reads. The documents are whitespace-compacted and
+hashed once at import. When the gateway supports automatic persisted
+queries, the hash can be sent in place of the document.
+"""
+
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Text
+
+
+@dataclass(frozen=True)
+class GraphQLOperation:
+    """A GraphQL document compacted and hashed for persisted queries."""
+    name: str
+    document: str
+    sha256: str = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "document", " ".join(self.document.split()))
+        object.__setattr__(self, "sha256", hashlib.sha256(self.document.encode()).hexdigest())
+
+    def payload(
+            self,
+            variables: Optional[Dict[Text, Any]] = None,
+            persisted: bool = False,
+            include_document: bool = True
+        ) -> Dict[Text, Any]:
+        """Builds the request body for the operation.
+
+        Args:
+            variables: The operation variables.
+            persisted: Include the persisted query hash.
+            include_document: Include the document. A persisted query can
+                leave it out once the gateway has the hash registered.
+        """
+        body = {
+            "operationName": self.name,
+            "variables": variables or {},
+        }
+
+        if include_document or not persisted:
+            body["query"] = self.document
+
+        if persisted:
+            body["extensions"] = {
+                "persistedQuery": {"version": 1, "sha256Hash": self.sha256}
+            }
+
+        return body
+
+
+VIEW_STACK_TITLES = GraphQLOperation(
+    "ViewUserStack",
+    """
+    query ViewUserStack {
+      viewUserStack {
+        __typename
+        ... on StackResponseSuccess {
+          userStack { stackedClassList { pelotonClass { title } } }
+        }
+      }
+    }
+    """
+)
+
+VIEW_STACK_JOIN_TOKENS = GraphQLOperation(
+    "ViewUserStack",
+    """
+    query ViewUserStack {
+      viewUserStack {
+        __typename
+        ... on StackResponseSuccess {
+          userStack { stackedClassList { pelotonClass { joinToken } } }
+        }
+      }
+    }
+    """
+)
+
+MODIFY_STACK = GraphQLOperation(
+    "ModifyStack",
+    """
+    mutation ModifyStack($input: ModifyStackInput!) {
+      modifyStack(input: $input) {
+        __typename
+        userStack { stackedClassList { pelotonClass { joinToken classId } } }
+      }
+    }
+    """
+)
+
+CLEAR_STACK = GraphQLOperation(
+    "ModifyStack",
+    """
+    mutation ModifyStack($input: ModifyStackInput!) {
+      modifyStack(input: $input) { __typename }
+    }
+    """
+)
+
+ADD_CLASS_TO_STACK = GraphQLOperation(
+    "AddClassToStack",
+    """
+    mutation AddClassToStack($input: AddClassToStackInput!) {
+      addClassToStack(input: $input) { __typename }
+    }
+    """
+)
+
+
+def persisted_query_error(response: Dict[Text, Any]) -> Optional[str]:
+    """Gets the persisted query error code from a response, if there is one.
+
+    Returns:
+        "PERSISTED_QUERY_NOT_FOUND" when the gateway needs the document to
+        register the hash, "PERSISTED_QUERY_NOT_SUPPORTED" when it doesn't
+        support persisted queries, otherwise None.
+    """
+    for error in response.get("errors") or []:
+        code = (error.get("extensions") or {}).get("code") or error.get("message")
+        if code in ("PERSISTED_QUERY_NOT_FOUND", "PersistedQueryNotFound"):
+            return "PERSISTED_QUERY_NOT_FOUND"
+        if code in ("PERSISTED_QUERY_NOT_SUPPORTED", "PersistedQueryNotSupported"):
+            return "PERSISTED_QUERY_NOT_SUPPORTED"
+    return None
+
+
+def _stacked_classes(response: Dict[Text, Any], field_name: str) -> Optional[list[Dict[Text, Any]]]:
+    try:
+        stack = response['data'][field_name]
+        if stack['__typename'] != 'StackResponseSuccess':
+            return None
+        return [cl['pelotonClass'] for cl in stack['userStack']['stackedClassList']]
+    except (KeyError, TypeError):
+        logging.info(f"There was an issue reading the {field_name} response: {response}")
+        return None
+
+
+def parse_stack_titles(response: Dict[Text, Any]) -> Optional[list[str]]:
+    """Gets the titles of the stacked classes from a `VIEW_STACK_TITLES` response."""
+    classes = _stacked_classes(response, 'viewUserStack')
+    return None if classes is None else [cl['title'] for cl in classes]
+
+
+def parse_stack_join_tokens(response: Dict[Text, Any]) -> Optional[list[str]]:
+    """Gets the join tokens of the stacked classes from a `VIEW_STACK_JOIN_TOKENS` response."""
+    classes = _stacked_classes(response, 'viewUserStack')
+    return None if classes is None else [cl['joinToken'] for cl in classes]
+
+
+def parse_success(response: Dict[Text, Any], field_name: str) -> bool:
+    """Checks a mutation response for a `StackResponseSuccess`."""
+    try:
+        return response['data'][field_name]['__typename'] == 'StackResponseSuccess'
+    except (KeyError, TypeError):
+        logging.info(f"There was an issue with the {field_name} request: {response}")
+        return False
+
+
+def parse_stack_results(
+        response: Dict[Text, Any],
+        join_tokens: Dict[Text, Optional[str]]
+    ) -> Dict[Text, bool]:
+    """Reports for each ride ID whether it is in the stack returned by `MODIFY_STACK`.
+
+    Args:
+        response: The ModifyStack GraphQL response.
+        join_tokens: Map of ride ID to its join token, or None if the join
+            token could not be resolved.
+    """
+    classes = _stacked_classes(response, 'modifyStack')
+    if classes is None:
+        return {ride_id: False for ride_id in join_tokens}
+
+    stacked_ids = set()
+    for cl in classes:
+        stacked_ids.add(cl.get('joinToken'))
+        stacked_ids.add(cl.get('classId'))
+
+    return {
+        ride_id: token is not None and (token in stacked_ids or ride_id in stacked_ids)
+        for ride_id, token in join_tokens.items()
+    }
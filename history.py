@@ -0,0 +1,255 @@
+"""Local store of each user's Peloton workout history.
+
+Workouts are synced newest first from `/api/user/{user_id}/workouts` and
+the sync stops as soon as it reaches a workout that is already stored, so
+a refresh only downloads the workouts done since the last one. The classes
+taken are flattened into a row per workout so the history can be queried
+by date without the joined ride payloads.
+"""
+
+import asyncio
+import datetime
+import logging
+import threading
+from typing import Any, Dict, Optional, Text, Union
+
+import storage
+
+
+# Number of workouts requested for each page of the history.
+PAGE_SIZE = 20
+
+# Most workouts downloaded the first time a user's history is synced.
+INITIAL_SYNC_LIMIT = 100
+
+
+def _timestamp(value: Union[datetime.datetime, datetime.date, float, int]) -> float:
+    """Converts a date, datetime or epoch timestamp to an epoch timestamp."""
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time()).timestamp()
+    return float(value)
+
+
+def flatten_workout(workout: Dict[Text, Any]) -> Dict[Text, Any]:
+    """Pulls the class details out of a workout from the workouts endpoint.
+
+    Classes taken with an instructor come from the joined `peloton.ride` and
+    only have an `instructor_id`, other workouts (i.e. Just Ride) have the
+    instructor name on the `ride`.
+    """
+    if workout.get("peloton"):
+        ride = workout["peloton"]["ride"]
+        description = ride["description"]
+        instructor_id = ride.get("instructor_id")
+        instructor = None
+    else:
+        ride = workout["ride"]
+        description = ride["title"]
+        instructor_id = None
+        instructor = (ride.get("instructor") or {}).get("name")
+
+    return {
+        "id": workout["id"],
+        "created_at": workout["created_at"],
+        "start_time": workout["start_time"],
+        "fitness_discipline": workout["fitness_discipline"],
+        "name": workout["name"],
+        "ride_id": ride["id"],
+        "title": ride["title"],
+        "description": description,
+        "instructor_id": instructor_id,
+        "instructor": instructor,
+        "duration": ride.get("duration") or 0,
+        "difficulty": ride.get("difficulty_rating_avg") or ride.get("difficulty_estimate"),
+    }
+
+
+class WorkoutHistory:
+    """SQLite backed store of the workouts for each user.
+
+    Args:
+        name: File name of the database in the cache directory.
+        page_size: Number of workouts requested for each page of the history.
+        initial_sync_limit: Most workouts downloaded the first time a user's
+            history is synced.
+    """
+
+    def __init__(
+            self,
+            name: str = "workouts.sqlite",
+            page_size: int = PAGE_SIZE,
+            initial_sync_limit: int = INITIAL_SYNC_LIMIT
+        ):
+
+        self.page_size = page_size
+        self.initial_sync_limit = initial_sync_limit
+        self._lock = threading.Lock()
+        self._sync_locks = {}
+        self._conn = storage.connect(name)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS workouts (
+                user_id TEXT NOT NULL,
+                id TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                start_time INTEGER NOT NULL,
+                fitness_discipline TEXT NOT NULL,
+                name TEXT NOT NULL,
+                ride_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                description TEXT NOT NULL,
+                instructor_id TEXT,
+                instructor TEXT,
+                duration INTEGER NOT NULL,
+                difficulty REAL,
+                PRIMARY KEY (user_id, id)
+            );
+            CREATE INDEX IF NOT EXISTS workouts_user_start_time
+                ON workouts (user_id, start_time);
+            """
+        )
+
+    def _stored_ids(self, user_id: str, workout_ids: list[str]) -> set[str]:
+        """Gets the workout IDs that are already stored for the user."""
+        if not workout_ids:
+            return set()
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id FROM workouts WHERE user_id = ? AND id IN ({','.join('?' * len(workout_ids))})",
+                (user_id, *workout_ids)
+            ).fetchall()
+        return {row["id"] for row in rows}
+
+    def _is_empty(self, user_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM workouts WHERE user_id = ? LIMIT 1", (user_id,)
+            ).fetchone()
+        return row is None
+
+    def add(self, user_id: str, workouts: list[Dict[Text, Any]]) -> int:
+        """Stores workouts from the workouts endpoint for the user.
+
+        Workouts that can't be read are logged and skipped, so one bad
+        workout doesn't stop the rest from being stored.
+
+        Returns:
+            The number of workouts stored.
+        """
+        rows = []
+        for workout in workouts:
+            try:
+                rows.append({"user_id": user_id, **flatten_workout(workout)})
+            except (KeyError, TypeError) as err:
+                logging.error(f'Error occurred reading Peloton workout {workout.get("id")}. {err}')
+        if not rows:
+            return 0
+
+        columns = list(rows[0])
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO workouts ({','.join(columns)}) "
+                f"VALUES ({','.join(':' + column for column in columns)})",
+                rows
+            )
+
+        return len(rows)
+
+    async def sync(self, api, user_id: str) -> int:
+        """Downloads the user's workouts done since the last sync.
+
+        The pages are walked from the newest until a stored workout, the
+        last page or the limit, and only then stored. If a page fails
+        nothing is stored and the next sync starts over.
+
+        Args:
+            api: An `AsyncPelotonAPI` used to request the workouts.
+            user_id: The Peloton user ID.
+
+        Returns:
+            The number of new workouts stored.
+        """
+        lock = self._sync_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            # SQLite calls block, so keep them off the event loop every session shares.
+            is_empty = await asyncio.to_thread(self._is_empty, user_id)
+            limit = self.initial_sync_limit if is_empty else None
+
+            new_workouts = []
+            page = 0
+            while True:
+                pelo_response = await api.get_user_workouts(
+                    user_id, page=page, limit=self.page_size
+                )
+                if pelo_response is None:
+                    # Storing the newer pages alone would make the next sync
+                    # stop at them and never fetch the rest, so store nothing.
+                    logging.error(f'Error occurred syncing the workouts of {user_id} at page {page}.')
+                    return 0
+
+                stored_ids = await asyncio.to_thread(
+                    self._stored_ids, user_id, [workout["id"] for workout in pelo_response["data"]]
+                )
+                reached_stored = False
+                for workout in pelo_response["data"]:
+                    if workout["id"] in stored_ids:
+                        reached_stored = True
+                        break
+                    new_workouts.append(workout)
+
+                if (
+                    reached_stored
+                    or not pelo_response.get("show_next")
+                    or (limit is not None and len(new_workouts) >= limit)
+                ):
+                    break
+                page += 1
+
+            # Only stored once the walk reached the stored workouts, the
+            # last page or the limit.
+            return await asyncio.to_thread(self.add, user_id, new_workouts)
+
+    def between(
+            self,
+            user_id: str,
+            start: Optional[Union[datetime.datetime, datetime.date, float]] = None,
+            end: Optional[Union[datetime.datetime, datetime.date, float]] = None,
+            limit: Optional[int] = None
+        ) -> list[Dict[Text, Any]]:
+        """Gets the user's stored workouts started in a date window, newest first.
+
+        Args:
+            user_id: The Peloton user ID.
+            start: Only include workouts started at or after this time.
+            end: Only include workouts started before this time.
+            limit: Maximum number of workouts returned, or None for no limit.
+
+        Returns:
+            A list of workouts with the keys from `flatten_workout`.
+        """
+        sql = "SELECT * FROM workouts WHERE user_id = ?"
+        params = [user_id]
+
+        if start is not None:
+            sql += " AND start_time >= ?"
+            params.append(_timestamp(start))
+        if end is not None:
+            sql += " AND start_time < ?"
+            params.append(_timestamp(end))
+
+        sql += " ORDER BY start_time DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def recent(self, user_id: str, limit: int = 30) -> list[Dict[Text, Any]]:
+        """Gets the user's most recent stored workouts, newest first."""
+        return self.between(user_id, limit=limit)
@@ -1,38 +1,162 @@
-"""Interfaces with the PelotonAPI to leverage Streamlit's caching.
+"""Cached interfaces to the Peloton API clients.
 
-Streamlit cannot directly cache a custom class so these interfaces have
-a custom hash function defined for the custom class to allow caching the 
-custom class.
+The instructor list is the same for every account, so it is kept in a
+bounded in-memory cache with a short TTL and shared by every session. The
+clients read it from their `ReferenceDataStore`, if they have one, which
+revalidates it with conditional requests, so the cache only saves the
+lookup in the store. Entries are sized by their JSON length and the least
+recently used are evicted once the cache is full, so memory stays flat as
+the number of users grows. Workouts and classes aren't cached here, they
+are synced into `WorkoutHistory` and `ClassCatalog`.
 
-https://docs.streamlit.io/develop/concepts/architecture/caching#example-1-hashing-a-custom-class
+`cached` works for both `PelotonAPI` and `AsyncPelotonAPI`. For the async
+client the awaited result is cached rather than the coroutine.
 """
 
-import streamlit as st
-from peloton import PelotonAPI
+import asyncio
+import json
+import logging
+import threading
+from functools import wraps
+from typing import Any, Dict, Text, Tuple
 
+from cachetools import TTLCache
 
-def hash_func(obj: PelotonAPI) -> str:
-    return ""
+from peloton import AsyncPelotonAPI
 
 
-@st.cache_data(hash_funcs={PelotonAPI: hash_func})
-def get_user_workouts(
-    obj: PelotonAPI,
-    user_id: str,
-    page: str = 0
-):
-    return obj.get_user_workouts(user_id, page)
+# Time to live of the instructor list, in seconds. Kept well under the
+# `ReferenceDataStore` revalidation age, so the store's conditional
+# requests decide when the list is stale.
+INSTRUCTORS_TTL = 60 * 60
 
+# Most JSON characters the instructor cache holds before evicting entries.
+INSTRUCTORS_MAX_SIZE = 2_000_000
 
-@st.cache_data(hash_funcs={PelotonAPI: hash_func})
-def get_instructor_list(
-    obj: PelotonAPI,
-):
-    return obj.get_instructor_list()
+
+def _json_size(value: Any) -> int:
+    """Approximates the memory used by a response with its JSON length."""
+    return len(json.dumps(value, default=str))
+
+
+class ResponseCache:
+    """Thread safe, size bounded TTL cache that counts hits and misses.
+
+    Args:
+        name: Name of the cache in the statistics.
+        ttl: Seconds an entry is served for.
+        max_size: Most JSON characters held before the least recently used
+            entries are evicted.
+    """
+
+    def __init__(self, name: str, ttl: float, max_size: int):
+
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = TTLCache(maxsize=max_size, ttl=ttl, getsizeof=_json_size)
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Tuple[bool, Any]:
+        """Gets an entry, returning whether it was found and its value."""
+        with self._lock:
+            try:
+                value = self._cache[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, value
+
+    def put(self, key: Tuple, value: Any) -> None:
+        """Stores an entry, unless it is larger than the whole cache."""
+        with self._lock:
+            try:
+                self._cache[key] = value
+            except ValueError:
+                logging.info(f"Response too large for the {self.name} cache.")
+
+    def clear(self) -> None:
+        """Removes all the entries and resets the statistics."""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[Text, Any]:
+        """Gets the hit and miss counts and current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._cache),
+                "size": self._cache.currsize,
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
+
+
+instructors_cache = ResponseCache("instructors", INSTRUCTORS_TTL, INSTRUCTORS_MAX_SIZE)
+
+
+def cached(cache: ResponseCache):
+    """Caches the result of an interface in `cache`.
+
+    The client is left out of the cache key, so only cache data that is
+    the same for every account. Failed requests (None) are not cached so
+    the next call retries.
+
+    Args:
+        cache: The cache the results are stored in.
+    """
+    def decorator(func):
+
+        def make_key(obj, args) -> Tuple:
+            return (func.__name__, *args)
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(obj, *args):
+                key = make_key(obj, args)
+                found, value = cache.get(key)
+                if found:
+                    return value
+
+                value = await func(obj, *args)
+                if value is not None:
+                    cache.put(key, value)
+                return value
+        else:
+            @wraps(func)
+            def wrapper(obj, *args):
+                key = make_key(obj, args)
+                found, value = cache.get(key)
+                if found:
+                    return value
+
+                value = func(obj, *args)
+                if value is not None:
+                    cache.put(key, value)
+                return value
+
+        wrapper.cache = cache
+        wrapper.clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def cache_stats() -> Dict[Text, Dict[Text, Any]]:
+    """Gets the statistics of every interface cache by name."""
+    return {cache.name: cache.stats() for cache in (instructors_cache,)}
 
 
-@st.cache_data(hash_funcs={PelotonAPI: hash_func})
-def get_available_classes(
-    obj: PelotonAPI
+@cached(instructors_cache)
+async def get_instructor_list_async(
+    obj: AsyncPelotonAPI,
 ):
-    return obj.get_recent_classes()
+    return await obj.get_instructor_list()
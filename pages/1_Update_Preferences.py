@@ -2,6 +2,7 @@ import json
 from pathlib import Path
 import streamlit as st
 import interface
+import runtime
 from schemas import UserWorkoutPreferences
 
 st.title("Update your Peloton Preferences")
@@ -65,7 +66,9 @@ disliked_disciplines = st.multiselect(
 )
 
 # get the list of instructors to include in the choices.
-instructor_map = interface.get_instructor_list(st.session_state["pelo_interface"])
+instructor_map = runtime.run(
+    interface.get_instructor_list_async(st.session_state["pelo_async"])
+)
 favorite_instructors = st.multiselect(
     label="Who are your favorite instructors?",
     options=instructor_map.values(),
@@ -0,0 +1,48 @@
+import datetime
+import pandas as pd
+import streamlit as st
+import interface
+import runtime
+from analytics import build_digest, DIGEST_DAYS
+
+st.title("Your Recent Workouts")
+
+
+history = st.session_state["workout_history"]
+user_id = st.session_state["pelo_user_id"]
+
+# Pick up any new workouts before building the stats.
+runtime.run(history.sync(st.session_state["pelo_async"], user_id))
+instructor_map = runtime.run(
+    interface.get_instructor_list_async(st.session_state["pelo_async"])
+)
+
+workouts = history.between(
+    user_id,
+    start=datetime.date.today() - datetime.timedelta(days=DIGEST_DAYS - 1)
+)
+digest = build_digest(workouts, st.session_state["user_preferences"], instructor_map)
+
+st.caption(f"LAST {digest.period_days} DAYS")
+workouts_col, minutes_col, rest_col = st.columns(3)
+workouts_col.metric("Workouts", digest.total_workouts)
+minutes_col.metric("Minutes", f"{digest.total_minutes:g}")
+rest_col.metric("Rest Days", digest.rest_days)
+
+if digest.weekly_minutes:
+    st.subheader("Minutes by discipline each week")
+    st.bar_chart(pd.DataFrame(digest.weekly_minutes).T.fillna(0))
+
+if digest.average_difficulty is not None:
+    st.metric(
+        "Average Difficulty",
+        f"{digest.average_difficulty:g}",
+        delta=None if digest.intensity_trend is None else f"{digest.intensity_trend:+g} per week"
+    )
+
+if digest.instructor_counts:
+    st.subheader("Instructors")
+    st.bar_chart(pd.Series(digest.instructor_counts, name="Workouts"))
+
+if digest.goal_gaps:
+    st.warning(f"No recent workouts for your goals: {', '.join(digest.goal_gaps)}")
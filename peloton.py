@@ -1,15 +1,56 @@
-from typing import Any, Dict, Text, Optional
+from typing import Any, Callable, Dict, Text, Optional
 import os
+import asyncio
+import threading
 import requests
+import httpx
 import json
 import logging
-from dotenv import load_dotenv
-load_dotenv()
+import re
+from urllib.parse import urlparse
 
+import graphql_ops
+import telemetry
 
 
-PELOTON_API_ROOT = "https://api.onepeloton.com"
-PELOTON_GRAPHQL_ROOT = "https://gql-graphql-gateway.prod.k8s.onepeloton.com/graphql"
+# Roots of the Peloton APIs. Set PELOTON_API_ROOT and PELOTON_GRAPHQL_ROOT to 
+# point the app at another server, such as the benchmark mock.
+PELOTON_API_ROOT = os.environ.get("PELOTON_API_ROOT", "https://api.onepeloton.com")
+PELOTON_GRAPHQL_ROOT = os.environ.get(
+    "PELOTON_GRAPHQL_ROOT", "https://gql-graphql-gateway.prod.k8s.onepeloton.com/graphql"
+)
+
+# Bounds for the keep-alive connection pool used by the async client.
+MAX_CONNECTIONS = 10
+MAX_KEEPALIVE_CONNECTIONS = 10
+
+# Send GraphQL document hashes instead of the documents (automatic persisted queries).
+PERSISTED_QUERIES = os.environ.get("PELOTON_PERSISTED_QUERIES", "").lower() in ("1", "true")
+
+
+# User and ride IDs in a path, replaced so requests are grouped by endpoint.
+_PATH_IDS = re.compile(r"(?<=/api/user/|/api/ride/)[^/]+")
+
+
+def _route(method: str, url: str) -> str:
+    """Names a request by its method and path, leaving out the query and IDs."""
+    return f"{method} {_PATH_IDS.sub('{id}', urlparse(url).path)}"
+
+
+def _request_bytes(kwargs: Dict[Text, Any]) -> int:
+    """Gets the size of the body of a request."""
+    if kwargs.get("json") is not None:
+        return len(json.dumps(kwargs["json"]))
+    return len(kwargs.get("content") or kwargs.get("data") or b"")
+
+
+def _merge_join_tokens(current: list[str], new: list[str]) -> list[str]:
+    """Appends `new` join tokens to the `current` stack, skipping duplicates."""
+    merged = list(current)
+    for token in new:
+        if token not in merged:
+            merged.append(token)
+    return merged
 
 
 class PelotonAPI:
@@ -17,12 +58,36 @@ class PelotonAPI:
 
     A common interface for interacting with the Peloton API. The class sets up 
     a requests Session that once authenticated will be the source of all API 
-    calls to Peloton.
+    calls to Peloton. If the session expires the user is authenticated again 
+    and the request is retried.
+
+    Args:
+        username: The Peloton username or email. Defaults to `PELOTON_USER`.
+        password: The Peloton password. Defaults to `PELOTON_PASS`.
+        cookies: Optional cookies from a previously authenticated session.
+        on_authenticate: Optional callback called with the session cookies 
+            after each successful login.
+        persisted_queries: Send GraphQL document hashes instead of the 
+            documents. Defaults to `PELOTON_PERSISTED_QUERIES`.
     """
 
-    def __init__(self):
+    def __init__(
+            self,
+            username: Optional[str] = None,
+            password: Optional[str] = None,
+            cookies: Optional[Any] = None,
+            on_authenticate: Optional[Callable[[Any], None]] = None,
+            persisted_queries: bool = PERSISTED_QUERIES
+        ):
 
         self.sess = requests.Session()
+        if cookies is not None:
+            self.sess.cookies.update(cookies)
+        self.username = username
+        self.password = password
+        self.on_authenticate = on_authenticate
+        self.persisted_queries = persisted_queries
+        self._auth_lock = threading.Lock()
 
     def authenticate(self) -> requests.Response:
         """Authenticates the user with the Peloton API and creates a new session.
@@ -30,17 +95,46 @@ class PelotonAPI:
         The user_id in the response is needed to make other API calls.
         """
         payload = {
-            "username_or_email": os.environ["PELOTON_USER"],
-            "password": os.environ["PELOTON_PASS"]
+            "username_or_email": self.username or os.environ["PELOTON_USER"],
+            "password": self.password or os.environ["PELOTON_PASS"]
         }
 
-        response = self.sess.post(
-            f"{PELOTON_API_ROOT}/auth/login",
-            data=json.dumps(payload)
-        )
+        url = f"{PELOTON_API_ROOT}/auth/login"
+        with telemetry.span(_route("POST", url), kind="http") as span:
+            response = self.sess.post(url, data=json.dumps(payload))
+            span.set(status_code=response.status_code, response_bytes=len(response.content))
+
+        if response.ok and self.on_authenticate is not None:
+            self.on_authenticate(self.sess.cookies)
+
+        return response
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Makes a request, authenticating again and retrying once on a 401."""
+        with telemetry.span(_route(method, url), kind="http", request_bytes=_request_bytes(kwargs)) as span:
+            cookies_before = self.sess.cookies.get_dict()
+            response = self.sess.request(method, url, **kwargs)
+
+            if response.status_code == 401:
+                with self._auth_lock:
+                    # Another thread may have already refreshed the session.
+                    if self.sess.cookies.get_dict() == cookies_before:
+                        logging.info("Peloton session expired, authenticating again.")
+                        self.authenticate()
+                response = self.sess.request(method, url, **kwargs)
+                span.set(retries=1)
+
+            span.set(status_code=response.status_code, response_bytes=len(response.content))
 
         return response
 
+    def get_me(self) -> Dict[Text, Any]:
+        """Gets the profile of the authenticated user, including their `id`."""
+        response = self._request("GET", f"{PELOTON_API_ROOT}/api/me")
+        response.raise_for_status()
+
+        return response.json()
+
     def get_recent_classes(self, fitness_discipline: Optional[str] = None) -> Dict[Text, Any]:
         """Get recent Peloton classes.
         
@@ -66,7 +160,7 @@ class PelotonAPI:
         if fitness_discipline:
             params['browse_category'] = fitness_discipline
 
-        response = self.sess.get(f"{PELOTON_API_ROOT}/api/v2/ride/archived",
+        response = self._request("GET", f"{PELOTON_API_ROOT}/api/v2/ride/archived",
                                  params=params)
 
         return response.json()
@@ -89,7 +183,8 @@ class PelotonAPI:
             }
 
             try:
-                response = self.sess.get(
+                response = self._request(
+                    "GET",
                     f"{PELOTON_API_ROOT}/api/instructor",
                     params=params
                 )
@@ -149,7 +244,8 @@ class PelotonAPI:
             }
 
             try:
-                response = self.sess.get(
+                response = self._request(
+                    "GET",
                     f"{PELOTON_API_ROOT}/api/user/{user_id}/workouts",
                     params=params
                 )
@@ -167,7 +263,7 @@ class PelotonAPI:
     def convert_ride_to_class_id(self, ride_id: str) -> str:
         """Get details about a specific class.
         """
-        response = self.sess.get(f"{PELOTON_API_ROOT}/api/ride/{ride_id}/details")
+        response = self._request("GET", f"{PELOTON_API_ROOT}/api/ride/{ride_id}/details")
 
         ride_detail = response.json()
 
@@ -178,14 +274,14 @@ class PelotonAPI:
         payload = {
             "ride_id": id
         }
-        response = self.sess.post(f"{PELOTON_API_ROOT}/api/favorites/create",
-                                  data=json.dumps(payload))
+        response = self._request("POST", f"{PELOTON_API_ROOT}/api/favorites/create",
+                                 data=json.dumps(payload))
 
         return response
 
     def categories(self) -> Dict[Text, Any]:
         """Gets a list of Peloton fitness disciplines."""
-        response = self.sess.get(f"{PELOTON_API_ROOT}/api/browse_categories?library_type=on_demand")
+        response = self._request("GET", f"{PELOTON_API_ROOT}/api/browse_categories?library_type=on_demand")
         return response.json()
 
     def get_stack(self) -> str:
@@ -199,26 +295,11 @@ class PelotonAPI:
             Each class is separated by a newline character.
         
         """
-        query = {
-            "query": "query ViewUserStack {\n  viewUserStack {\n    numClasses\n    totalTime\n    ... on StackResponseSuccess {\n      numClasses\n      totalTime\n      userStack {\n        stackedClassList {\n          playOrder\n          pelotonClass {\n            joinToken\n            title\n            classId\n            fitnessDiscipline {\n              slug\n              __typename\n            }\n            assets {\n              thumbnailImage {\n                location\n                __typename\n              }\n              __typename\n            }\n            duration\n            ... on OnDemandInstructorClass {\n              joinToken\n              title\n              fitnessDiscipline {\n                slug\n                displayName\n                __typename\n              }\n              contentFormat\n              totalUserWorkouts\n              originLocale {\n                language\n                __typename\n              }\n              captions {\n                locales\n                __typename\n              }\n              timeline {\n                startOffset\n                __typename\n              }\n              difficultyLevel {\n                slug\n                displayName\n                __typename\n              }\n              airTime\n              instructor {\n                name\n                __typename\n              }\n              __typename\n            }\n            classTypes {\n              name\n              __typename\n            }\n            playableOnPlatform\n            contentAvailability\n            isLimitedRide\n            freeForLimitedTime\n            __typename\n          }\n          __typename\n        }\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}\n",
-            "operationName":"ViewUserStack",
-            "variables":{}
-        }
-
-        headers = {
-            'peloton-platform': 'web'
-        }
-
-        response = self.sess.post(PELOTON_GRAPHQL_ROOT, json=query, headers=headers).json()
-
-        if response['data']['viewUserStack']['__typename'] != 'StackResponseSuccess':
+        titles = graphql_ops.parse_stack_titles(self._graphql(graphql_ops.VIEW_STACK_TITLES))
+        if titles is None:
             return None
 
-        classes_in_stack = []
-        for cl in response['data']['viewUserStack']['userStack']['stackedClassList']:
-            classes_in_stack.append(cl["pelotonClass"]['title'])
-
-        return "\n".join(classes_in_stack)
+        return "\n".join(titles)
 
     def clear_stack(self) -> bool:
         """Clears all the classes in a user's Peloton stack.
@@ -230,30 +311,11 @@ class PelotonAPI:
             True if classes were successfully deleted or False if there is an 
             issue clearing the classes.
         """
-        query = {
-            "query": "mutation ModifyStack($input: ModifyStackInput!) {\n  modifyStack(input: $input) {\n    numClasses\n    totalTime\n    userStack {\n      stackedClassList {\n        playOrder\n        pelotonClass {\n          ...ClassDetails\n          __typename\n        }\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment ClassDetails on PelotonClass {\n  joinToken\n  title\n  classId\n  fitnessDiscipline {\n    slug\n    __typename\n  }\n  assets {\n    thumbnailImage {\n      location\n      __typename\n    }\n    __typename\n  }\n  duration\n  ... on OnDemandInstructorClass {\n    title\n    fitnessDiscipline {\n      slug\n      displayName\n      __typename\n    }\n    contentFormat\n    difficultyLevel {\n      slug\n      displayName\n      __typename\n    }\n    airTime\n    instructor {\n      name\n      __typename\n    }\n    __typename\n  }\n  classTypes {\n    name\n    __typename\n  }\n  playableOnPlatform\n  contentAvailability\n  isLimitedRide\n  freeForLimitedTime\n  __typename\n}\n",
-            "operationName": "ModifyStack",
-            "variables": {
-                "input": {
-                    "pelotonClassIdList": []
-                }
-            }
-        }
-
-        headers = {
-            'peloton-platform': 'web'
-        }
-
-        response = self.sess.post(PELOTON_GRAPHQL_ROOT, json=query, headers=headers).json()
-
-        try:
-            if response['data']['modifyStack']['__typename'] != 'StackResponseSuccess':
-                return False
-        except KeyError:
-            logging.info(f"There was an issue with the clear_stack request: {response}")
-            return False
+        response = self._graphql(
+            graphql_ops.CLEAR_STACK, {"input": {"pelotonClassIdList": []}}
+        )
 
-        return True
+        return graphql_ops.parse_success(response, 'modifyStack')
 
     def stack_class(self, class_id: str) -> bool:
         """Adds the specified class_id to the user's Peloton stack.
@@ -264,24 +326,479 @@ class PelotonAPI:
         Returns:
             True if adding the class was successful. Otherwise returns False.
         """
-        query = {
-            "query": "mutation AddClassToStack($input: AddClassToStackInput!) {\n  addClassToStack(input: $input) {\n    numClasses\n    totalTime\n    userStack {\n      stackedClassList {\n        playOrder\n        pelotonClass {\n          ...ClassDetails\n          __typename\n        }\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment ClassDetails on PelotonClass {\n  joinToken\n  title\n  classId\n  fitnessDiscipline {\n    slug\n    __typename\n  }\n  assets {\n    thumbnailImage {\n      location\n      __typename\n    }\n    __typename\n  }\n  duration\n  ... on OnDemandInstructorClass {\n    title\n    fitnessDiscipline {\n      slug\n      displayName\n      __typename\n    }\n    contentFormat\n    difficultyLevel {\n      slug\n      displayName\n      __typename\n    }\n    airTime\n    instructor {\n      name\n      __typename\n    }\n    __typename\n  }\n  classTypes {\n    name\n    __typename\n  }\n  playableOnPlatform\n  contentAvailability\n  isLimitedRide\n  freeForLimitedTime\n  __typename\n}\n",
-            "operationName": "AddClassToStack",
-            "variables": {
-                "input": {
-                    "pelotonClassId": f"{class_id}"
-                }
-            }
+        response = self._graphql(
+            graphql_ops.ADD_CLASS_TO_STACK, {"input": {"pelotonClassId": f"{class_id}"}}
+        )
+
+        # Check if the class was successfully added to the stack.
+        return graphql_ops.parse_success(response, 'addClassToStack')
+
+    def _graphql(
+            self,
+            operation: graphql_ops.GraphQLOperation,
+            variables: Optional[Dict[Text, Any]] = None
+        ) -> Dict[Text, Any]:
+        """Posts a GraphQL operation to the Peloton gateway.
+
+        With persisted queries on, only the document hash is sent. The 
+        document is sent as well if the gateway hasn't seen the hash yet, 
+        and persisted queries are turned off if the gateway doesn't 
+        support them.
+        """
+        headers = {
+            'peloton-platform': 'web'
+        }
+
+        with telemetry.span(f"graphql {operation.name}", kind="graphql") as span:
+            if self.persisted_queries:
+                payload = operation.payload(variables, persisted=True, include_document=False)
+                response = self._request("POST", PELOTON_GRAPHQL_ROOT, json=payload, headers=headers).json()
+
+                error = graphql_ops.persisted_query_error(response)
+                if error is None:
+                    return response
+                if error == "PERSISTED_QUERY_NOT_SUPPORTED":
+                    logging.info("Persisted queries are not supported, sending the full documents.")
+                    self.persisted_queries = False
+                span.set(retries=1)
+
+            payload = operation.payload(variables, persisted=self.persisted_queries)
+
+            return self._request("POST", PELOTON_GRAPHQL_ROOT, json=payload, headers=headers).json()
+
+
+class AsyncPelotonAPI:
+    """Async interface for making calls to the Peloton API.
+
+    Mirrors the endpoints of `PelotonAPI` on top of an `httpx.AsyncClient` 
+    with a bounded keep-alive connection pool so independent requests can 
+    be made concurrently. The client is bound to the running event loop and 
+    is rebuilt, keeping the session cookies, if it is used from a new loop.
+
+    Args:
+        cookies: Optional cookies from an already authenticated session 
+            (i.e. `PelotonAPI.sess.cookies`) so a second login is not needed.
+        max_connections: Maximum number of concurrent connections.
+        max_keepalive_connections: Maximum number of idle connections kept 
+            alive in the pool.
+        ride_cache: Optional `RideDetailCache` consulted before requesting 
+            ride details.
+        username: The Peloton username or email. Defaults to `PELOTON_USER`.
+        password: The Peloton password. Defaults to `PELOTON_PASS`.
+        on_authenticate: Optional callback called with the session cookies 
+            after each successful login.
+        persisted_queries: Send GraphQL document hashes instead of the 
+            documents. Defaults to `PELOTON_PERSISTED_QUERIES`.
+        reference_data: Optional `ReferenceDataStore` that serves and 
+            revalidates the instructor list.
+    """
+
+    def __init__(
+            self,
+            cookies: Optional[Any] = None,
+            max_connections: int = MAX_CONNECTIONS,
+            max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+            ride_cache: Optional[Any] = None,
+            username: Optional[str] = None,
+            password: Optional[str] = None,
+            on_authenticate: Optional[Callable[[Any], None]] = None,
+            persisted_queries: bool = PERSISTED_QUERIES,
+            reference_data: Optional[Any] = None
+        ):
+
+        self.username = username
+        self.password = password
+        self.on_authenticate = on_authenticate
+        self.persisted_queries = persisted_queries
+        self._auth_lock = None
+        self.cookies = httpx.Cookies(cookies)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.ride_cache = ride_cache
+        self.reference_data = reference_data
+        self._client = None
+        self._loop = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled client for the currently running event loop."""
+        loop = asyncio.get_running_loop()
+
+        if self._client is None or self._loop is not loop:
+            # Connections can't be shared across loops, but the session can.
+            if self._client is not None:
+                self.cookies = self._client.cookies
+
+            self._client = httpx.AsyncClient(
+                cookies=self.cookies,
+                limits=self.limits,
+                timeout=30
+            )
+            self._loop = loop
+
+        return self._client
+
+    def update_cookies(self, jar) -> None:
+        """Copies cookies into the session, i.e. after another client logged in."""
+        for cookie in jar:
+            self.cookies.jar.set_cookie(cookie)
+            if self._client is not None:
+                self._client.cookies.jar.set_cookie(cookie)
+
+    async def aclose(self) -> None:
+        """Closes the pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    async def authenticate(self) -> httpx.Response:
+        """Authenticates the user with the Peloton API and creates a new session.
+
+        The user_id in the response is needed to make other API calls.
+        """
+        payload = {
+            "username_or_email": self.username or os.environ["PELOTON_USER"],
+            "password": self.password or os.environ["PELOTON_PASS"]
+        }
+
+        url = f"{PELOTON_API_ROOT}/auth/login"
+        with telemetry.span(_route("POST", url), kind="http") as span:
+            response = await self.client.post(url, content=json.dumps(payload))
+            span.set(status_code=response.status_code, response_bytes=len(response.content))
+
+        if response.is_success and self.on_authenticate is not None:
+            self.on_authenticate(self.client.cookies.jar)
+
+        return response
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Makes a request, authenticating again and retrying once on a 401."""
+        client = self.client
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+
+        with telemetry.span(_route(method, url), kind="http", request_bytes=_request_bytes(kwargs)) as span:
+            cookies_before = [(c.name, c.value) for c in client.cookies.jar]
+            response = await client.request(method, url, **kwargs)
+
+            if response.status_code == 401:
+                async with self._auth_lock:
+                    # Another request may have already refreshed the session.
+                    if [(c.name, c.value) for c in self.client.cookies.jar] == cookies_before:
+                        logging.info("Peloton session expired, authenticating again.")
+                        await self.authenticate()
+                response = await self.client.request(method, url, **kwargs)
+                span.set(retries=1)
+
+            span.set(status_code=response.status_code, response_bytes=len(response.content))
+
+        return response
+
+    @telemetry.traced("peloton")
+    async def get_me(self) -> Dict[Text, Any]:
+        """Gets the profile of the authenticated user, including their `id`."""
+        response = await self._request("GET", f"{PELOTON_API_ROOT}/api/me")
+        response.raise_for_status()
+
+        return response.json()
+
+    @telemetry.traced("peloton")
+    async def get_archived_rides(
+            self,
+            page: int = 0,
+            limit: int = 50,
+            browse_category: Optional[str] = None
+        ) -> Dict[Text, Any]:
+        """Get a page of the on demand class library, newest classes first.
+
+        Args:
+            page: The page number for the results to retrieve.
+            limit: The number of classes on each page.
+            browse_category: An optional value to filter the class results 
+                to be for a single discipline.
+
+        Returns:
+            A JSON object with the class information. The `data` key has the 
+            classes on the page, `instructors` the instructors teaching them 
+            and `page_count` the total number of pages.
+        """
+        params = {
+            "page": page,
+            "limit": limit,
+            "sort_by": "original_air_time",
+            "desc": True
         }
 
+        if browse_category:
+            params['browse_category'] = browse_category
+
+        response = await self._request("GET", f"{PELOTON_API_ROOT}/api/v2/ride/archived",
+                                       params=params)
+        response.raise_for_status()
+
+        return response.json()
+
+    async def conditional_get(
+            self,
+            url: str,
+            etag: Optional[str] = None,
+            last_modified: Optional[str] = None
+        ) -> httpx.Response:
+        """Makes a GET request that the server can answer with 304 Not Modified.
+
+        Args:
+            url: The URL to request.
+            etag: The `ETag` of the stored response, sent as `If-None-Match`.
+            last_modified: The `Last-Modified` of the stored response, sent 
+                as `If-Modified-Since`.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        return await self._request("GET", url, headers=headers)
+
+    async def _get_reference_data(self, url: str) -> Dict[Text, Any]:
+        """Gets reference data from the store if there is one, else the API."""
+        if self.reference_data is not None:
+            return await self.reference_data.get(self, url)
+
+        response = await self._request("GET", url)
+        response.raise_for_status()
+
+        return response.json()
+
+    async def _get_instructor_page(self, page_id: int) -> Dict[Text, Any]:
+        """Gets a single page of the Peloton instructors."""
+        return await self._get_reference_data(f"{PELOTON_API_ROOT}/api/instructor?page={page_id}")
+
+    @telemetry.traced("peloton")
+    async def get_instructor_list(self) -> dict:
+        """Gets a list of Peloton instructors.
+
+        The first page reports the total number of pages so the remaining 
+        pages are requested concurrently.
+
+        Returns a dictionary with the instructor ID as the key and the name
+        for a value.
+        """
+        try:
+            first_page = await self._get_instructor_page(0)
+
+            page_count = first_page.get("page_count")
+            if page_count is not None:
+                remaining = await asyncio.gather(
+                    *[self._get_instructor_page(page_id) for page_id in range(1, page_count)]
+                )
+            else:
+                # Without a page count fall back to following `show_next`.
+                remaining = []
+                pelo_response = first_page
+                while pelo_response["show_next"]:
+                    pelo_response = await self._get_instructor_page(len(remaining) + 1)
+                    remaining.append(pelo_response)
+        except Exception as http_err:
+            logging.error(
+                f'Error occurred getting Peloton instructors. {http_err}'
+            )
+            return None
+
+        instructor_map = {}
+        for pelo_response in [first_page, *remaining]:
+            for instructor in pelo_response["data"]:
+                instructor_map[instructor["id"]] = instructor["name"]
+
+        return instructor_map
+
+    @telemetry.traced("peloton")
+    async def get_user_workouts(
+            self,
+            user_id: str,
+            page: int = 0,
+            limit: int = 50,
+            joins: Optional[str] = "peloton.ride"
+        ) -> Dict[Text, Any]:
+        """Get the latest workouts for the user, newest first.
+
+        See `PelotonAPI.get_user_workouts`.
+
+        Args:
+            user_id: The Peloton user ID to build the query string.
+            page: the page number for the results to retrieve.
+            limit: the number of workouts on each page.
+            joins: related objects to include with each workout. Defaults to 
+                the class taken in the workout.
+        """
+        params = {
+            "page": page,
+            "limit": limit,
+            "sort_by": "-created"
+        }
+
+        if joins:
+            params["joins"] = joins
+
+        try:
+            response = await self._request(
+                "GET",
+                f"{PELOTON_API_ROOT}/api/user/{user_id}/workouts",
+                params=params
+            )
+            response.raise_for_status()
+        except Exception as http_err:
+            logging.error(
+                f'Error occurred getting Peloton workouts. {http_err}'
+            )
+            return None
+
+        return response.json()
+
+    @telemetry.traced("peloton")
+    async def get_ride_details(self, ride_id: str) -> Dict[Text, Any]:
+        """Get details about a specific class."""
+        response = await self._request("GET", f"{PELOTON_API_ROOT}/api/ride/{ride_id}/details")
+        response.raise_for_status()
+
+        return response.json()
+
+    async def convert_ride_to_class_id(self, ride_id: str) -> str:
+        """Get the join token for a specific class."""
+        if self.ride_cache is not None:
+            join_tokens = await self.ride_cache.join_tokens(self, [ride_id])
+            return join_tokens[ride_id]
+
+        ride_detail = await self.get_ride_details(ride_id)
+
+        return ride_detail['ride']['join_tokens']['on_demand']
+
+    async def _graphql(
+            self,
+            operation: graphql_ops.GraphQLOperation,
+            variables: Optional[Dict[Text, Any]] = None
+        ) -> Dict[Text, Any]:
+        """Posts a GraphQL operation to the Peloton gateway.
+
+        See `PelotonAPI._graphql`.
+        """
         headers = {
             'peloton-platform': 'web'
         }
 
-        response = self.sess.post(PELOTON_GRAPHQL_ROOT, json=query, headers=headers).json()
+        with telemetry.span(f"graphql {operation.name}", kind="graphql") as span:
+            if self.persisted_queries:
+                payload = operation.payload(variables, persisted=True, include_document=False)
+                response = await self._request("POST", PELOTON_GRAPHQL_ROOT, json=payload, headers=headers)
+
+                error = graphql_ops.persisted_query_error(response.json())
+                if error is None:
+                    return response.json()
+                if error == "PERSISTED_QUERY_NOT_SUPPORTED":
+                    logging.info("Persisted queries are not supported, sending the full documents.")
+                    self.persisted_queries = False
+                span.set(retries=1)
+
+            payload = operation.payload(variables, persisted=self.persisted_queries)
+            response = await self._request("POST", PELOTON_GRAPHQL_ROOT, json=payload, headers=headers)
+
+            return response.json()
+
+    @telemetry.traced("peloton")
+    async def get_stack(self) -> str:
+        """Gets the classes currently in the user's stack.
+
+        See `PelotonAPI.get_stack`.
+        """
+        titles = graphql_ops.parse_stack_titles(await self._graphql(graphql_ops.VIEW_STACK_TITLES))
+        if titles is None:
+            return None
+
+        return "\n".join(titles)
+
+    @telemetry.traced("peloton")
+    async def clear_stack(self) -> bool:
+        """Clears all the classes in a user's Peloton stack.
+
+        See `PelotonAPI.clear_stack`.
+        """
+        response = await self._graphql(
+            graphql_ops.CLEAR_STACK, {"input": {"pelotonClassIdList": []}}
+        )
+
+        return graphql_ops.parse_success(response, 'modifyStack')
+
+    @telemetry.traced("peloton")
+    async def stack_class(self, class_id: str) -> bool:
+        """Adds the specified class_id to the user's Peloton stack.
+
+        See `PelotonAPI.stack_class`.
+        """
+        response = await self._graphql(
+            graphql_ops.ADD_CLASS_TO_STACK, {"input": {"pelotonClassId": f"{class_id}"}}
+        )
 
         # Check if the class was successfully added to the stack.
-        if response['data']['addClassToStack']['__typename'] != 'StackResponseSuccess':
-            return False
+        return graphql_ops.parse_success(response, 'addClassToStack')
+
+    async def _resolve_join_token(self, ride_id: str) -> Optional[str]:
+        """Gets the join token for a class, or None if it can't be resolved."""
+        try:
+            return await self.convert_ride_to_class_id(ride_id)
+        except Exception as http_err:
+            logging.error(f'Error occurred getting the join token for {ride_id}. {http_err}')
+            return None
+
+    @telemetry.traced("peloton")
+    async def stack_classes(self, ride_ids: list[str], append: bool = False) -> Dict[Text, bool]:
+        """Sets the user's Peloton stack to the specified classes in one request.
+
+        The join tokens for every class are resolved concurrently and then 
+        the whole workout is written with a single ModifyStack mutation.
+
+        Args:
+            ride_ids: The IDs of the classes to stack, in play order.
+            append: If True the classes are added after the classes already 
+                in the stack. Otherwise the stack is replaced. Nothing is 
+                written if the current stack can't be read.
+
+        Returns:
+            A dictionary with each ride ID as the key and True if the class 
+            is in the stack after the request, otherwise False.
+        """
+        if self.ride_cache is not None:
+            # Cached join tokens are looked up in one query, misses in bulk.
+            calls = [self.ride_cache.join_tokens(self, ride_ids)]
+        else:
+            calls = [self._resolve_join_token(ride_id) for ride_id in ride_ids]
+
+        if append:
+            calls.append(self._graphql(graphql_ops.VIEW_STACK_JOIN_TOKENS))
+
+        results = await asyncio.gather(*calls)
+        if self.ride_cache is not None:
+            join_tokens = results[0]
+        else:
+            join_tokens = dict(zip(ride_ids, results))
+
+        new_tokens = [token for token in join_tokens.values() if token is not None]
+        if not new_tokens:
+            # Nothing resolved, so don't clear the stack by writing an empty list.
+            return {ride_id: False for ride_id in ride_ids}
+
+        if append:
+            current = graphql_ops.parse_stack_join_tokens(results[-1])
+            if current is None:
+                # Writing without the current stack would drop its classes.
+                logging.error("Error occurred reading the stack, so the classes weren't added.")
+                return {ride_id: False for ride_id in ride_ids}
+            new_tokens = _merge_join_tokens(current, new_tokens)
+
+        response = await self._graphql(
+            graphql_ops.MODIFY_STACK, {"input": {"pelotonClassIdList": new_tokens}}
+        )
 
-        return True
+        return graphql_ops.parse_stack_results(response, join_tokens)
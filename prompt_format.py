@@ -0,0 +1,159 @@
+"""Compact rendering of classes and preferences for prompts.
+
+Class lists used to reach the model as pydantic JSON: every field name
+repeated for every class, full descriptions and 32 character class IDs.
+Here classes are rendered as a table with one header and `|` separated
+rows. Descriptions are truncated, and class IDs are swapped for short
+aliases that stay the same for the whole session, so a class suggested in
+one turn can still be stacked in a later one. `fit_classes` drops the
+lowest ranked classes until the table fits a token budget.
+"""
+
+import threading
+from typing import Any, Iterable, Optional
+
+from schemas import PelotonClass, UserWorkoutPreferences
+from tokens import estimate_tokens
+
+
+FIELD_SEPARATOR = "|"
+
+# Most characters of a class description included in a prompt.
+DESCRIPTION_CHARS = 80
+
+# Most tokens a list of available classes can use in a tool result.
+CLASS_LIST_TOKEN_BUDGET = 2500
+
+CLASS_COLUMNS = ["id", "title", "min", "difficulty", "discipline", "instructor", "description"]
+
+
+class IdAliases:
+    """Short aliases for long IDs that stay the same once assigned.
+
+    Args:
+        prefix: Prefix of every alias, followed by a number.
+    """
+
+    def __init__(self, prefix: str = "c"):
+
+        self.prefix = prefix
+        self._aliases = {}
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def alias(self, id: str) -> str:
+        """Gets the alias for an ID, assigning the next one if it is new."""
+        with self._lock:
+            if id not in self._aliases:
+                alias = f"{self.prefix}{len(self._aliases) + 1}"
+                self._aliases[id] = alias
+                self._ids[alias] = id
+            return self._aliases[id]
+
+    def resolve(self, alias: str) -> str:
+        """Gets the ID for an alias. Anything else, such as a full ID, is returned as it is."""
+        with self._lock:
+            return self._ids.get(alias.strip(), alias)
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """Shortens text to `max_chars`, ending with "..." if anything was cut."""
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 3, 0)].rstrip() + "..."
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        value = round(value, 1)
+    return str(value).replace(FIELD_SEPARATOR, "/").replace("\n", " ").strip()
+
+
+def format_table(columns: list[str], rows: Iterable[Iterable[Any]]) -> str:
+    """Renders rows as a header line and one `|` separated line per row."""
+    lines = [FIELD_SEPARATOR.join(columns)]
+    lines.extend(FIELD_SEPARATOR.join(_cell(value) for value in row) for row in rows)
+    return "\n".join(lines)
+
+
+def format_classes(
+        classes: list[PelotonClass],
+        aliases: IdAliases,
+        description_chars: int = DESCRIPTION_CHARS
+    ) -> str:
+    """Renders classes as a table with aliased IDs and truncated descriptions."""
+    return format_table(CLASS_COLUMNS, (
+        [
+            aliases.alias(cl.id),
+            cl.title,
+            cl.duration,
+            cl.difficulty,
+            cl.fitness_discipline,
+            cl.instructor,
+            truncate(cl.description, description_chars)
+        ]
+        for cl in classes
+    ))
+
+
+def fit_classes(
+        classes: list[PelotonClass],
+        aliases: IdAliases,
+        token_budget: int = CLASS_LIST_TOKEN_BUDGET,
+        description_chars: int = DESCRIPTION_CHARS
+    ) -> tuple[str, int]:
+    """Renders as many of the best classes as fit in a token budget.
+
+    Args:
+        classes: The classes ordered from the best fit to the worst.
+        aliases: The session's class ID aliases.
+        token_budget: Most tokens the table can use.
+        description_chars: Most characters of each description.
+
+    Returns:
+        The table and the number of classes in it.
+    """
+    rows = format_classes(classes, aliases, description_chars).split("\n")
+
+    # Every row is about the same size, so add rows until the budget is hit.
+    tokens = estimate_tokens(rows[0])
+    count = 0
+    for row in rows[1:]:
+        tokens += estimate_tokens(row) + 1
+        if tokens > token_budget:
+            break
+        count += 1
+
+    return "\n".join(rows[:count + 1]), count
+
+
+def format_preferences(preferences: UserWorkoutPreferences) -> str:
+    """Renders the workout preferences as one line per preference that is set."""
+    def join(values: Optional[list[str]]) -> str:
+        return ", ".join(values) if values else "none"
+
+    return "\n".join([
+        f"fitness goals: {join(preferences.fitness_goals)}",
+        f"duration: {preferences.preferred_duration_minutes} min",
+        f"intensity: {preferences.preferred_intensity or 'any'}",
+        f"excluded classes: {join(preferences.excluded_classes)}",
+        f"favorite instructors: {join(preferences.favorite_instructors)}",
+    ])
+
+
+def compact_table(text: str, keep_columns: int = 2, max_line_chars: int = 400) -> str:
+    """Shortens text with tables to the first columns of each row.
+
+    Used to shrink an old tool result while keeping the class aliases and
+    titles. Lines that aren't table rows are truncated instead.
+    """
+    lines = []
+    for line in text.split("\n"):
+        fields = line.split(FIELD_SEPARATOR)
+        if len(fields) > keep_columns:
+            lines.append(FIELD_SEPARATOR.join(fields[:keep_columns]))
+        else:
+            lines.append(truncate(line, max_line_chars))
+    return "\n".join(lines)
@@ -6,11 +6,13 @@ AGENT_SYSTEM_MSG = """You are an intelligent fitness advisor. Your goal is to cr
         - Prioritize the user's favorite instructers.
         - Do not include classes from excluded fitness disciplines.
 
+        Start by calling the workout_context tool. It returns the user's preferences, a summary of their recent workouts and the available classes in one call. Classes are listed in tables with short IDs such as c12, use those IDs with the other tools.
+
         Carefully review the user's recent workouts and the available Peloton classes to choose classes for today's workout that fit the criteria.
 
         Understand the recent classes taken by the user. Check that recommended classes for the workout introduce variety so the user is meeting their fitness goals.
 
-        Calculate the total duration of the workout by adding the duration in minutes for each recommended class. The total workout duration must equal the user's duration preference.  Do not recommend a workout that does not meet this criteria.
+        Use the compose_workout tool to find combinations of the available classes that add up to the user's duration preference. Choose the workout from those combinations instead of adding up class durations yourself. The total workout duration must equal the user's duration preference.  Do not recommend a workout that does not meet this criteria.
 
         Check the response to make sure the class type aligns with the user preferences. A class should not be recommended if the class type does not align with the user preferences.
 
@@ -20,7 +22,14 @@ AGENT_SYSTEM_MSG = """You are an intelligent fitness advisor. Your goal is to cr
         """
 
 
+# Bump when RECENT_WORKOUT_SUMMARY changes so cached summaries aren't reused.
+RECENT_WORKOUT_SUMMARY_VERSION = "2"
+
 RECENT_WORKOUT_SUMMARY = """
+<workoutDigest>
+{WORKOUT_DIGEST}
+</workoutDigest>
+
 <recentClasses>
 {RECENT_USER_CLASSES}
 </recentClasses>
@@ -29,7 +38,7 @@ RECENT_WORKOUT_SUMMARY = """
 {USER_PREFERENCES}
 </preferences>
 
-Summarize the recent user classes and how they relate to the user preferences. Determine what type of class the user should take to stay on track with their goals.
+Summarize the user's recent workouts from the digest of their workout history and how they relate to the user preferences. Determine what type of class the user should take to stay on track with their goals.
 
 Is there a particular focus for the user to stay on track with their fitness goals?
-"""
\ No newline at end of file
+"""
@@ -0,0 +1,161 @@
+"""Preference-aware filtering and ranking of candidate classes.
+
+Rather than handing the agent every class and having the model apply the
+user's preferences, the rules that can be checked deterministically are
+applied here. Excluded disciplines, recently taken classes and classes
+longer than the workout are filtered out of the columnar catalog. Every
+remaining class is scored on fitness goals, favorite instructors,
+intensity, recency and, with a `SemanticIndex`, how closely the class
+text matches the user's goals. Only the top candidates are returned.
+"""
+
+import re
+from typing import Any, Dict, Optional, Text
+
+import numpy as np
+
+from catalog import CatalogColumns, ClassCatalog
+from schemas import UserWorkoutPreferences
+from semantic_index import SemanticIndex
+
+
+# Class types shown on the preferences page that don't match the
+# `fitness_discipline` slug once lowercased.
+DISCIPLINE_SLUGS = {
+    "Rowing": ["caesar"],
+    "Tread": ["running", "walking"],
+    "Tread Bootcamp": ["circuit"],
+}
+
+# Weights for each part of a class score.
+GOAL_WEIGHT = 2.0
+INSTRUCTOR_WEIGHT = 1.5
+INTENSITY_WEIGHT = 0.5
+RECENCY_WEIGHT = 1.0
+DURATION_WEIGHT = 0.5
+SEMANTIC_WEIGHT = 2.0
+
+
+def discipline_slugs(class_types: Optional[list[str]]) -> list[str]:
+    """Converts class types from the preferences to `fitness_discipline` slugs."""
+    slugs = []
+    for class_type in class_types or []:
+        slugs.extend(
+            DISCIPLINE_SLUGS.get(class_type, [class_type.lower().replace(" ", "_")])
+        )
+    return slugs
+
+
+def intensity_range(preferred_intensity: Optional[str]) -> Optional[tuple[float, float]]:
+    """Parses the preferred intensity (i.e. "7" or "6-8") into a range."""
+    if not preferred_intensity:
+        return None
+
+    values = [float(v) for v in re.findall(r"\d+(?:\.\d+)?", preferred_intensity)]
+    if not values:
+        return None
+
+    return min(values), max(values)
+
+
+def score_classes(
+        columns: CatalogColumns,
+        rows: np.ndarray,
+        preferences: UserWorkoutPreferences,
+        similarity: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+    """Scores how well each class fits the user preferences. Higher is better.
+
+    Args:
+        columns: The columnar catalog.
+        rows: The rows of the classes to score.
+        preferences: The user workout preferences.
+        similarity: Optional similarity of each class to the user's goals.
+
+    Returns:
+        The score of each class in `rows`.
+    """
+    score = np.zeros(len(rows), dtype=np.float32)
+    if similarity is not None:
+        score += SEMANTIC_WEIGHT * similarity
+
+    goal_codes = columns.codes("discipline", discipline_slugs(preferences.fitness_goals))
+    score += GOAL_WEIGHT * np.isin(columns.discipline[rows], goal_codes)
+
+    favorite_codes = columns.codes("instructor", preferences.favorite_instructors)
+    score += INSTRUCTOR_WEIGHT * np.isin(columns.instructor[rows], favorite_codes)
+
+    intensity = intensity_range(preferences.preferred_intensity)
+    if intensity is not None:
+        low, high = intensity
+        difficulty = columns.difficulty[rows]
+        distance = np.maximum(np.maximum(low - difficulty, difficulty - high), 0)
+        score -= INTENSITY_WEIGHT * distance
+
+    air_time = columns.original_air_time[rows]
+    newest, oldest = air_time.max(), air_time.min()
+    if newest > oldest:
+        score += RECENCY_WEIGHT * (air_time - oldest) / (newest - oldest)
+
+    score += DURATION_WEIGHT * (columns.duration[rows] == preferences.preferred_duration_minutes * 60)
+
+    return score
+
+
+def rank_classes(
+        catalog: ClassCatalog,
+        preferences: UserWorkoutPreferences,
+        exclude_ids: Optional[list[str]] = None,
+        top_k: int = 25,
+        index: Optional[SemanticIndex] = None,
+        query: Optional[str] = None
+    ) -> list[Dict[Text, Any]]:
+    """Finds the classes that best fit the user preferences.
+
+    Every class in the catalog is filtered and scored with array operations
+    on `ClassCatalog.columns`, and only the `top_k` are turned into
+    dictionaries.
+
+    Args:
+        catalog: The class catalog to draw candidates from.
+        preferences: The user workout preferences.
+        exclude_ids: Class IDs to leave out, such as recently taken classes.
+        top_k: The number of classes to return.
+        index: Optional index used to score the classes on how similar
+            they are to `query`.
+        query: Text describing the classes the user should take, i.e.
+            from `semantic_index.build_query`.
+
+    Returns:
+        The `top_k` highest scoring classes with the keys from
+        `CatalogColumns.record`, best first, each with an added `score` key.
+    """
+    columns = catalog.columns()
+    if not len(columns):
+        return []
+
+    excluded_codes = columns.codes("discipline", discipline_slugs(preferences.excluded_classes))
+    mask = ~np.isin(columns.discipline, excluded_codes)
+
+    max_duration = preferences.preferred_duration_minutes * 60
+    if max_duration:
+        mask &= columns.duration <= max_duration
+
+    mask[columns.row_indices(exclude_ids)] = False
+
+    rows = np.flatnonzero(mask)
+    if not len(rows):
+        return []
+
+    similarity = None
+    if index is not None and query:
+        similarity = index.similarity(query, columns.ids[rows])
+
+    scores = score_classes(columns, rows, preferences, similarity)
+
+    # Only sort the top classes rather than the whole library.
+    k = min(top_k, len(rows))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+
+    return [{**columns.record(rows[i]), "score": float(scores[i])} for i in top]
@@ -0,0 +1,165 @@
+"""Revalidating store of Peloton reference data.
+
+The instructor list almost never changes, but used to be downloaded in
+full whenever the cache went cold. Responses are kept in
+SQLite with their `ETag` and `Last-Modified` headers and served straight
+from the store. Once an entry is older than `max_age` it is still served,
+and a conditional request with `If-None-Match` / `If-Modified-Since` runs
+in the background on the shared runtime. A 304 only marks the entry as
+fresh again, so the body isn't downloaded or parsed a second time. Only a
+URL that has never been fetched waits on the network.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Text
+
+import runtime
+import storage
+
+
+# Seconds before a stored response is revalidated.
+REVALIDATE_AFTER_SECONDS = 24 * 60 * 60
+
+
+class ReferenceDataStore:
+    """SQLite backed store of reference data responses and their validators.
+
+    Args:
+        name: File name of the database in the cache directory.
+        max_age: Seconds before a stored response is revalidated.
+    """
+
+    def __init__(self, name: str = "reference_data.sqlite", max_age: float = REVALIDATE_AFTER_SECONDS):
+
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # Parsed bodies, so each response is only parsed once per process.
+        self._bodies = {}
+        self._refreshing = set()
+        self._conn = storage.connect(name)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS reference_data (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body TEXT NOT NULL,
+                validated_at REAL NOT NULL
+            );
+            """
+        )
+
+    def _entry(self, url: str) -> Optional[Dict[Text, Any]]:
+        """Gets the stored validators and parsed body for a URL."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, body, validated_at FROM reference_data WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            if url not in self._bodies:
+                self._bodies[url] = json.loads(row["body"])
+
+            return {
+                "etag": row["etag"],
+                "last_modified": row["last_modified"],
+                "body": self._bodies[url],
+                "validated_at": row["validated_at"],
+            }
+
+    def _put(self, url: str, body: Any, etag: Optional[str], last_modified: Optional[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reference_data (url, etag, last_modified, body, validated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, json.dumps(body), time.time())
+            )
+            self._bodies[url] = body
+
+    def _touch(self, url: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE reference_data SET validated_at = ? WHERE url = ?", (time.time(), url)
+            )
+
+    async def revalidate(self, api, url: str) -> Any:
+        """Requests a URL, sending the stored validators if there are any.
+
+        Args:
+            api: An `AsyncPelotonAPI` used to make the request.
+            url: The URL of the reference data.
+
+        Returns:
+            The response body, from the store if the server responded with
+            304 Not Modified.
+        """
+        # SQLite calls block, so keep them off the event loop every session shares.
+        entry = await asyncio.to_thread(self._entry, url)
+        response = await api.conditional_get(
+            url,
+            etag=entry["etag"] if entry else None,
+            last_modified=entry["last_modified"] if entry else None
+        )
+
+        if response.status_code == 304 and entry is not None:
+            await asyncio.to_thread(self._touch, url)
+            return entry["body"]
+
+        response.raise_for_status()
+        body = response.json()
+        await asyncio.to_thread(
+            self._put,
+            url,
+            body,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified")
+        )
+
+        return body
+
+    async def _refresh(self, api, url: str) -> None:
+        try:
+            await self.revalidate(api, url)
+        except Exception as http_err:
+            logging.error(f'Error occurred refreshing {url}. {http_err}')
+        finally:
+            with self._lock:
+                self._refreshing.discard(url)
+
+    def refresh_in_background(self, api, url: str) -> None:
+        """Revalidates a URL on the shared runtime unless it already is."""
+        with self._lock:
+            if url in self._refreshing:
+                return
+            self._refreshing.add(url)
+
+        runtime.submit(self._refresh(api, url))
+
+    async def get(self, api, url: str) -> Any:
+        """Gets the reference data at a URL.
+
+        Stored responses are returned right away and revalidated in the
+        background once they are older than `max_age`. A URL that hasn't
+        been stored yet is requested.
+
+        Args:
+            api: An `AsyncPelotonAPI` used to make the request.
+            url: The URL of the reference data.
+
+        Returns:
+            The response body.
+        """
+        entry = await asyncio.to_thread(self._entry, url)
+        if entry is None:
+            return await self.revalidate(api, url)
+
+        if time.time() - entry["validated_at"] > self.max_age:
+            self.refresh_in_background(api, url)
+
+        return entry["body"]
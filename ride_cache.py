@@ -0,0 +1,162 @@
+"""Persistent cache of Peloton ride details.
+
+Ride details, including the join tokens needed to stack a class, don't 
+change once a class is published. They are kept in SQLite keyed by ride ID 
+and shared by every user, so stacking a popular class usually doesn't need 
+a request to `/api/ride/{ride_id}/details`. The least recently used rides 
+are evicted once the cache is over `max_entries`.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Text
+
+import storage
+
+
+class RideDetailCache:
+    """SQLite backed LRU cache of ride details.
+
+    Args:
+        name: File name of the database in the cache directory.
+        max_entries: Maximum number of rides kept before the least recently 
+            used are evicted.
+    """
+
+    def __init__(self, name: str = "ride_details.sqlite", max_entries: int = 10000):
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = storage.connect(name)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS ride_details (
+                ride_id TEXT PRIMARY KEY,
+                detail TEXT NOT NULL,
+                last_accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ride_details_last_accessed
+                ON ride_details (last_accessed);
+            """
+        )
+
+    def get_many(self, ride_ids: list[str]) -> Dict[Text, Dict[Text, Any]]:
+        """Gets the cached details for the ride IDs that are in the cache.
+
+        Returns:
+            A dictionary with the ride ID as the key and the ride details as 
+            the value. Rides that aren't cached are left out.
+        """
+        if not ride_ids:
+            return {}
+
+        placeholders = ",".join("?" * len(ride_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT ride_id, detail FROM ride_details WHERE ride_id IN ({placeholders})",
+                ride_ids
+            ).fetchall()
+            self.hits += len(rows)
+            self.misses += len(ride_ids) - len(rows)
+            self._conn.execute(
+                f"UPDATE ride_details SET last_accessed = ? WHERE ride_id IN ({placeholders})",
+                [time.time(), *ride_ids]
+            )
+
+        return {row["ride_id"]: json.loads(row["detail"]) for row in rows}
+
+    def stats(self) -> Dict[Text, Any]:
+        """Gets the hit and miss counts, by ride, and number of rides in the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM ride_details").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
+
+    def get(self, ride_id: str) -> Optional[Dict[Text, Any]]:
+        """Gets the cached details for a ride, or None if it isn't cached."""
+        return self.get_many([ride_id]).get(ride_id)
+
+    def put_many(self, details: Dict[Text, Dict[Text, Any]]) -> None:
+        """Stores ride details and evicts the least recently used rides."""
+        if not details:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ride_details (ride_id, detail, last_accessed) VALUES (?, ?, ?)",
+                [(ride_id, json.dumps(detail), now) for ride_id, detail in details.items()]
+            )
+            self._conn.execute(
+                """
+                DELETE FROM ride_details WHERE ride_id IN (
+                    SELECT ride_id FROM ride_details
+                    ORDER BY last_accessed DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+
+    def put(self, ride_id: str, detail: Dict[Text, Any]) -> None:
+        """Stores the details for a single ride."""
+        self.put_many({ride_id: detail})
+
+    async def resolve_many(self, api, ride_ids: list[str]) -> Dict[Text, Dict[Text, Any]]:
+        """Gets the details for the rides, only requesting the cache misses.
+
+        Misses are fetched concurrently and stored in the cache.
+
+        Args:
+            api: An `AsyncPelotonAPI` used to request the missing rides.
+            ride_ids: The IDs of the rides to resolve.
+
+        Returns:
+            A dictionary with the ride ID as the key and the ride details as 
+            the value. Rides that couldn't be fetched are left out.
+        """
+        # SQLite calls block, so keep them off the event loop every session shares.
+        details = await asyncio.to_thread(self.get_many, list(dict.fromkeys(ride_ids)))
+        misses = [ride_id for ride_id in dict.fromkeys(ride_ids) if ride_id not in details]
+
+        if misses:
+            responses = await asyncio.gather(
+                *[api.get_ride_details(ride_id) for ride_id in misses],
+                return_exceptions=True
+            )
+
+            fetched = {}
+            for ride_id, response in zip(misses, responses):
+                if isinstance(response, Exception):
+                    logging.error(f'Error occurred getting ride details for {ride_id}. {response}')
+                    continue
+                fetched[ride_id] = response["ride"]
+
+            await asyncio.to_thread(self.put_many, fetched)
+            details.update(fetched)
+
+        return details
+
+    async def join_tokens(self, api, ride_ids: list[str]) -> Dict[Text, Optional[str]]:
+        """Gets the on demand join token for each ride.
+
+        Returns:
+            A dictionary with the ride ID as the key and the join token as 
+            the value, or None if the ride couldn't be resolved.
+        """
+        details = await self.resolve_many(api, ride_ids)
+
+        return {
+            ride_id: details[ride_id]["join_tokens"]["on_demand"] if ride_id in details else None
+            for ride_id in ride_ids
+        }
@@ -0,0 +1,52 @@
+"""Process-wide async runtime.
+
+A single event loop runs for the life of the process on a background 
+thread and is shared by every Streamlit session. Agent runs and other 
+coroutines are submitted to it from the script threads, so async clients 
+and their connection pools survive between turns and concurrent sessions 
+don't block each other.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Gets the shared event loop, starting it on first use."""
+    global _loop
+
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever,
+                name="peloton-pal-runtime",
+                daemon=True
+            ).start()
+
+    return _loop
+
+
+def submit(coro: Coroutine[Any, Any, T]) -> "Future[T]":
+    """Schedules a coroutine on the shared loop without waiting for it.
+
+    Returns:
+        A future that can be waited on from any thread.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+    """Runs a coroutine on the shared loop and waits for the result.
+
+    Must not be called from the shared loop itself.
+    """
+    return submit(coro).result(timeout)
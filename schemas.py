@@ -33,3 +33,24 @@ class PelotonClass(BaseModel):
     difficulty: float = Field(description="Class difficulty on a scale of 0-10 where 0 is easy and 10 is the most difficult.")
     fitness_discipline: str = Field(description="Category the class is assigned to (cardio, strength, cycling etc.)")
     instructor: str = Field(description="Name of the class instructor")
+
+
+class WorkoutOption(BaseModel):
+    class_ids: list[str] = Field(description="IDs of the classes in the workout, in play order.")
+    titles: list[str] = Field(description="Display titles of the classes in the workout, in play order.")
+    total_duration: int = Field(description="Total duration of the workout measured in minutes.")
+    score: float = Field(description="How well the workout fits the user preferences. Higher is better.")
+
+
+class WorkoutDigest(BaseModel):
+    period_days: int = Field(description="Number of days of workout history the digest covers.")
+    total_workouts: int = Field(description="Number of workouts in the period.")
+    total_minutes: float = Field(description="Total minutes of workouts in the period.")
+    weekly_minutes: dict[str, dict[str, float]] = Field(description="Minutes of each discipline for each week, keyed by the date the week starts.")
+    discipline_minutes: dict[str, float] = Field(description="Total minutes of each discipline in the period.")
+    average_difficulty: Optional[float] = Field(default=None, description="Average class difficulty on a scale of 0-10.")
+    intensity_trend: Optional[float] = Field(default=None, description="Change in class difficulty per week. Positive when workouts are getting harder.")
+    rest_days: int = Field(description="Number of days in the period without a workout.")
+    days_since_last_workout: Optional[int] = Field(default=None, description="Days since the most recent workout.")
+    instructor_counts: dict[str, int] = Field(description="Number of workouts with each instructor, most frequent first.")
+    goal_gaps: list[str] = Field(description="Fitness goals with no workouts in the period.")
@@ -0,0 +1,238 @@
+"""Local similarity index over the class catalog.
+
+Each class's title, description, discipline and instructor are turned into
+a vector of hashed word and character trigram counts. Hashing means there
+is no vocabulary to fit, so classes can be added one sync at a time and
+the index can be rebuilt offline from the catalog alone. The vectors are
+L2 normalized rows of a NumPy matrix, so scoring every class against a
+query is a single matrix-vector product. The matrix is saved next to the
+catalog and only classes stored since the last update are vectorized.
+"""
+
+import logging
+import os
+import re
+import tempfile
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Text
+
+import numpy as np
+
+import storage
+
+
+# Width of the hashed feature vectors.
+DIMENSIONS = 512
+
+# Length of the character n-grams taken from each word.
+NGRAM = 3
+
+# Bump when the features change so saved indexes are rebuilt.
+INDEX_VERSION = 1
+
+
+def _features(text: str) -> list[str]:
+    """Splits text into words and character trigrams of the padded words."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+
+    features = [f"w:{word}" for word in words]
+    for word in words:
+        padded = f"#{word}#"
+        features.extend(padded[i:i + NGRAM] for i in range(max(len(padded) - NGRAM + 1, 1)))
+
+    return features
+
+
+def vectorize(texts: list[str], dimensions: int = DIMENSIONS) -> np.ndarray:
+    """Converts texts to L2 normalized hashed feature vectors.
+
+    Returns:
+        A float32 matrix with a row for each text.
+    """
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+
+    for row, text in enumerate(texts):
+        features = _features(text)
+        if not features:
+            continue
+        # crc32 is stable across processes, unlike hash().
+        indices = np.fromiter(
+            (zlib.crc32(feature.encode()) % dimensions for feature in features),
+            dtype=np.int64,
+            count=len(features)
+        )
+        # Dampen repeated features so long descriptions don't dominate.
+        matrix[row] = np.log1p(np.bincount(indices, minlength=dimensions))
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+    return matrix
+
+
+def class_text(cl: Dict[Text, Any]) -> str:
+    """Gets the text of a catalog class that is indexed."""
+    return " ".join([
+        cl["title"],
+        cl["description"],
+        cl["fitness_discipline"].replace("_", " "),
+        cl.get("instructor") or "",
+    ])
+
+
+def build_query(
+        fitness_goals: Optional[list[str]],
+        goal_gaps: Optional[list[str]] = None
+    ) -> str:
+    """Builds a query from the fitness goals and the goals the user has been missing.
+
+    Goals are ordered by priority, so earlier goals are repeated more. Goals
+    without a recent workout from the digest are repeated again to pull
+    those classes up.
+    """
+    goals = fitness_goals or []
+    terms = []
+    for position, goal in enumerate(goals):
+        terms.extend([goal] * (len(goals) - position))
+    for goal in goal_gaps or []:
+        terms.extend([goal] * 2)
+
+    return " ".join(terms)
+
+
+class SemanticIndex:
+    """Hashed n-gram similarity index over the classes in a `ClassCatalog`.
+
+    Args:
+        name: File name of the saved index in the cache directory, or None
+            to keep the index in memory only.
+        dimensions: Width of the hashed feature vectors.
+    """
+
+    def __init__(self, name: Optional[str] = "semantic_index.npz", dimensions: int = DIMENSIONS):
+
+        self.dimensions = dimensions
+        self.path = storage.CACHE_DIR / name if name else None
+        self._lock = threading.Lock()
+        # Held for the whole of `update`, so concurrent sessions don't
+        # vectorize the same classes or save over each other.
+        self._update_lock = threading.Lock()
+        self._ids = []
+        self._rows = {}
+        self._matrix = np.zeros((0, dimensions), dtype=np.float32)
+        # Catalog rowid of the newest class in the index.
+        self._last_rowid = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+
+        try:
+            with np.load(self.path) as saved:
+                if int(saved["version"]) != INDEX_VERSION or saved["matrix"].shape[1] != self.dimensions:
+                    return
+                self._matrix = saved["matrix"]
+                self._ids = saved["ids"].tolist()
+                self._last_rowid = int(saved["last_rowid"])
+        except (OSError, KeyError, ValueError) as err:
+            logging.error(f'Error occurred loading the semantic index. {err}')
+            return
+
+        self._rows = {class_id: row for row, class_id in enumerate(self._ids)}
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            matrix, ids = self._matrix, list(self._ids)
+
+        # A unique temporary file, so other processes saving the index
+        # don't replace it halfway.
+        with tempfile.NamedTemporaryFile(
+            dir=self.path.parent, prefix=f"{self.path.stem}.", suffix=".tmp.npz", delete=False
+        ) as tmp:
+            np.savez(
+                tmp,
+                version=INDEX_VERSION,
+                matrix=matrix,
+                ids=np.array(ids, dtype=str),
+                last_rowid=self._last_rowid
+            )
+        try:
+            os.replace(tmp.name, self.path)
+        except OSError:
+            os.unlink(tmp.name)
+            raise
+
+    def add(self, classes: list[Dict[Text, Any]]) -> None:
+        """Adds classes to the index, replacing the vectors of classes already in it."""
+        if not classes:
+            return
+
+        vectors = vectorize([class_text(cl) for cl in classes], self.dimensions)
+
+        with self._lock:
+            new_rows = []
+            for cl, vector in zip(classes, vectors):
+                row = self._rows.get(cl["id"])
+                if row is None:
+                    self._rows[cl["id"]] = len(self._ids)
+                    self._ids.append(cl["id"])
+                    new_rows.append(vector)
+                else:
+                    self._matrix[row] = vector
+
+            if new_rows:
+                self._matrix = np.vstack([self._matrix, np.stack(new_rows)])
+
+    def update(self, catalog) -> int:
+        """Indexes the classes stored in the catalog since the last update.
+
+        Only one update runs at a time. Sessions that wait for another
+        session's update find its classes already indexed.
+
+        Args:
+            catalog: The `ClassCatalog` to index.
+
+        Returns:
+            The number of classes added or replaced.
+        """
+        with self._update_lock:
+            classes = catalog.changed_since(self._last_rowid)
+            if not classes:
+                return 0
+
+            self.add(classes)
+            self._last_rowid = max(cl["rowid"] for cl in classes)
+            self._save()
+
+        return len(classes)
+
+    def similarity(self, query: str, class_ids: Sequence[str]) -> np.ndarray:
+        """Scores classes against a query.
+
+        Returns:
+            The cosine similarity of each class, in the order of `class_ids`.
+            Classes that aren't indexed score 0.
+        """
+        query_vector = vectorize([query], self.dimensions)[0]
+
+        with self._lock:
+            rows = np.fromiter(
+                (self._rows.get(class_id, -1) for class_id in class_ids),
+                dtype=np.int64,
+                count=len(class_ids)
+            )
+            indexed = rows >= 0
+            scores = np.zeros(len(rows), dtype=np.float32)
+            scores[indexed] = self._matrix[rows[indexed]] @ query_vector
+
+        return scores
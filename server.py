@@ -0,0 +1,332 @@
+"""HTTP/JSON server for the recommendation service.
+
+Serves a `RecommendationService` on the shared runtime loop, so requests
+for different sessions run concurrently and share the Peloton clients,
+the catalog and the caches. Sessions are kept in memory, so when several
+workers run behind a load balancer the requests of a session must go to
+the worker that opened it.
+
+    python server.py --port 8600
+
+Endpoints, all taking and returning JSON:
+
+    POST   /v1/sessions                  Opens a session. Takes the Peloton
+                                         "username" and "password" and
+                                         optional "preferences", returns
+                                         "session_id". The credentials can
+                                         only be left out, to use the
+                                         PELOTON_USER account, if the server
+                                         runs with --allow-env-account.
+    DELETE /v1/sessions/{id}             Closes a session.
+    POST   /v1/sessions/{id}/suggest     Takes an optional "prompt" and
+                                         "preferences", returns the response
+                                         "text" and the composed "workouts".
+                                         With "stream": true the events are
+                                         streamed as lines of JSON instead.
+    GET    /v1/sessions/{id}/summary     Returns the summary of the recent
+                                         workouts.
+    POST   /v1/sessions/{id}/stack       Takes "class_ids" and an optional
+                                         "append", returns "stacked".
+    GET    /healthz                      Returns "ok".
+    GET    /metrics                      The telemetry in the Prometheus
+                                         text format.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Dict, Text
+
+import requests
+import tornado.web
+from pydantic import ValidationError
+from tornado.httpserver import HTTPServer
+from tornado.iostream import StreamClosedError
+
+import runtime
+import startup
+
+
+# Default address the server listens on.
+HOST = "127.0.0.1"
+PORT = 8600
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    """Parses JSON bodies and writes errors as JSON."""
+
+    def initialize(self, service) -> None:
+        self.service = service
+
+    def body(self) -> Dict[Text, Any]:
+        """Gets the JSON body of the request, or an empty dict if there is none."""
+        if not self.request.body:
+            return {}
+        try:
+            body = json.loads(self.request.body)
+        except json.JSONDecodeError as err:
+            raise tornado.web.HTTPError(400, "Invalid JSON. %s", err)
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, "The body must be a JSON object.")
+        return body
+
+    def preferences(self, body: Dict[Text, Any]):
+        """Gets the user workout preferences from the body, if there are any."""
+        from schemas import UserWorkoutPreferences
+
+        if body.get("preferences") is None:
+            return None
+        try:
+            return UserWorkoutPreferences(**body["preferences"])
+        except (TypeError, ValidationError) as err:
+            raise tornado.web.HTTPError(400, "Invalid preferences. %s", err)
+
+    def session(self, session_id: str):
+        """Gets an open session or responds with 404."""
+        session = self.service.get_session(session_id)
+        if session is None:
+            raise tornado.web.HTTPError(404, "Unknown or expired session.")
+        return session
+
+    def write_json(self, value: Any, status: int = 200) -> None:
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(value, default=str))
+
+    def write_error(self, status_code: int, **kwargs) -> None:
+        error = kwargs.get("exc_info", (None, None))[1]
+        if isinstance(error, tornado.web.HTTPError) and error.log_message:
+            message = error.log_message % error.args
+        else:
+            message = self._reason
+
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({"error": message}))
+
+
+class SessionsHandler(BaseHandler):
+
+    def initialize(self, service, allow_env_account: bool = False) -> None:
+        super().initialize(service)
+        self.allow_env_account = allow_env_account
+
+    async def post(self) -> None:
+        body = self.body()
+        preferences = self.preferences(body)
+        username, password = body.get("username"), body.get("password")
+
+        if username is None and password is None:
+            if not self.allow_env_account:
+                raise tornado.web.HTTPError(401, "A Peloton username and password are required.")
+        elif not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+            raise tornado.web.HTTPError(400, "username and password must both be given.")
+
+        try:
+            # Logging in uses the blocking client, so keep it off the loop.
+            session = await asyncio.to_thread(
+                self.service.open_session, preferences, username, password
+            )
+        except requests.HTTPError as err:
+            if err.response is not None and err.response.status_code in (400, 401, 403):
+                raise tornado.web.HTTPError(401, "Peloton rejected the username or password.")
+            logging.error(f'Error occurred opening a session. {err}')
+            raise tornado.web.HTTPError(502, "Couldn't log in to Peloton. %s", err)
+        except Exception as err:
+            logging.error(f'Error occurred opening a session. {err}')
+            raise tornado.web.HTTPError(502, "Couldn't log in to Peloton. %s", err)
+
+        self.write_json({"session_id": session.id, "user_id": session.deps.user_id}, status=201)
+
+
+class SessionHandler(BaseHandler):
+
+    def delete(self, session_id: str) -> None:
+        if not self.service.close_session(session_id):
+            raise tornado.web.HTTPError(404, "Unknown or expired session.")
+        self.set_status(204)
+        self.finish()
+
+
+class SuggestHandler(BaseHandler):
+
+    async def post(self, session_id: str) -> None:
+        from service import DEFAULT_PROMPT
+
+        session = self.session(session_id)
+        body = self.body()
+        prompt = body.get("prompt") or DEFAULT_PROMPT
+        preferences = self.preferences(body)
+
+        stream = body.get("stream", False)
+        if not isinstance(stream, bool):
+            raise tornado.web.HTTPError(400, "stream must be true or false.")
+
+        if stream:
+            await self._stream(session, prompt, preferences)
+            return
+
+        try:
+            suggestion = await self.service.suggest(session, prompt, preferences)
+        except Exception as err:
+            logging.error(f'Error occurred suggesting a workout. {err}')
+            raise tornado.web.HTTPError(502, "The agent run failed. %s", err)
+
+        self.write_json(suggestion.to_dict())
+
+    async def _stream(self, session, prompt: str, preferences) -> None:
+        """Writes the events of the run as lines of JSON as they happen."""
+        from service import Suggestion
+
+        self.set_header("Content-Type", "application/x-ndjson")
+        events = self.service.chat(session, prompt, preferences)
+        try:
+            async for event in events:
+                if event.kind == "done":
+                    content = Suggestion.from_result(event.content).to_dict()
+                elif event.kind == "error":
+                    logging.error(f'Error occurred suggesting a workout. {event.content}')
+                    content = str(event.content)
+                else:
+                    content = event.content
+
+                self.write(json.dumps({"kind": event.kind, "content": content}, default=str) + "\n")
+                await self.flush()
+        except StreamClosedError:
+            # The client went away, stop the run.
+            await events.aclose()
+            return
+
+        self.finish()
+
+
+class SummaryHandler(BaseHandler):
+
+    async def get(self, session_id: str) -> None:
+        session = self.session(session_id)
+        try:
+            summary = await self.service.summarize(session)
+        except Exception as err:
+            logging.error(f'Error occurred summarizing the workouts. {err}')
+            raise tornado.web.HTTPError(502, "Couldn't summarize the workouts. %s", err)
+
+        self.write_json(summary.model_dump())
+
+
+class StackHandler(BaseHandler):
+
+    async def post(self, session_id: str) -> None:
+        session = self.session(session_id)
+        body = self.body()
+        class_ids = body.get("class_ids")
+        if not isinstance(class_ids, list) or not all(isinstance(id, str) for id in class_ids):
+            raise tornado.web.HTTPError(400, "class_ids must be a list of class IDs.")
+        append = body.get("append", True)
+        if not isinstance(append, bool):
+            raise tornado.web.HTTPError(400, "append must be true or false.")
+
+        try:
+            stacked = await self.service.stack(session, class_ids, append=append)
+        except Exception as err:
+            logging.error(f'Error occurred stacking classes. {err}')
+            raise tornado.web.HTTPError(502, "Couldn't stack the classes. %s", err)
+
+        self.write_json({"stacked": stacked})
+
+
+class HealthHandler(tornado.web.RequestHandler):
+
+    def get(self) -> None:
+        self.finish("ok")
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+
+    def get(self) -> None:
+        import telemetry
+
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(telemetry.prometheus_snapshot())
+
+
+def make_app(service, allow_env_account: bool = False) -> tornado.web.Application:
+    """Routes the endpoints to a `RecommendationService`.
+
+    Args:
+        service: The service to serve.
+        allow_env_account: Open sessions without credentials on the 
+            `PELOTON_USER` account. Anyone who can reach the server can then 
+            use that account.
+    """
+    args = {"service": service}
+    return tornado.web.Application([
+        (r"/v1/sessions", SessionsHandler, {**args, "allow_env_account": allow_env_account}),
+        (r"/v1/sessions/([0-9a-f]+)", SessionHandler, args),
+        (r"/v1/sessions/([0-9a-f]+)/suggest", SuggestHandler, args),
+        (r"/v1/sessions/([0-9a-f]+)/summary", SummaryHandler, args),
+        (r"/v1/sessions/([0-9a-f]+)/stack", StackHandler, args),
+        (r"/healthz", HealthHandler),
+        (r"/metrics", MetricsHandler),
+    ])
+
+
+def serve(
+        service=None,
+        host: str = HOST,
+        port: int = PORT,
+        allow_env_account: bool = False
+    ) -> HTTPServer:
+    """Starts serving on the shared runtime loop without blocking.
+
+    Args:
+        service: The service to serve. Defaults to a new `RecommendationService`.
+        host: The address to listen on.
+        port: The port to listen on, 0 for any free port.
+        allow_env_account: Open sessions without credentials on the 
+            `PELOTON_USER` account.
+
+    Returns:
+        The server. Stop it with `runtime.run(stop(server))`.
+    """
+    if service is None:
+        from service import RecommendationService
+        service = RecommendationService()
+
+    async def start() -> HTTPServer:
+        server = HTTPServer(make_app(service, allow_env_account))
+        server.listen(port, address=host)
+        return server
+
+    return runtime.run(start())
+
+
+async def stop(server: HTTPServer) -> None:
+    """Stops accepting requests and closes the open connections."""
+    server.stop()
+    await server.close_all_connections()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the workout recommendations over HTTP.")
+    parser.add_argument("--host", default=HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on.")
+    parser.add_argument("--allow-env-account", action="store_true",
+                        help="Open sessions without credentials on the PELOTON_USER account. "
+                             "Anyone who can reach the server can then use it.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    startup.load_env()
+    startup.warm_up()
+
+    server = serve(host=args.host, port=args.port, allow_env_account=args.allow_env_account)
+    logging.info(f"Serving workout recommendations on http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        runtime.run(stop(server))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Headless recommendation service.
+
+`RecommendationService` holds the clients and stores shared by every
+session (one authenticated client per Peloton account, the class catalog
+and its index, the workout history and the summary and ride caches) and
+the open sessions, and runs the agent pipeline for them: suggesting
+workouts, summarizing the workout history and stacking classes.
+
+Nothing here depends on Streamlit. The app uses the service in process
+and `server.py` serves it over HTTP/JSON to any other front end.
+"""
+
+import asyncio
+import threading
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Optional, Text
+
+from cachetools import TTLCache
+from pydantic_ai.messages import ToolReturn
+
+from agent import AgentDeps, peloton_agent, stack_classes, summarize_history
+from auth import SessionManager
+from catalog import ClassCatalog
+from compaction import compact_messages
+from history import WorkoutHistory
+from reference_data import ReferenceDataStore
+from ride_cache import RideDetailCache
+from schemas import RecentUserSummary, UserWorkoutPreferences, WorkoutOption
+from semantic_index import SemanticIndex
+from streaming import AgentEvent, astream_agent
+from summary_cache import SummaryCache
+
+
+# Prompt of a suggestion when none is given.
+DEFAULT_PROMPT = "Suggest a workout"
+
+# Seconds an unused session is kept for.
+SESSION_TTL = 60 * 60
+
+# Maximum number of open sessions, the least recently used are closed first.
+MAX_SESSIONS = 1000
+
+
+@dataclass
+class Session:
+    """A conversation with the agent for one Peloton account.
+
+    Turns of the same session run one at a time, since they share the
+    `AgentDeps` and the message history.
+    """
+    id: str
+    username: str
+    deps: AgentDeps
+    message_history: Optional[list] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+
+@dataclass
+class Suggestion:
+    """The response to a prompt and the workouts composed for it."""
+    text: str
+    workouts: list[WorkoutOption]
+    result: Any = field(default=None, repr=False)
+
+    @classmethod
+    def from_result(cls, result) -> "Suggestion":
+        """Gets the response and the workouts of the last `compose_workout` call of a run."""
+        new_messages = result.new_messages()
+        workouts = []
+        for message in reversed(new_messages):
+            if isinstance(message, ToolReturn) and message.tool_name == "compose_workout":
+                workouts = list(message.content or [])
+                break
+
+        return cls(text=new_messages[-1].content, workouts=workouts, result=result)
+
+    def to_dict(self) -> Dict[Text, Any]:
+        return {
+            "text": self.text,
+            "workouts": [workout.model_dump() for workout in self.workouts],
+        }
+
+
+class RecommendationService:
+    """Runs the recommendation pipeline for any number of sessions.
+
+    Every store defaults to a new one in the cache directory. Pass the
+    stores to share them with something else in the process.
+
+    Args:
+        session_manager: Authenticated clients by Peloton account.
+        catalog: The class library.
+        index: Similarity index over the catalog.
+        history: The stored workouts of every user.
+        summary_cache: Summaries of the workout history by their inputs.
+        ride_cache: Ride details, shared with the session manager's clients.
+        reference_data: The instructor list, shared with the session
+            manager's clients.
+        agent: The agent to run. Defaults to `peloton_agent`.
+        session_ttl: Seconds an unused session is kept for.
+        max_sessions: Maximum number of open sessions.
+    """
+
+    def __init__(
+            self,
+            session_manager: Optional[SessionManager] = None,
+            catalog: Optional[ClassCatalog] = None,
+            index: Optional[SemanticIndex] = None,
+            history: Optional[WorkoutHistory] = None,
+            summary_cache: Optional[SummaryCache] = None,
+            ride_cache: Optional[RideDetailCache] = None,
+            reference_data: Optional[ReferenceDataStore] = None,
+            agent=None,
+            session_ttl: float = SESSION_TTL,
+            max_sessions: int = MAX_SESSIONS
+        ):
+
+        self.ride_cache = ride_cache or RideDetailCache()
+        self.reference_data = reference_data or ReferenceDataStore()
+        self.session_manager = session_manager or SessionManager(
+            ride_cache=self.ride_cache, reference_data=self.reference_data
+        )
+        self.catalog = catalog or ClassCatalog()
+        self.index = index or SemanticIndex()
+        self.history = history or WorkoutHistory()
+        self.summary_cache = summary_cache or SummaryCache()
+        self.agent = agent or peloton_agent
+        self._sessions = TTLCache(maxsize=max_sessions, ttl=session_ttl)
+        self._lock = threading.Lock()
+
+    def open_session(
+            self,
+            preferences: Optional[UserWorkoutPreferences] = None,
+            username: Optional[str] = None,
+            password: Optional[str] = None
+        ) -> Session:
+        """Opens a session and starts fetching its workout context.
+
+        Logs in if the account doesn't have a saved session, so call it off
+        the event loop.
+
+        Args:
+            preferences: The user workout preferences. Defaults to the
+                default preferences.
+            username: The Peloton username or email. Defaults to `PELOTON_USER`.
+            password: The Peloton password. Defaults to `PELOTON_PASS`.
+
+        Returns:
+            The new session.
+        """
+        pelo_session = self.session_manager.get(username, password)
+        deps = AgentDeps(
+            api=pelo_session.async_api,
+            user_id=pelo_session.user_id,
+            preferences=preferences or UserWorkoutPreferences(),
+            catalog=self.catalog,
+            history=self.history,
+            summary_cache=self.summary_cache,
+            index=self.index
+        )
+        # Fetch the workouts, instructors and new classes before the first prompt.
+        deps.start_prefetch()
+
+        session = Session(id=uuid.uuid4().hex, username=pelo_session.username, deps=deps)
+        with self._lock:
+            self._sessions[session.id] = session
+
+        return session
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        """Gets an open session, or None if it doesn't exist or has expired."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                # Reading doesn't refresh the TTL, so store it again.
+                self._sessions[session_id] = session
+            return session
+
+    def close_session(self, session_id: str) -> bool:
+        """Closes a session. Returns whether it was open."""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    async def chat(
+            self,
+            session: Session,
+            prompt: str = DEFAULT_PROMPT,
+            preferences: Optional[UserWorkoutPreferences] = None
+        ) -> AsyncIterator[AgentEvent]:
+        """Streams the agent's response to a prompt in the session's conversation.
+
+        The history of the conversation is compacted and kept in the
+        session once the run is done.
+
+        Args:
+            session: The session.
+            prompt: The user prompt.
+            preferences: Updated user workout preferences, if they changed.
+
+        Yields:
+            The events of the run, see `streaming.AgentEvent`.
+        """
+        async with session.lock:
+            if preferences is not None:
+                session.deps.preferences = preferences
+
+            async for event in astream_agent(
+                self.agent, prompt, session.deps,
+                message_history=session.message_history, session_id=session.id
+            ):
+                if event.kind == "done":
+                    # Keep the history sent each turn inside the token budget.
+                    session.message_history = compact_messages(event.content.all_messages())
+                yield event
+
+    async def suggest(
+            self,
+            session: Session,
+            prompt: str = DEFAULT_PROMPT,
+            preferences: Optional[UserWorkoutPreferences] = None
+        ) -> Suggestion:
+        """Gets the agent's response to a prompt, by default a workout suggestion.
+
+        See `chat`.
+
+        Raises:
+            Exception: Anything the agent run raised.
+        """
+        async for event in self.chat(session, prompt, preferences):
+            if event.kind == "error":
+                raise event.content
+            if event.kind == "done":
+                return Suggestion.from_result(event.content)
+
+    async def summarize(self, session: Session) -> RecentUserSummary:
+        """Summarizes the session user's recent workouts."""
+        return await summarize_history(session.deps)
+
+    async def stack(self, session: Session, class_ids: list[str], append: bool = True) -> Dict[Text, bool]:
+        """Adds classes to the session user's stack.
+
+        Args:
+            session: The session.
+            class_ids: The class IDs, or the aliases the agent used for them.
+            append: Keep the classes already in the stack. Set to False to
+                replace the stack.
+
+        Returns:
+            Whether each class ID was added to the stack.
+        """
+        return await stack_classes(session.deps, class_ids, append=append)
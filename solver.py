@@ -0,0 +1,109 @@
+"""Composes workouts whose classes add up to an exact duration.
+
+The workout duration is a bounded subset-sum problem over the candidate
+class durations. Partial workouts are grown one class at a time, keeping
+only the best few for every (total minutes, number of classes) state, and
+the complete workouts are re-scored for discipline balance. Picking the
+arithmetic out of the model's hands means a suggested workout always adds
+up to the user's preferred duration.
+"""
+
+from typing import Optional
+
+from ranking import discipline_slugs
+from schemas import PelotonClass, WorkoutOption
+
+
+# Most classes allowed in a single workout.
+MAX_CLASSES = 4
+
+# Partial workouts kept for every (total minutes, number of classes) state.
+BEAM_WIDTH = 16
+
+# Weights for each part of a workout score.
+INSTRUCTOR_WEIGHT = 1.0
+GOAL_COVERAGE_WEIGHT = 2.0
+VARIETY_WEIGHT = 1.0
+REPEAT_PENALTY = 1.5
+
+
+def _balance_score(classes: list[PelotonClass], goal_slugs: set[str]) -> float:
+    """Scores the mix of disciplines in a complete workout."""
+    disciplines = [cl.fitness_discipline for cl in classes]
+    distinct = set(disciplines)
+
+    return (
+        GOAL_COVERAGE_WEIGHT * len(distinct & goal_slugs)
+        + VARIETY_WEIGHT * (len(distinct) - 1)
+        - REPEAT_PENALTY * (len(disciplines) - len(distinct))
+    )
+
+
+def compose_workouts(
+        classes: list[PelotonClass],
+        total_duration: int,
+        fitness_goals: Optional[list[str]] = None,
+        favorite_instructors: Optional[list[str]] = None,
+        class_scores: Optional[dict[str, float]] = None,
+        n: int = 3,
+        max_classes: int = MAX_CLASSES
+    ) -> list[WorkoutOption]:
+    """Finds the best workouts that add up to exactly `total_duration`.
+
+    Args:
+        classes: The candidate classes.
+        total_duration: The workout duration in minutes.
+        fitness_goals: The user's fitness goals, as class types.
+        favorite_instructors: Names of the user's favorite instructors.
+        class_scores: Optional score for each class ID, such as the score 
+            from `ranking.rank_classes`.
+        n: The number of workouts to return.
+        max_classes: The most classes allowed in a workout.
+
+    Returns:
+        Up to `n` workouts, best first. Longer classes are played first.
+    """
+    goal_slugs = set(discipline_slugs(fitness_goals))
+    favorites = set(favorite_instructors or [])
+    class_scores = class_scores or {}
+
+    classes = [cl for cl in classes if 0 < cl.duration <= total_duration]
+    item_scores = [
+        class_scores.get(cl.id, 0.0) + (INSTRUCTOR_WEIGHT if cl.instructor in favorites else 0.0)
+        for cl in classes
+    ]
+
+    # Each state maps (total minutes, number of classes) to the best partial
+    # workouts as (score, class indices). Iterating over a copy of the
+    # states means every class is used at most once.
+    states = {(0, 0): [(0.0, ())]}
+    for i, cl in enumerate(classes):
+        snapshot = [(state, list(partials)) for state, partials in states.items()]
+        for (minutes, count), partials in snapshot:
+            new_minutes = minutes + cl.duration
+            if new_minutes > total_duration or count >= max_classes:
+                continue
+
+            beam = states.setdefault((new_minutes, count + 1), [])
+            beam.extend((score + item_scores[i], indices + (i,)) for score, indices in partials)
+            if len(beam) > BEAM_WIDTH:
+                beam.sort(key=lambda partial: partial[0], reverse=True)
+                del beam[BEAM_WIDTH:]
+
+    workouts = []
+    for (minutes, count), partials in states.items():
+        if minutes != total_duration or count == 0:
+            continue
+
+        for score, indices in partials:
+            workout = sorted((classes[i] for i in indices), key=lambda cl: cl.duration, reverse=True)
+            workouts.append(WorkoutOption(
+                class_ids=[cl.id for cl in workout],
+                titles=[cl.title for cl in workout],
+                total_duration=minutes,
+                score=round(score + _balance_score(workout, goal_slugs), 3)
+            ))
+
+    workouts.sort(key=lambda workout: workout.score, reverse=True)
+
+    return workouts[:n]
@@ -0,0 +1,113 @@
+"""Startup of a fresh app worker.
+
+`Home.py` draws the page before it imports the agent, so the first paint
+only waits for Streamlit and this module. The rest of the app is imported
+after that, and the modules and clients that aren't needed until the first
+response (openai, pandas and the OpenAI clients) are imported and built on
+a background thread by `warm_up` once the page is drawn.
+
+`IMPORT_BUDGET` is the import time allowed for each stage of the startup.
+`python -m benchmarks.startup` measures the stages in fresh interpreters
+and fails when one is over budget.
+"""
+
+import logging
+import threading
+import time
+from importlib import import_module
+from typing import Dict, Optional, Text
+
+
+# Modules imported before the first paint, by Home.py itself.
+FIRST_PAINT_MODULES = ("streamlit", "startup")
+
+# Modules imported after the first paint to set up the session.
+SESSION_MODULES = (
+    "pydantic_ai.messages",
+    "service",
+    "schemas",
+    "streaming",
+    "interface",
+    "telemetry",
+)
+
+# Modules only needed by the first response or the other pages, imported
+# by `warm_up` in the background.
+DEFERRED_MODULES = (
+    "openai",
+    "pydantic_ai.models.openai",
+    "pandas",
+)
+
+# Seconds each stage of the startup may spend importing, measured by
+# `benchmarks.startup` in a fresh interpreter with warm bytecode caches.
+IMPORT_BUDGET: Dict[Text, float] = {
+    "first_paint": 0.75,
+    "session": 1.0,
+    "deferred": 1.5,
+}
+
+_env_loaded = False
+_warm_up_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def load_env() -> None:
+    """Loads the `.env` file into the environment, once.
+
+    Called before the app modules are imported, since they read their 
+    settings from the environment when they are imported.
+    """
+    global _env_loaded
+
+    with _lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+def _warm_up() -> None:
+    import telemetry
+
+    with telemetry.span("startup.warm_up", kind="startup") as span:
+        start = time.perf_counter()
+        for name in DEFERRED_MODULES:
+            try:
+                import_module(name)
+            except Exception as err:
+                logging.error(f'Error occurred importing {name}. {err}')
+        span.set(import_seconds=round(time.perf_counter() - start, 6))
+
+        try:
+            import agent
+            agent.warm_up()
+        except Exception as err:
+            logging.error(f'Error occurred building the OpenAI clients. {err}')
+
+
+def warm_up() -> threading.Thread:
+    """Imports the deferred modules and builds the clients on a background thread.
+
+    Only the first call starts the thread, later calls return it.
+    """
+    global _warm_up_thread
+
+    with _lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(
+                target=_warm_up,
+                name="peloton-pal-warm-up",
+                daemon=True
+            )
+            _warm_up_thread.start()
+
+    return _warm_up_thread
+
+
+def import_seconds(modules: tuple[str, ...]) -> float:
+    """Imports `modules` and gets the seconds it took, not counting modules already imported."""
+    start = time.perf_counter()
+    for name in modules:
+        import_module(name)
+    return time.perf_counter() - start
@@ -0,0 +1,43 @@
+"""Local SQLite storage shared by the on-disk caches and stores.
+
+Every store keeps its tables in a SQLite database file under `CACHE_DIR`, 
+which defaults to `.cache` in the working directory and can be moved with 
+the `PELOTON_PAL_CACHE_DIR` environment variable.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional, Union
+
+
+CACHE_DIR = Path(os.environ.get("PELOTON_PAL_CACHE_DIR", ".cache"))
+
+
+def connect(name: Union[str, Path], cache_dir: Optional[Path] = None) -> sqlite3.Connection:
+    """Opens a SQLite database in the cache directory.
+
+    The connection can be shared between threads, so callers should 
+    serialize access with a lock.
+
+    Args:
+        name: File name of the database, or ":memory:" for an in-memory 
+            database.
+        cache_dir: Directory for the database file. Defaults to `CACHE_DIR`.
+
+    Returns:
+        The open connection with rows returned as `sqlite3.Row`.
+    """
+    if str(name) == ":memory:":
+        path = ":memory:"
+    else:
+        cache_dir = Path(cache_dir or CACHE_DIR)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        path = cache_dir / name
+
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    return conn
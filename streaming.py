@@ -0,0 +1,124 @@
+"""Streams agent runs as events, to async callers or to a Streamlit script.
+
+Tools report what they are doing through `AgentDeps.progress` and the final
+response text is streamed as it is generated. `astream_agent` yields the
+events on the running loop, i.e. to the HTTP server. `stream_agent` runs
+the agent on the shared runtime loop while the script thread renders, so
+the events are handed over through a thread-safe queue.
+"""
+
+import asyncio
+import queue
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterator, Literal, Optional, TypeVar
+
+import runtime
+import telemetry
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class AgentEvent:
+    """Something that happened during a streamed agent run.
+
+    `progress` events have a description of the tool that is running,
+    `text` events have the response text so far, `done` events have the
+    `StreamedRunResult` and `error` events have the raised exception.
+    """
+    kind: Literal["progress", "text", "done", "error"]
+    content: Any = None
+
+
+async def astream_agent(
+        agent,
+        user_input: str,
+        deps,
+        message_history: Optional[list] = None,
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[AgentEvent]:
+    """Runs the agent and yields its events as they happen.
+
+    Args:
+        agent: The pydantic-ai agent to run.
+        user_input: The user prompt.
+        deps: The `AgentDeps` for the session. Its `events` queue is set for
+            the length of the run.
+        message_history: History of the conversation so far.
+        session_id: ID of the session, set on the run's span so
+            `telemetry.last_trace` can find the session's last run.
+
+    Yields:
+        The events of the run, ending with a `done` or `error` event.
+    """
+    events = asyncio.Queue()
+
+    async def produce():
+        deps.events = events
+        try:
+            # Tools, requests and model turns of the run are nested under this span.
+            with telemetry.span("agent.run", kind="agent") as span:
+                if session_id is not None:
+                    span.set(session=session_id)
+                async with agent.run_stream(
+                    user_input, message_history=message_history, deps=deps
+                ) as result:
+                    async for text in result.stream_text():
+                        events.put_nowait(AgentEvent("text", text))
+            events.put_nowait(AgentEvent("done", result))
+        except Exception as err:
+            events.put_nowait(AgentEvent("error", err))
+        finally:
+            deps.events = None
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            event = await events.get()
+            yield event
+            if event.kind in ("done", "error"):
+                break
+    finally:
+        # The caller stopped listening, i.e. the HTTP client went away.
+        if not task.done():
+            task.cancel()
+
+
+def iterate(aiterator: AsyncIterator[T]) -> Iterator[T]:
+    """Runs an async iterator on the runtime loop and yields its items on this thread."""
+    items = queue.Queue()
+    end = object()
+
+    async def forward():
+        try:
+            async for item in aiterator:
+                items.put(item)
+        finally:
+            items.put(end)
+
+    future = runtime.submit(forward())
+
+    while True:
+        item = items.get()
+        if item is end:
+            # Raises the iterator's exception, if it failed.
+            future.result()
+            break
+        yield item
+
+
+def stream_agent(
+        agent,
+        user_input: str,
+        deps,
+        message_history: Optional[list] = None,
+        session_id: Optional[str] = None
+    ) -> Iterator[AgentEvent]:
+    """Runs the agent on the runtime loop and yields its events as they happen.
+
+    See `astream_agent`.
+    """
+    return iterate(astream_agent(
+        agent, user_input, deps, message_history=message_history, session_id=session_id
+    ))
@@ -0,0 +1,136 @@
+"""Persistent cache of the recent workout summaries.
+
+Summaries are addressed by a hash of everything that goes into the summary
+prompt: the ordered recent class IDs, the rendered workout digest, the user
+preferences and the version of the prompt template. The digest counts days
+back from today, so it changes with the date as well as with new classes.
+Asking for a workout again on the same day before the user has taken a new
+class or changed their preferences then reuses the summary instead of
+another completion. Entries expire after `ttl` seconds and the
+least recently used are evicted once the cache is over `max_entries`.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Text
+
+import storage
+from schemas import RecentUserSummary, UserWorkoutPreferences
+
+
+class SummaryCache:
+    """SQLite backed cache of `RecentUserSummary` results.
+
+    Args:
+        name: File name of the database in the cache directory.
+        ttl: Seconds a summary is reused for.
+        max_entries: Maximum number of summaries kept before the least 
+            recently used are evicted.
+    """
+
+    def __init__(
+            self,
+            name: str = "summaries.sqlite",
+            ttl: float = 24 * 60 * 60,
+            max_entries: int = 1000
+        ):
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = storage.connect(name)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS summaries_last_accessed
+                ON summaries (last_accessed);
+            """
+        )
+
+    @staticmethod
+    def key(
+            recent_class_ids: list[str],
+            preferences: UserWorkoutPreferences,
+            prompt_version: str,
+            digest: str
+        ) -> str:
+        """Builds the cache key for a summary from the inputs to its prompt.
+
+        Args:
+            recent_class_ids: The ride IDs of the recent classes, newest first.
+            preferences: The user workout preferences.
+            prompt_version: Version of the summary prompt template.
+            digest: The workout digest as rendered by `format_digest`.
+        """
+        content = json.dumps(
+            {
+                "recent_class_ids": recent_class_ids,
+                "digest": digest,
+                "preferences": preferences.model_dump(),
+                "prompt_version": prompt_version,
+            },
+            sort_keys=True
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[RecentUserSummary]:
+        """Gets the cached summary, or None if it's missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE summaries SET last_accessed = ? WHERE key = ?", (now, key)
+            )
+
+        return RecentUserSummary.model_validate_json(row["summary"])
+
+    def put(self, key: str, summary: RecentUserSummary) -> None:
+        """Stores a summary and evicts expired and least recently used summaries."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+                (key, summary.model_dump_json(), now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM summaries WHERE created_at <= ?", (now - self.ttl,)
+            )
+            self._conn.execute(
+                """
+                DELETE FROM summaries WHERE key IN (
+                    SELECT key FROM summaries
+                    ORDER BY last_accessed DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+
+    def stats(self) -> Dict[Text, Any]:
+        """Gets the hit and miss counts and number of summaries in the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
@@ -0,0 +1,281 @@
+"""Spans and metrics for the hot paths of the app.
+
+Peloton requests, agent tools, model turns and summary completions are
+wrapped in spans that record how long they took, how they ended and
+attributes such as payload sizes, retries and token usage. Spans started
+inside another span, in the same task or a task it started, are linked to
+it so a slow suggestion can be broken down into its tools and requests.
+
+Finished spans are kept in memory for the debug panel, aggregated into
+metrics that `prometheus_snapshot` renders in the Prometheus text format
+and, with `PELOTON_PAL_TRACE_LOG` set, logged as one JSON object per line.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+from typing import Any, Dict, Iterator, Optional, Text
+
+
+# Log every finished span as JSON.
+LOG_SPANS = os.environ.get("PELOTON_PAL_TRACE_LOG", "").lower() in ("1", "true")
+
+# Number of finished spans kept for the debug panel.
+MAX_SPANS = 1000
+
+# Upper bounds of the span duration histogram buckets, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Span attributes that are also summed into counters, by counter name.
+COUNTED_ATTRIBUTES = {
+    "request_bytes": ("peloton_pal_payload_bytes_total", {"direction": "request"}),
+    "response_bytes": ("peloton_pal_payload_bytes_total", {"direction": "response"}),
+    "retries": ("peloton_pal_retries_total", {}),
+    "prompt_tokens": ("peloton_pal_tokens_total", {"type": "prompt"}),
+    "completion_tokens": ("peloton_pal_tokens_total", {"type": "completion"}),
+}
+
+logger = logging.getLogger("peloton_pal.telemetry")
+
+
+@dataclass
+class Span:
+    """A timed operation, such as an HTTP request or a tool call."""
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    duration: Optional[float] = None
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[Text, Any] = field(default_factory=dict)
+
+    def set(self, **attributes) -> None:
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        """Gets the seconds since the span started."""
+        return time.time() - self.start
+
+    def to_dict(self) -> Dict[Text, Any]:
+        return asdict(self)
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "peloton_pal_span", default=None
+)
+
+
+class Telemetry:
+    """Keeps the recent spans and aggregates them into metrics.
+
+    Args:
+        max_spans: Number of finished spans kept.
+    """
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        # Histogram of the durations by (kind, name): bucket counts, sum and count.
+        self._durations = {}
+        self._errors = Counter()
+        self._counters = Counter()
+
+    def record(self, span: Span) -> None:
+        """Stores a finished span and adds it to the metrics."""
+        key = (span.kind, span.name)
+        with self._lock:
+            self._spans.append(span)
+
+            buckets, total, count = self._durations.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    buckets[i] += 1
+            self._durations[key] = (buckets, total + span.duration, count + 1)
+
+            if span.status == "error":
+                self._errors[key] += 1
+
+            for attribute, (metric, labels) in COUNTED_ATTRIBUTES.items():
+                value = span.attributes.get(attribute)
+                if value:
+                    self._counters[(metric, *key, *sorted(labels.items()))] += value
+
+        if LOG_SPANS:
+            logger.info(json.dumps(span.to_dict(), default=str))
+
+    def spans(self, limit: Optional[int] = None) -> list[Span]:
+        """Gets the most recent finished spans, oldest first."""
+        with self._lock:
+            spans = list(self._spans)
+        return spans[-limit:] if limit else spans
+
+    def clear(self) -> None:
+        """Forgets the spans and resets the metrics."""
+        with self._lock:
+            self._spans.clear()
+            self._durations.clear()
+            self._errors.clear()
+            self._counters.clear()
+
+    def prometheus(self) -> str:
+        """Renders the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            durations = dict(self._durations)
+            errors = dict(self._errors)
+            counters = dict(self._counters)
+
+        lines = [
+            "# HELP peloton_pal_span_duration_seconds Duration of the traced operations.",
+            "# TYPE peloton_pal_span_duration_seconds histogram",
+        ]
+        for (kind, name), (buckets, total, count) in sorted(durations.items()):
+            labels = _labels(kind=kind, name=name)
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                lines.append(
+                    f"peloton_pal_span_duration_seconds_bucket{_labels(kind=kind, name=name, le=bound)} {bucket_count}"
+                )
+            lines.append(f'peloton_pal_span_duration_seconds_bucket{_labels(kind=kind, name=name, le="+Inf")} {count}')
+            lines.append(f"peloton_pal_span_duration_seconds_sum{labels} {total:.6f}")
+            lines.append(f"peloton_pal_span_duration_seconds_count{labels} {count}")
+
+        lines.extend([
+            "# HELP peloton_pal_span_errors_total Traced operations that raised an error.",
+            "# TYPE peloton_pal_span_errors_total counter",
+        ])
+        for (kind, name), count in sorted(errors.items()):
+            lines.append(f"peloton_pal_span_errors_total{_labels(kind=kind, name=name)} {count}")
+
+        helps = {
+            "peloton_pal_payload_bytes_total": "Bytes sent and received by the traced operations.",
+            "peloton_pal_retries_total": "Retries made by the traced operations.",
+            "peloton_pal_tokens_total": "Model tokens used by the traced operations.",
+        }
+        for metric, help_text in helps.items():
+            lines.extend([f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"])
+            for (counter, kind, name, *labels), value in sorted(counters.items()):
+                if counter == metric:
+                    lines.append(f"{metric}{_labels(kind=kind, name=name, **dict(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels) -> str:
+    def escape(value: Any) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+registry = Telemetry()
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes) -> Iterator[Span]:
+    """Times the body of a `with` block as a span.
+
+    Args:
+        name: Name of the operation, i.e. "GET /api/instructor". Spans with
+            the same kind and name are aggregated together.
+        kind: What the operation is, i.e. "http", "tool" or "llm".
+        attributes: Attributes to start the span with. More can be added
+            with `Span.set`.
+
+    Yields:
+        The span.
+    """
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        kind=kind,
+        trace_id=parent.trace_id if parent else uuid.uuid4().hex[:16],
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes
+    )
+    token = _current_span.set(current)
+    start = time.perf_counter()
+
+    try:
+        yield current
+    except BaseException as err:
+        current.status = "error"
+        current.error = f"{type(err).__name__}: {err}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        registry.record(current)
+
+
+def traced(kind: str, name: Optional[str] = None):
+    """Records every call of a function or coroutine function as a span.
+
+    Args:
+        kind: What the function does, i.e. "tool".
+        name: Name of the spans. Defaults to the function's qualified name.
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(span_name, kind):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(span_name, kind):
+                    return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_span() -> Optional[Span]:
+    """Gets the innermost span of the running task, if there is one."""
+    return _current_span.get()
+
+
+def recent_spans(limit: Optional[int] = None) -> list[Span]:
+    """Gets the most recent finished spans, oldest first."""
+    return registry.spans(limit)
+
+
+def last_trace(kind: str = "agent", session: Optional[str] = None) -> list[Span]:
+    """Gets the spans of the most recent trace whose root is of `kind`, i.e. the last agent run.
+
+    Args:
+        kind: Kind of the root span.
+        session: Only consider traces whose root span has this `session`
+            attribute, i.e. the runs of one session.
+    """
+    spans = registry.spans()
+    for candidate in reversed(spans):
+        if (
+            candidate.kind == kind
+            and candidate.parent_id is None
+            and (session is None or candidate.attributes.get("session") == session)
+        ):
+            return [s for s in spans if s.trace_id == candidate.trace_id]
+    return []
+
+
+def prometheus_snapshot() -> str:
+    """Renders the metrics in the Prometheus text exposition format."""
+    return registry.prometheus()
@@ -0,0 +1,10 @@
+import pytest
+
+import storage
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keeps the stores of each test in its own cache directory."""
+    monkeypatch.setattr(storage, "CACHE_DIR", tmp_path)
+    return tmp_path
@@ -0,0 +1,92 @@
+import pytest
+import requests
+from requests.cookies import create_cookie
+
+import auth
+from peloton import PelotonAPI
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, user_id: str = ""):
+        self.status_code = status_code
+        self.ok = status_code == 200
+        self._user_id = user_id
+
+    def raise_for_status(self) -> None:
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Client Error", response=self)
+
+    def json(self) -> dict:
+        return {"user_id": self._user_id}
+
+
+class FakePeloton:
+    """Stands in for the Peloton login and records the accounts that logged in."""
+
+    def __init__(self, password: str):
+        self.password = password
+        self.logins = []
+
+    def authenticate(self, api: PelotonAPI) -> FakeResponse:
+        self.logins.append(api.username)
+        if api.password != self.password:
+            return FakeResponse(401)
+        api.sess.cookies.set_cookie(create_cookie("peloton_session_id", f"session-{len(self.logins)}"))
+        return FakeResponse(200, f"id-{api.username.lower()}")
+
+
+@pytest.fixture
+def peloton(monkeypatch):
+    peloton = FakePeloton("old password")
+    monkeypatch.setattr(PelotonAPI, "authenticate", lambda api: peloton.authenticate(api))
+    return peloton
+
+
+def test_saved_session_is_reused_after_a_restart(peloton, tmp_path):
+    session = auth.SessionManager(session_dir=tmp_path).get("Bob", "old password")
+
+    restored = auth.SessionManager(session_dir=tmp_path).get("bob", "old password")
+
+    assert peloton.logins == ["Bob"]
+    assert restored.user_id == session.user_id
+    assert restored.api.sess.cookies.get("peloton_session_id") == "session-1"
+
+
+def test_usernames_share_one_session_regardless_of_case(peloton, tmp_path):
+    manager = auth.SessionManager(session_dir=tmp_path)
+
+    assert manager.get("Bob", "old password") is manager.get("bob", "old password")
+    assert peloton.logins == ["Bob"]
+
+
+def test_wrong_password_is_not_given_the_session(peloton, tmp_path):
+    manager = auth.SessionManager(session_dir=tmp_path)
+    session = manager.get("bob", "old password")
+
+    with pytest.raises(requests.HTTPError):
+        manager.get("bob", "wrong password")
+    assert manager.get("bob", "old password") is session
+
+    # Nor the saved session after a restart.
+    with pytest.raises(requests.HTTPError):
+        auth.SessionManager(session_dir=tmp_path).get("bob", "wrong password")
+    assert peloton.logins == ["bob", "bob", "bob"]
+
+
+def test_changed_password_logs_in_again_and_replaces_the_saved_hash(peloton, tmp_path):
+    auth.SessionManager(session_dir=tmp_path).get("bob", "old password")
+    peloton.password = "new password"
+
+    manager = auth.SessionManager(session_dir=tmp_path)
+    session = manager.get("bob", "new password")
+    assert peloton.logins == ["bob", "bob"]
+    assert auth._check_password("new password", session.password_hash)
+    assert not auth._check_password("old password", session.password_hash)
+
+    # The new password's session is restored without logging in, the old one isn't.
+    restored = auth.SessionManager(session_dir=tmp_path)
+    restored.get("bob", "new password")
+    with pytest.raises(requests.HTTPError):
+        restored.get("bob", "old password")
+    assert peloton.logins == ["bob", "bob", "bob"]
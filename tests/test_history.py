@@ -0,0 +1,66 @@
+import asyncio
+from typing import Optional
+
+from history import WorkoutHistory
+
+
+def make_workout(number: int) -> dict:
+    return {
+        "id": f"w{number}",
+        "created_at": number,
+        "start_time": number,
+        "fitness_discipline": "cycling",
+        "name": "Cycling Workout",
+        "ride": {"id": f"r{number}", "title": f"Ride {number}", "duration": 1200},
+    }
+
+
+class FakeAPI:
+    """Serves a user's workouts newest first, a page at a time."""
+
+    def __init__(self, count: int, failing_page: Optional[int] = None):
+        self.count = count
+        self.failing_page = failing_page
+        self.pages = []
+
+    async def get_user_workouts(self, user_id: str, page: int = 0, limit: int = 20):
+        self.pages.append(page)
+        if page == self.failing_page:
+            return None
+
+        numbers = list(range(self.count, 0, -1))[page * limit:(page + 1) * limit]
+        return {
+            "data": [make_workout(number) for number in numbers],
+            "show_next": (page + 1) * limit < self.count,
+        }
+
+
+def test_sync_stops_at_the_first_stored_workout():
+    history = WorkoutHistory(page_size=5)
+    assert asyncio.run(history.sync(FakeAPI(count=12), "user")) == 12
+
+    # Three new workouts fit on the first page, so only that page is requested.
+    api = FakeAPI(count=15)
+    assert asyncio.run(history.sync(api, "user")) == 3
+    assert api.pages == [0]
+    assert len(history.between("user")) == 15
+
+
+def test_failed_page_stores_nothing_so_the_next_sync_fetches_everything():
+    history = WorkoutHistory(page_size=5)
+    asyncio.run(history.sync(FakeAPI(count=5), "user"))
+
+    assert asyncio.run(history.sync(FakeAPI(count=17, failing_page=1), "user")) == 0
+    assert len(history.between("user")) == 5
+
+    assert asyncio.run(history.sync(FakeAPI(count=17), "user")) == 12
+    assert len(history.between("user")) == 17
+
+
+def test_unreadable_workouts_are_skipped():
+    history = WorkoutHistory()
+    broken = make_workout(2)
+    del broken["ride"]
+
+    assert history.add("user", [make_workout(1), broken, make_workout(3)]) == 2
+    assert {workout["id"] for workout in history.between("user")} == {"w1", "w3"}
@@ -0,0 +1,43 @@
+from schemas import PelotonClass
+from solver import compose_workouts
+
+
+def make_class(id: str, duration: int, fitness_discipline: str = "cycling") -> PelotonClass:
+    return PelotonClass(
+        id=id,
+        title=f"{duration} min {fitness_discipline}",
+        description="",
+        duration=duration,
+        difficulty=5.0,
+        fitness_discipline=fitness_discipline,
+        instructor="Instructor"
+    )
+
+
+def test_workouts_use_distinct_classes_adding_up_to_the_duration():
+    # Classes of the same length share solver states, which is where a
+    # class used to be added to the same workout twice.
+    classes = [
+        make_class(f"c{i}", duration, discipline)
+        for i, (duration, discipline) in enumerate([
+            (5, "stretching"), (10, "strength"), (10, "yoga"), (15, "cycling"),
+            (20, "cycling"), (5, "cardio"), (15, "strength"), (10, "cycling"),
+        ])
+    ]
+
+    for total_duration in (15, 20, 30, 45):
+        # Every workout, not just the best, since repeats score lower.
+        workouts = compose_workouts(classes, total_duration, fitness_goals=["Cycling"], n=1000)
+
+        assert workouts
+        durations = {cl.id: cl.duration for cl in classes}
+        for workout in workouts:
+            assert len(set(workout.class_ids)) == len(workout.class_ids)
+            assert sum(durations[class_id] for class_id in workout.class_ids) == total_duration
+            assert workout.total_duration == total_duration
+
+
+def test_no_workouts_when_the_duration_cannot_be_reached():
+    classes = [make_class("c0", 20), make_class("c1", 45)]
+
+    assert compose_workouts(classes, 30) == []
@@ -0,0 +1,59 @@
+import datetime
+
+from analytics import build_digest, format_digest
+from schemas import RecentUserSummary, UserWorkoutPreferences
+from summary_cache import SummaryCache
+
+
+PREFERENCES = UserWorkoutPreferences(fitness_goals=["Cycling"])
+
+
+def digest_on(today: datetime.date) -> str:
+    """Renders the digest of a single workout taken on 2026-10-01, as seen on `today`."""
+    workout = {
+        "start_time": datetime.datetime(2026, 10, 1, 18).timestamp(),
+        "fitness_discipline": "cycling",
+        "instructor_id": None,
+        "instructor": "Alex",
+        "duration": 1800,
+        "difficulty": 6.5,
+    }
+    return format_digest(build_digest([workout], PREFERENCES, today=today))
+
+
+def test_summary_is_reused_while_the_prompt_inputs_are_unchanged():
+    cache = SummaryCache()
+    digest = digest_on(datetime.date(2026, 10, 2))
+    key = SummaryCache.key(["r1"], PREFERENCES, "v1", digest)
+    summary = RecentUserSummary(recent_class_ids=["r1"], summary="One ride this week.")
+
+    cache.put(key, summary)
+
+    assert cache.get(SummaryCache.key(["r1"], PREFERENCES, "v1", digest)) == summary
+    assert cache.stats()["hits"] == 1
+
+
+def test_summary_expires_when_the_digest_changes_with_the_date():
+    cache = SummaryCache()
+    summary = RecentUserSummary(recent_class_ids=["r1"], summary="Last workout yesterday.")
+    cache.put(SummaryCache.key(["r1"], PREFERENCES, "v1", digest_on(datetime.date(2026, 10, 2))), summary)
+
+    # Same classes and preferences, but the days since the last workout moved on.
+    later = digest_on(datetime.date(2026, 10, 6))
+
+    assert cache.get(SummaryCache.key(["r1"], PREFERENCES, "v1", later)) is None
+
+
+def test_summary_expires_when_classes_or_preferences_change():
+    cache = SummaryCache()
+    digest = digest_on(datetime.date(2026, 10, 2))
+    cache.put(
+        SummaryCache.key(["r1"], PREFERENCES, "v1", digest),
+        RecentUserSummary(recent_class_ids=["r1"], summary="One ride.")
+    )
+
+    assert cache.get(SummaryCache.key(["r2", "r1"], PREFERENCES, "v1", digest)) is None
+    assert cache.get(SummaryCache.key(
+        ["r1"], UserWorkoutPreferences(fitness_goals=["Yoga"]), "v1", digest
+    )) is None
+    assert cache.get(SummaryCache.key(["r1"], PREFERENCES, "v2", digest)) is None
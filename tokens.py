@@ -0,0 +1,20 @@
+"""Token estimates for prompts and messages.
+
+The estimates are used to keep prompts inside a budget before they are
+sent, so they only need to be close. English text and JSON average about
+four characters per token with the OpenAI tokenizers.
+"""
+
+import math
+
+
+# Average number of characters in a token.
+CHARS_PER_TOKEN = 4
+
+# Tokens the chat format adds around each message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens in a piece of text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
@@ -0,0 +1,104 @@
+"""A pydantic-ai model wrapper that records every model turn as a span.
+
+`TracedModel` wraps the agent's model so each request made during a run,
+streamed or not, is timed as an "llm" span with its token usage, nested
+under the span of the tool call or agent run that made it.
+
+The wrapped model can be given by name, i.e. "openai:gpt-4o-mini", in which
+case it isn't built, and its client library isn't imported, until it is
+first used.
+"""
+
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Union
+
+from pydantic_ai.messages import Message, ModelAnyResponse
+from pydantic_ai.models import AgentModel, EitherStreamedResponse, Model, infer_model
+from pydantic_ai.result import Cost
+from pydantic_ai.tools import ToolDefinition
+
+import telemetry
+
+
+def _record_cost(span: telemetry.Span, cost: Optional[Cost]) -> None:
+    if cost is not None:
+        span.set(prompt_tokens=cost.request_tokens or 0, completion_tokens=cost.response_tokens or 0)
+
+
+class TracedAgentModel(AgentModel):
+    """Times the requests of a wrapped agent model."""
+
+    def __init__(self, wrapped: AgentModel, model_name: str):
+
+        self.wrapped = wrapped
+        self.model_name = model_name
+
+    async def request(self, messages: list[Message]) -> tuple[ModelAnyResponse, Cost]:
+        with telemetry.span(f"model {self.model_name}", kind="llm", messages=len(messages)) as span:
+            response, cost = await self.wrapped.request(messages)
+            _record_cost(span, cost)
+            span.set(response=response.role)
+
+        return response, cost
+
+    @asynccontextmanager
+    async def request_stream(self, messages: list[Message]) -> AsyncIterator[EitherStreamedResponse]:
+        with telemetry.span(
+            f"model {self.model_name}", kind="llm", messages=len(messages), stream=True
+        ) as span:
+            async with self.wrapped.request_stream(messages) as response:
+                # The wrapped model waits for the first chunk before returning.
+                span.set(first_response_seconds=round(span.elapsed(), 6))
+                try:
+                    yield response
+                finally:
+                    _record_cost(span, response.cost())
+
+
+class TracedModel(Model):
+    """Records the requests the agent makes to `model` as "llm" spans.
+
+    Args:
+        model: The model to wrap, i.e. an `OpenAIModel`, or the name of one 
+            to build on first use, i.e. "openai:gpt-4o-mini".
+    """
+
+    def __init__(self, model: Union[Model, str]):
+
+        self._model = model if isinstance(model, Model) else None
+        self._model_name = model.name() if isinstance(model, Model) else model
+        self._lock = threading.Lock()
+
+    def build(self) -> Model:
+        """Builds the wrapped model if it was given by name, and gets it.
+
+        Building an OpenAI model imports openai and creates its client.
+        """
+        with self._lock:
+            if self._model is None:
+                self._model = infer_model(self._model_name)
+
+        return self._model
+
+    @property
+    def model(self) -> Model:
+        """The wrapped model, built on first use if it was given by name."""
+        return self.build()
+
+    async def agent_model(
+            self,
+            *,
+            function_tools: list[ToolDefinition],
+            allow_text_result: bool,
+            result_tools: list[ToolDefinition]
+        ) -> AgentModel:
+        wrapped = await self.model.agent_model(
+            function_tools=function_tools,
+            allow_text_result=allow_text_result,
+            result_tools=result_tools
+        )
+        return TracedAgentModel(wrapped, self._model_name)
+
+    def name(self) -> str:
+        return self._model_name